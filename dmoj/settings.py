@@ -297,6 +297,24 @@ DATABASES = {
 BRIDGED_JUDGE_ADDRESS = [('localhost', 9999)]
 BRIDGED_DJANGO_ADDRESS = [('localhost', 9998)]
 BRIDGED_DJANGO_CONNECT = None
+# Serves bridge metrics in the Prometheus text format over HTTP, e.g. ('localhost', 9994).
+BRIDGED_METRICS_ADDRESS = None
+# Path of a journal that keeps queued submissions across bridge restarts, e.g. '/var/lib/dmoj/bridge-queue.journal'.
+BRIDGED_QUEUE_JOURNAL = None
+# Queued submissions are judged in order of priority, then arrival. Set this to 'fair-share' to interleave users and
+# contests with many submissions queued, tuned by BRIDGED_SCHEDULING_OPTIONS, e.g. {'user_interval': 10}.
+BRIDGED_SCHEDULING_POLICY = 'priority'
+# Submissions go to the idle judge reporting the least load. Set this to 'score' to also weigh ping latency, past
+# speed on the language and recently judged problems, tuned by BRIDGED_JUDGE_SELECTOR_OPTIONS, e.g.
+# {'latency_weight': 5.0}. `manage.py simulate_judge_selection` compares the two on simulated judges.
+BRIDGED_JUDGE_SELECTOR = 'least-load'
+# To run the bridge as several shards, list each shard's addresses here and start `runbridged --shard <index>` for
+# each, e.g. {'judge_address': [('localhost', 9999)], 'django_address': [('localhost', 9998)]}, optionally with
+# 'django_connect', 'queue_journal' and 'metrics_address'. Judges connect to the judge address of their shard.
+# Shards with idle judges steal queued submissions from each other, waiting up to BRIDGED_SHARD_TIMEOUT (5) seconds
+# for the other shard. Stolen submissions that are not confirmed within BRIDGED_SHARD_HANDOFF_TIMEOUT (30) seconds
+# are queued again on the shard they were stolen from.
+BRIDGED_SHARDS = []
 
 # Event Server configuration
 EVENT_DAEMON_USE = False
@@ -304,6 +322,9 @@ EVENT_DAEMON_POST = 'ws://localhost:9997/'
 EVENT_DAEMON_GET = 'ws://localhost:9996/'
 EVENT_DAEMON_POLL = '/channels/'
 EVENT_DAEMON_KEY = None
+# The bridge posts events from a background thread, up to this many per frame, with at most this many waiting.
+EVENT_DAEMON_BATCH_SIZE = 100
+EVENT_DAEMON_QUEUE_SIZE = 10000
 EVENT_DAEMON_SUBMISSION_KEY = '6Sdmkx^%pk@GsifDfXcwX*Y7LRF%RGT8vmFpSxFBT$fwS7trc8raWfN#CSfQuKApx&$B#Gh2L7p%W!Ww'
 
 # Internationalization
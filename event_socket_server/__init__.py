@@ -4,7 +4,10 @@ from .handler import Handler
 from .helpers import ProxyProtocolMixin, SizedPacketHandler, ZlibPacketHandler
 
 
-def get_preferred_engine(choices=('epoll', 'poll', 'select')):
+DEFAULT_ENGINES = ('epoll', 'poll', 'select')
+
+
+def get_preferred_engine(choices=DEFAULT_ENGINES):
     for choice in choices:
         if choice in engines:
             return engines[choice]
@@ -37,6 +37,8 @@ class ScheduledJob(object):
 
 
 class BaseServer(object):
+    read_size = 65536
+
     def __init__(self, addresses, client):
         self._servers = set()
         for address, port in addresses:
@@ -54,6 +56,7 @@ class BaseServer(object):
         self._send_queue = defaultdict(deque)
         self._job_queue = []
         self._job_queue_lock = threading.Lock()
+        self._read_view = memoryview(bytearray(self.read_size))
 
     def _serve(self):
         raise NotImplementedError()
@@ -114,17 +117,19 @@ class BaseServer(object):
         return dt
 
     def _nonblock_read(self, client):
+        # Reads go straight into a buffer owned by the server, and handlers are passed a view of it that is only
+        # valid during the call.
         try:
-            data = client._socket.recv(1024)
+            size = client._socket.recv_into(self._read_view)
         except socket.error:
             self._clean_up_client(client)
         else:
-            logger.debug('Read from %s: %d bytes', client.client_address, len(data))
-            if not data:
+            logger.debug('Read from %s: %d bytes', client.client_address, size)
+            if not size:
                 self._clean_up_client(client)
             else:
                 try:
-                    client._recv_data(data)
+                    client._recv_data(self._read_view[:size])
                 except Exception:
                     logger.exception('Client recv_data failure')
                     self._clean_up_client(client)
@@ -135,6 +140,7 @@ class BaseServer(object):
         try:
             top = queue[0]
             cb = client._socket.send(top.data)
+            # Slicing a memoryview does not copy what is left to send.
             top.data = top.data[cb:]
             logger.debug('Send to %s: %d bytes', client.client_address, cb)
             if not top.data:
@@ -156,7 +162,7 @@ class BaseServer(object):
 
     def send(self, client, data, callback=None):
         logger.debug('Writing %d bytes to client %s, callback: %s', len(data), client.client_address, callback)
-        self._send_queue[client.fileno()].append(SendMessage(data, callback))
+        self._send_queue[client.fileno()].append(SendMessage(memoryview(data), callback))
         self._register_write(client)
 
     def stop(self):
@@ -14,4 +14,7 @@ if hasattr(select, 'epoll'):
     from .epoll_server import EpollServer
     engines['epoll'] = EpollServer
 
+from .asyncio_server import AsyncioServer  # noqa: E402
+engines['asyncio'] = AsyncioServer
+
 del select
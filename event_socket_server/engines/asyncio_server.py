@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ..base_server import BaseServer, ScheduledJob
+
+logger = logging.getLogger('event_socket_server')
+
+
+class _Lane(object):
+    """A queue of calls that run in order on the worker pool, one at a time."""
+    __slots__ = ('calls', 'running')
+
+    def __init__(self):
+        self.calls = deque()
+        self.running = False
+
+
+class _ClientProtocol(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.client = None
+
+    def connection_made(self, transport):
+        self.client = self.server._connection_made(transport)
+
+    def data_received(self, data):
+        self.server._data_received(self.client, data)
+
+    def connection_lost(self, exc):
+        if self.client is not None:
+            self.server._run(self.client.lane, self.server._clean_up_client, self.client)
+
+
+class AsyncioServer(BaseServer):
+    """
+    An engine built on asyncio transports. The event loop only moves bytes: packet handling, write callbacks and
+    scheduled jobs run on a bounded pool of worker threads, so blocking work such as database queries for one
+    client cannot stall every other client. Calls for the same client run in order, one at a time, as they would on
+    a single threaded engine.
+    """
+    workers = 8
+    lag_interval = 0.5
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncioServer, self).__init__(*args, **kwargs)
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._lane_lock = threading.Lock()
+        self._jobs = _Lane()
+        self._backlog = 0
+        self._lag = deque(maxlen=120)
+        self._listeners = []
+
+    def _run(self, lane, func, *args):
+        with self._lane_lock:
+            lane.calls.append((func, args))
+            self._backlog += 1
+            if lane.running:
+                return
+            lane.running = True
+        try:
+            self._executor.submit(self._drain, lane)
+        except RuntimeError:
+            # The server has shut down.
+            pass
+
+    def _drain(self, lane):
+        while True:
+            with self._lane_lock:
+                if not lane.calls:
+                    lane.running = False
+                    return
+                func, args = lane.calls.popleft()
+                self._backlog -= 1
+            try:
+                func(*args)
+            except Exception:
+                logger.exception('Error in worker call: %r', func)
+
+    def _connection_made(self, transport):
+        client = self._ClientClass(self, transport.get_extra_info('socket'))
+        client.transport = transport
+        client.lane = _Lane()
+        with self._lane_lock:
+            self._clients.add(client)
+        return client
+
+    def _data_received(self, client, data):
+        self._run(client.lane, self._recv_data, client, data)
+
+    def _recv_data(self, client, data):
+        if client not in self._clients:
+            return
+        logger.debug('Read from %s: %d bytes', client.client_address, len(data))
+        try:
+            client._recv_data(data)
+        except Exception:
+            logger.exception('Client recv_data failure')
+            self._clean_up_client(client)
+
+    def _clean_up_client(self, client, finalize=False):
+        with self._lane_lock:
+            if client not in self._clients:
+                return
+            if not finalize:
+                self._clients.remove(client)
+        try:
+            client.on_close()
+        finally:
+            self._loop.call_soon_threadsafe(client.transport.close)
+
+    def schedule(self, delay, func, *args, **kwargs):
+        job = ScheduledJob(time.time() + delay, func, args, kwargs)
+        self._loop.call_soon_threadsafe(self._loop.call_later, max(delay, 0),
+                                        self._run, self._jobs, self._dispatch, job)
+        return job
+
+    def _dispatch(self, job):
+        with self._job_queue_lock:
+            if job.cancel:
+                return
+            job.dispatched = True
+        logger.debug('Dispatching event: %r(*%r, **%r)', job.func, job.args, job.kwargs)
+        job.func(*job.args, **job.kwargs)
+
+    def send(self, client, data, callback=None):
+        logger.debug('Writing %d bytes to client %s, callback: %s', len(data), client.client_address, callback)
+        self._loop.call_soon_threadsafe(self._write, client, data, callback)
+
+    def _write(self, client, data, callback):
+        if client.transport.is_closing():
+            return
+        client.transport.write(data)
+        if callback is not None:
+            # The transport flushes what it has buffered before it closes, which is what callbacks rely on.
+            self._run(client.lane, self._callback, client, callback)
+
+    def _callback(self, client, callback):
+        try:
+            callback()
+        except Exception:
+            logger.exception('Client write callback failure')
+            self._clean_up_client(client)
+
+    async def _measure_lag(self):
+        while True:
+            start = self._loop.time()
+            await asyncio.sleep(self.lag_interval)
+            self._lag.append(max(self._loop.time() - start - self.lag_interval, 0))
+
+    def loop_stats(self):
+        """Event loop lag over the last minute, in seconds, and the calls waiting for a worker."""
+        lag = list(self._lag)
+        return {
+            'lag_last': lag[-1] if lag else 0,
+            'lag_mean': sum(lag) / len(lag) if lag else 0,
+            'lag_max': max(lag) if lag else 0,
+            'clients': len(self._clients),
+            'backlog': self._backlog,
+        }
+
+    def stop(self):
+        super(AsyncioServer, self).stop()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _serve(self):
+        asyncio.set_event_loop(self._loop)
+        for sock in self._servers:
+            self._listeners.append(self._loop.run_until_complete(
+                self._loop.create_server(lambda: _ClientProtocol(self), sock=sock, backlog=16)))
+        lag = self._loop.create_task(self._measure_lag())
+        try:
+            if not self._stop.is_set():
+                self._loop.run_forever()
+        finally:
+            logger.info('Shutting down server')
+            # Stop taking packets and let the lanes drain before the server flushes what they wrote.
+            for listener in self._listeners:
+                listener.close()
+            with self._lane_lock:
+                clients = list(self._clients)
+            for client in clients:
+                client.transport.pause_reading()
+            self._executor.shutdown(wait=True)
+            for client in clients:
+                self._clean_up_client(client, True)
+            self.on_shutdown()
+            lag.cancel()
+            self._loop.run_until_complete(asyncio.sleep(0))
+            self._loop.close()
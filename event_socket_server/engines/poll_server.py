@@ -87,9 +87,10 @@ class PollServer(BaseServer):
                                     self._nonblock_write(client)
         finally:
             logger.info('Shutting down server')
-            self.on_shutdown()
+            # Clients close first so that whatever their on_close writes is still flushed by on_shutdown.
             for client in self._clients:
                 self._clean_up_client(client, True)
+            self.on_shutdown()
             for fd, sock in self._server_fds.items():
                 self._poll.unregister(fd)
                 sock.close()
@@ -42,8 +42,8 @@ class SelectServer(BaseServer):
                     else:
                         self._clean_up_client(s)
         finally:
-            self.on_shutdown()
             for client in self._clients:
                 self._clean_up_client(client, True)
+            self.on_shutdown()
             for server in self._servers:
                 server.close()
@@ -10,7 +10,7 @@ size_pack = struct.Struct('!I')
 class SizedPacketHandler(Handler):
     def __init__(self, server, socket):
         super(SizedPacketHandler, self).__init__(server, socket)
-        self._buffer = b''
+        self._buffer = bytearray()
         self._packetlen = 0
 
     def _packet(self, data):
@@ -20,17 +20,29 @@ class SizedPacketHandler(Handler):
         return data
 
     def _recv_data(self, data):
-        self._buffer += data
-        while len(self._buffer) >= self._packetlen if self._packetlen else len(self._buffer) >= size_pack.size:
-            if self._packetlen:
-                data = self._buffer[:self._packetlen]
-                self._buffer = self._buffer[self._packetlen:]
-                self._packetlen = 0
-                self._packet(data)
-            else:
-                data = self._buffer[:size_pack.size]
-                self._buffer = self._buffer[size_pack.size:]
-                self._packetlen = size_pack.unpack(data)[0]
+        # Data is appended to a growable buffer, and complete packets are cut out of it by offset. The consumed
+        # prefix is dropped once per read, so large packets arriving in many small reads stay linear.
+        buffer = self._buffer
+        buffer += data
+        offset = 0
+        try:
+            while True:
+                if self._packetlen:
+                    if len(buffer) - offset < self._packetlen:
+                        break
+                    end = offset + self._packetlen
+                    with memoryview(buffer) as view:
+                        data = view[offset:end].tobytes()
+                    offset = end
+                    self._packetlen = 0
+                    self._packet(data)
+                else:
+                    if len(buffer) - offset < size_pack.size:
+                        break
+                    self._packetlen = size_pack.unpack_from(buffer, offset)[0]
+                    offset += size_pack.size
+        finally:
+            del buffer[:offset]
 
     def send(self, data, callback=None):
         data = self._format_send(data)
@@ -112,7 +124,11 @@ class ProxyProtocolMixin(object):
     def _recv_data(self, data):
         if self.__type == self.__DATA:
             super(ProxyProtocolMixin, self)._recv_data(data)
-        elif self.__type == self.__UNKNOWN_TYPE:
+            return
+
+        # The header is parsed as bytes, while the server may pass a view of its read buffer.
+        data = bytes(data)
+        if self.__type == self.__UNKNOWN_TYPE:
             if len(data) >= 16 and data[:self.__HEADER2_LEN] == self.__HEADER2:
                 self.close()
             elif len(data) >= 8 and data[:5] == b'PROXY':
@@ -1,6 +1,9 @@
+import base64
 import ctypes
+import os
 import socket
 import struct
+import threading
 import time
 import zlib
 
@@ -36,15 +39,79 @@ def random(length):
     return buf.raw
 
 
+def read_frame(sock):
+    def read(size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(min(size - len(data), 1048576))
+            if not chunk:
+                raise EOFError('Connection closed')
+            data += chunk
+        return bytes(data)
+    return read(size_pack.unpack(read(size_pack.size))[0])
+
+
+def benchmark(connections, packets, size):
+    # Every connection pipelines its packets to the echo server while a second thread reads the echoes back.
+    # Payloads are random, so compression barely shrinks them and the server has to frame the full size.
+    payload = base64.b64encode(os.urandom(size * 3 // 4)).decode('ascii')
+    frame = zlibify(payload)
+    errors = []
+
+    def run():
+        sock = open_connection()
+
+        def send():
+            try:
+                for i in range(packets):
+                    sock.sendall(frame)
+            except socket.error as e:
+                errors.append(str(e))
+
+        sender = threading.Thread(target=send)
+        sender.start()
+        try:
+            for i in range(packets):
+                if dezlibify(read_frame(sock), False) != payload:
+                    errors.append('Echo does not match')
+        except (EOFError, socket.error) as e:
+            errors.append(str(e))
+        sender.join()
+        sock.close()
+
+    start = time.time()
+    threads = [threading.Thread(target=run) for i in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    total = connections * packets * len(frame)
+    print('%d connections x %d packets of %d bytes: %.2fs, %.1f packets/s, %.1f MB/s each way' % (
+        connections, packets, len(frame), elapsed, connections * packets / elapsed, total / elapsed / 1e6))
+    if errors:
+        print('%d errors, first: %s' % (len(errors), errors[0]))
+
+
 def main():
     global host, port
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('-l', '--host', default='localhost')
     parser.add_argument('-p', '--port', default=9999, type=int)
+    parser.add_argument('-b', '--benchmark', action='store_true',
+                        help='measure echo throughput instead of testing; run the server with --quiet')
+    parser.add_argument('-c', '--connections', default=4, type=int, help='concurrent connections to benchmark')
+    parser.add_argument('-n', '--packets', default=200, type=int, help='packets per connection to benchmark')
+    parser.add_argument('-s', '--size', default=1000000, type=int, help='approximate bytes per benchmark packet')
     args = parser.parse_args()
     host, port = args.host, args.port
 
+    if args.benchmark:
+        benchmark(args.connections, args.packets, args.size)
+        return
+
     print('Opening idle connection:', end=' ')
     s1 = open_connection()
     print('Success')
@@ -3,6 +3,8 @@ from .helpers import ProxyProtocolMixin, ZlibPacketHandler
 
 
 class EchoPacketHandler(ProxyProtocolMixin, ZlibPacketHandler):
+    quiet = False
+
     def __init__(self, server, socket):
         super(EchoPacketHandler, self).__init__(server, socket)
         self._gotdata = False
@@ -15,7 +17,8 @@ class EchoPacketHandler(ProxyProtocolMixin, ZlibPacketHandler):
 
     def packet(self, data):
         self._gotdata = True
-        print('Data from %s: %r' % (self._socket.getpeername(), data[:30] if len(data) > 30 else data))
+        if not self.quiet:
+            print('Data from %s: %r' % (self._socket.getpeername(), data[:30] if len(data) > 30 else data))
         self.send(data)
 
     def on_close(self):
@@ -29,6 +32,7 @@ def main():
     parser.add_argument('-l', '--host', action='append')
     parser.add_argument('-p', '--port', type=int, action='append')
     parser.add_argument('-e', '--engine', default='select', choices=sorted(engines.keys()))
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not print every packet, e.g. for benchmarks')
     try:
         import netaddr
     except ImportError:
@@ -44,6 +48,7 @@ def main():
             return client
 
     handler = EchoPacketHandler
+    handler.quiet = args.quiet
     if netaddr is not None and args.proxy:
         handler = handler.with_proxy_set(args.proxy)
     server = TestServer(list(zip(args.host, args.port)), handler)
@@ -1,8 +1,11 @@
+from celery.result import AsyncResult
+from celery.utils import uuid
 from django.conf import settings
 from django.conf.urls import url
 from django.contrib import admin, messages
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
-from django.db import connection, transaction
+from django.db import transaction
 from django.db.models import Q, TextField
 from django.forms import ModelForm, ModelMultipleChoiceField
 from django.http import Http404, HttpResponseRedirect
@@ -13,6 +16,8 @@ from django.utils.translation import gettext_lazy as _, ugettext, ungettext
 
 from judge.models import Contest, ContestProblem, ContestSubmission, Profile, Rating
 from judge.ratings import rate_contest
+from judge.scoreboard import post_contest_update
+from judge.utils.celery import redirect_to_task_status
 from judge.widgets import AdminHeavySelect2MultipleWidget, AdminHeavySelect2Widget, AdminPagedownWidget, \
     AdminSelect2MultipleWidget, AdminSelect2Widget, HeavyPreviewAdminPageDownWidget
 
@@ -197,17 +202,17 @@ class ContestAdmin(admin.ModelAdmin):
     def rate_all_view(self, request):
         if not request.user.has_perm('judge.contest_rating'):
             raise PermissionDenied()
-        with transaction.atomic():
-            if connection.vendor == 'sqlite':
-                Rating.objects.all().delete()
-            else:
-                cursor = connection.cursor()
-                cursor.execute('TRUNCATE TABLE `%s`' % Rating._meta.db_table)
-                cursor.close()
-            Profile.objects.update(rating=None)
-            for contest in Contest.objects.filter(is_rated=True).order_by('end_time'):
-                rate_contest(contest)
-        return HttpResponseRedirect(reverse('admin:judge_contest_changelist'))
+        from judge.tasks import rate_all_contests
+        from judge.tasks.contest import RATE_ALL_LOCK, RATE_ALL_LOCK_TIMEOUT
+        task_id = uuid()
+        running = None if cache.add(RATE_ALL_LOCK, task_id, RATE_ALL_LOCK_TIMEOUT) else cache.get(RATE_ALL_LOCK)
+        if running is None:
+            status = rate_all_contests.apply_async(task_id=task_id)
+        else:
+            # Already rating all contests; show its progress instead of starting again.
+            status = AsyncResult(running)
+        return redirect_to_task_status(status, message=ugettext('Rating all contests...'),
+                                       redirect=reverse('admin:judge_contest_changelist'))
 
     def rate_view(self, request, id):
         if not request.user.has_perm('judge.contest_rating'):
@@ -231,6 +236,11 @@ class ContestAdmin(admin.ModelAdmin):
         ).distinct()
         return form
 
+    def save_related(self, request, form, formsets, change):
+        super(ContestAdmin, self).save_related(request, form, formsets, change)
+        # Its problems, format or primary group may have changed.
+        post_contest_update(form.instance.id)
+
 
 class ContestParticipationForm(ModelForm):
     class Meta:
@@ -265,6 +275,20 @@ class ContestParticipationAdmin(admin.ModelAdmin):
                                              count) % count)
     recalculate_results.short_description = _('Recalculate results')
 
+    def save_model(self, request, obj, form, change):
+        super(ContestParticipationAdmin, self).save_model(request, obj, form, change)
+        post_contest_update(obj.contest_id)
+
+    def delete_model(self, request, obj):
+        super(ContestParticipationAdmin, self).delete_model(request, obj)
+        post_contest_update(obj.contest_id)
+
+    def delete_queryset(self, request, queryset):
+        contests = set(queryset.values_list('contest_id', flat=True))
+        super(ContestParticipationAdmin, self).delete_queryset(request, queryset)
+        for contest_id in contests:
+            post_contest_update(contest_id)
+
     def username(self, obj):
         return obj.user.username
     username.short_description = _('username')
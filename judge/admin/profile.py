@@ -4,7 +4,7 @@ from django.utils.html import format_html
 from django.utils.translation import gettext, gettext_lazy as _, ungettext
 
 from django_ace import AceWidget
-from judge.models import Profile
+from judge.models import Profile, UserProblemPoints
 from judge.widgets import AdminPagedownWidget, AdminSelect2Widget
 
 
@@ -98,6 +98,7 @@ class ProfileAdmin(admin.ModelAdmin):
     def recalculate_points(self, request, queryset):
         count = 0
         for profile in queryset:
+            UserProblemPoints.recompute(profile.id)
             profile.calculate_points()
             count += 1
         self.message_user(request, ungettext('%d user have scores recalculated.',
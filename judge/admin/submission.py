@@ -13,8 +13,8 @@ from django.utils.html import format_html
 from django.utils.translation import gettext, gettext_lazy as _, pgettext, ungettext
 
 from django_ace import AceWidget
-from judge.models import ContestParticipation, ContestProblem, ContestSubmission, Profile, Submission, \
-    SubmissionSource, SubmissionTestCase
+from judge.models import ContestParticipation, ContestProblem, ContestSubmission, Problem, Profile, Submission, \
+    SubmissionSource, SubmissionTestCase, UserProblemPoints
 from judge.utils.raw_sql import use_straight_join
 
 
@@ -181,6 +181,13 @@ class SubmissionAdmin(admin.ModelAdmin):
             submission.save()
             submission.update_contest()
 
+        for user_id, problem_id in queryset.values_list('user_id', 'problem_id').distinct().order_by():
+            UserProblemPoints.recompute(user_id, problem_id)
+
+        for problem in Problem.objects.filter(id__in=queryset.values_list('problem_id', flat=True).distinct()):
+            problem._updating_stats_only = True
+            problem.update_stats()
+
         for profile in Profile.objects.filter(id__in=queryset.values_list('user_id', flat=True).distinct()):
             profile.calculate_points()
             cache.delete('user_complete:%d' % profile.id)
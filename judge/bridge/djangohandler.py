@@ -16,6 +16,8 @@ class DjangoHandler(ZlibPacketHandler):
             'submission-request': self.on_submission,
             'terminate-submission': self.on_termination,
             'disconnect-judge': self.on_disconnect,
+            'steal-submissions': self.on_steal,
+            'steal-confirm': self.on_steal_confirm,
         }
         self._to_kill = True
         # self.server.schedule(5, self._kill_if_no_request)
@@ -36,12 +38,23 @@ class DjangoHandler(ZlibPacketHandler):
         except Exception:
             logger.exception('Error in packet handling (Django-facing)')
             result = {'name': 'bad-request'}
-        self.send(result, self._schedule_close)
+
+        request_id = packet.get('request-id')
+        if request_id is None:
+            self.send(result, self._schedule_close)
+        else:
+            # Pooled clients tag every request and keep the connection open for the next ones.
+            result = dict(result)
+            result['request-id'] = request_id
+            self.send(result)
 
     def _schedule_close(self):
         self.server.schedule(0, self.close)
 
     def on_submission(self, data):
+        if 'submissions' in data:
+            return self.on_submission_batch(data['submissions'])
+
         id = data['submission-id']
         problem = data['problem-id']
         language = data['language']
@@ -49,9 +62,28 @@ class DjangoHandler(ZlibPacketHandler):
         priority = data['priority']
         if not self.server.judges.check_priority(priority):
             return {'name': 'bad-request'}
-        self.server.judges.judge(id, problem, language, source, priority)
+        self.server.judges.judge(id, problem, language, source, priority, data.get('user-id'), data.get('contest-key'))
+        self._sync_journal()
         return {'name': 'submission-received', 'submission-id': id}
 
+    def on_submission_batch(self, submissions):
+        received, rejected = [], []
+        for submission in submissions:
+            id = submission['submission-id']
+            if not self.server.judges.check_priority(submission['priority']):
+                rejected.append(id)
+                continue
+            self.server.judges.judge(id, submission['problem-id'], submission['language'], submission['source'],
+                                     submission['priority'], submission.get('user-id'), submission.get('contest-key'))
+            received.append(id)
+        self._sync_journal()
+        return {'name': 'submission-received', 'submission-ids': received, 'rejected-ids': rejected}
+
+    def _sync_journal(self):
+        # Submissions are only acknowledged once they are on disk, with a single fsync for a whole batch.
+        if self.server.judges.journal is not None:
+            self.server.judges.journal.sync()
+
     def on_termination(self, data):
         return {'name': 'submission-received', 'judge-aborted': self.server.judges.abort(data['submission-id'])}
 
@@ -59,9 +91,25 @@ class DjangoHandler(ZlibPacketHandler):
         judge_id = data['judge-id']
         force = data['force']
         self.server.judges.disconnect(judge_id, force=force)
+        return {'name': 'judge-disconnected'}
+
+    def on_steal(self, data):
+        # Another bridge shard takes queued submissions for its idle judges.
+        stolen = self.server.judges.steal(data['count'], set(data['problems']), set(data['executors']))
+        return {'name': 'submissions-stolen', 'submissions': [{
+            'submission-id': entry.id, 'problem-id': entry.problem, 'language': entry.language,
+            'source': entry.source, 'priority': entry.priority, 'user-id': entry.user, 'contest-key': entry.contest,
+        } for entry in stolen]}
+
+    def on_steal_confirm(self, data):
+        # The shard that stole these submissions has journaled them, so this one can forget them.
+        self.server.judges.confirm_steal(data['submission-ids'])
+        self._sync_journal()
+        return {'name': 'steal-confirmed'}
 
     def on_malformed(self, packet):
         logger.error('Malformed packet: %s', packet)
+        return {'name': 'bad-request'}
 
     def on_close(self):
         self._to_kill = False
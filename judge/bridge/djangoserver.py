@@ -1,7 +1,9 @@
-from event_socket_server import get_preferred_engine
+from django.conf import settings
 
+from event_socket_server import DEFAULT_ENGINES, get_preferred_engine
 
-class DjangoServer(get_preferred_engine()):
+
+class DjangoServer(get_preferred_engine(getattr(settings, 'BRIDGED_ENGINES', DEFAULT_ENGINES))):
     def __init__(self, judges, *args, **kwargs):
         super(DjangoServer, self).__init__(*args, **kwargs)
         self.judges = judges
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('judge.bridge')
+
+
+class QueueJournal(object):
+    """
+    Append-only log of the submissions the bridge was asked to judge, so that its queue survives a restart.
+
+    Enqueue, dispatch and complete events are buffered in memory and appended to the file with one write and fsync
+    per sync. Replaying the file in one pass yields every submission that was enqueued but never completed, in the
+    order it was enqueued; submissions that were dispatched to a judge but not completed are queued again, since
+    their judge went away with the bridge. Once completed records dominate the file, it is compacted by atomically
+    replacing it with the enqueue records of the live submissions.
+    """
+
+    def __init__(self, path, compact_min=10000, compact_ratio=4):
+        self.path = path
+        self.compact_min = compact_min
+        self.compact_ratio = compact_ratio
+        self.lock = threading.RLock()
+        # Held while writing to the file, which is done outside of `lock` so that queueing is never held up by disk.
+        self._write_lock = threading.Lock()
+        self._live = OrderedDict()
+        self._dispatched = set()
+        self._buffer = []
+        self._records = 0
+        self._file = None
+
+    def replay(self):
+        """Rebuilds the live submissions from the file, then compacts it. Returns the arguments to judge them with."""
+        with self._write_lock:
+            with self.lock:
+                self._live.clear()
+                dispatched = self._dispatched
+                dispatched.clear()
+                try:
+                    with open(self.path, 'rb') as f:
+                        for number, line in enumerate(f, 1):
+                            try:
+                                record = json.loads(line)
+                            except ValueError:
+                                # Only the last record can be torn, by a crash in the middle of a write.
+                                logger.warning('Ignoring the rest of the queue journal from line %d', number)
+                                break
+                            if record['op'] == 'enqueue':
+                                self._live[record['id']] = record
+                            elif record['op'] == 'dispatch':
+                                if record['id'] in self._live:
+                                    dispatched.add(record['id'])
+                            else:
+                                self._live.pop(record['id'], None)
+                                dispatched.discard(record['id'])
+                except FileNotFoundError:
+                    pass
+
+                logger.info('Replayed queue journal: %d submissions to judge, %d of which were being judged',
+                            len(self._live), len(dispatched))
+                records = list(self._live.values())
+            self._compact()
+        return [(record['id'], record['problem'], record['language'], record['source'], record['priority'],
+                 record['user'], record['contest']) for record in records]
+
+    def _append(self, record):
+        self._buffer.append(json.dumps(record, separators=(',', ':')))
+
+    def enqueue(self, id, problem, language, source, priority, user=None, contest=None):
+        with self.lock:
+            if id in self._live:
+                # Replayed, or asked to judge again while still queued.
+                return
+            record = {'op': 'enqueue', 'id': id, 'problem': problem, 'language': language, 'source': source,
+                      'priority': priority, 'user': user, 'contest': contest}
+            self._live[id] = record
+            self._append(record)
+
+    def dispatch(self, id):
+        with self.lock:
+            if id in self._live:
+                self._dispatched.add(id)
+                self._append({'op': 'dispatch', 'id': id})
+
+    def complete(self, id):
+        with self.lock:
+            if self._live.pop(id, None) is not None:
+                self._dispatched.discard(id)
+                self._append({'op': 'complete', 'id': id})
+
+    def sync(self):
+        """Writes and fsyncs the buffered events, compacting the file if it has grown mostly dead."""
+        with self._write_lock:
+            with self.lock:
+                buffer, self._buffer = self._buffer, []
+            if buffer:
+                if self._file is None:
+                    self._file = open(self.path, 'ab')
+                self._file.write(('\n'.join(buffer) + '\n').encode('utf-8'))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._records += len(buffer)
+            with self.lock:
+                compact = self._records > self.compact_min and self._records > self.compact_ratio * len(self._live)
+            if compact:
+                self._compact()
+
+    def _compact(self):
+        # Called holding `_write_lock`. Only copying the live submissions is done under `lock`: events buffered after
+        # the copy are not in the new file, and are appended to it by the next sync.
+        with self.lock:
+            records = list(self._live.values())
+            dispatched = list(self._dispatched)
+            self._buffer = []
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+            for id in dispatched:
+                f.write(json.dumps({'op': 'dispatch', 'id': id}, separators=(',', ':')).encode('utf-8') + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.replace(temp, self.path)
+        self._records = len(records) + len(dispatched)
+        logger.info('Compacted queue journal to %d submissions', len(records))
+
+    def close(self):
+        self.sync()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __len__(self):
+        return len(self._live)
@@ -4,12 +4,15 @@ import time
 from operator import itemgetter
 
 from django import db
+from django.core.cache import cache
 from django.utils import timezone
 
 from judge import event_poster as event
 from judge.caching import finished_submission
-from judge.models import Judge, Language, LanguageLimit, Problem, RuntimeVersion, Submission, SubmissionTestCase
+from judge.models import Judge, Language, LanguageLimit, Problem, RuntimeVersion, Submission, SubmissionTestCase, \
+    UserProblemPoints
 from .judgehandler import JudgeHandler, SubmissionData
+from .recompute import update_participation, update_user_points
 
 logger = logging.getLogger('judge.bridge')
 json_log = logging.getLogger('judge.json.bridge')
@@ -18,11 +21,78 @@ UPDATE_RATE_LIMIT = 5
 UPDATE_RATE_TIME = 0.5
 
 
-def _ensure_connection():
+def _reconnecting(query):
+    # Instead of pinging the database before every query, reconnect once if the idle connection turned out to be lost.
     try:
-        db.connection.cursor().execute('SELECT 1').fetchall()
-    except Exception:
+        return query()
+    except (db.OperationalError, db.InterfaceError):
+        if db.connection.in_atomic_block or db.connection.is_usable():
+            raise
         db.connection.close()
+        return query()
+
+
+def get_problem_limits(problem_id):
+    """The time and memory limits of a problem, with the limits of each language that overrides them."""
+    key = 'problem_limits:%d' % problem_id
+    result = cache.get(key)
+    if result is not None:
+        return result
+    time, memory, short_circuit = Problem.objects.filter(id=problem_id) \
+        .values_list('time_limit', 'memory_limit', 'short_circuit').get()
+    languages = {language: (time, memory) for language, time, memory in
+                 LanguageLimit.objects.filter(problem_id=problem_id)
+                                      .values_list('language_id', 'time_limit', 'memory_limit')}
+    result = time, memory, short_circuit, languages
+    cache.set(key, result, 86400)
+    return result
+
+
+class GradingResult(object):
+    status_codes = ['SC', 'AC', 'WA', 'MLE', 'TLE', 'IR', 'RTE', 'OLE']
+
+    def __init__(self):
+        self.time = 0
+        self.memory = 0
+        self.points = 0.0
+        self.total = 0
+        self.status = 0
+        self.batches = {}  # batch number: (points, total)
+
+    @classmethod
+    def from_test_cases(cls, cases):
+        result = cls()
+        for case in cases:
+            result.add(case)
+        return result
+
+    def add(self, case):
+        self.time += case.time
+        if not case.batch:
+            self.points += case.points
+            self.total += case.total
+        else:
+            if case.batch in self.batches:
+                self.batches[case.batch][0] = min(self.batches[case.batch][0], case.points)
+                self.batches[case.batch][1] = max(self.batches[case.batch][1], case.total)
+            else:
+                self.batches[case.batch] = [case.points, case.total]
+        self.memory = max(self.memory, case.memory)
+        i = self.status_codes.index(case.status)
+        if i > self.status:
+            self.status = i
+
+    def case_points(self):
+        points = self.points
+        total = self.total
+        for i in self.batches:
+            points += self.batches[i][0]
+            total += self.batches[i][1]
+        return round(points, 1), round(total, 1)
+
+    @property
+    def result(self):
+        return self.status_codes[self.status]
 
 
 class DjangoJudgeHandler(JudgeHandler):
@@ -37,13 +107,20 @@ class DjangoJudgeHandler(JudgeHandler):
         self._submission_cache_id = None
         self._submission_cache = {}
 
+        # Problem codes stored as supported by this judge, mapped to their ids, or None if there is no such problem.
+        self._problem_ids = {}
+
+        # Running totals of the test cases seen for each submission graded over this connection.
+        self._grading_results = {}
+
         json_log.info(self._make_json_log(action='connect'))
 
     def on_close(self):
         super(DjangoJudgeHandler, self).on_close()
         json_log.info(self._make_json_log(action='disconnect', info='judge disconnected'))
         if self._working:
-            Submission.objects.filter(id=self._working).update(status='IE', result='IE')
+            self.server.writes.flush()
+            self._finish_submission(self._working, status='IE', result='IE')
             json_log.error(self._make_json_log(sub=self._working, action='close', info='IE due to shutdown on grading'))
 
     def on_malformed(self, packet):
@@ -54,14 +131,13 @@ class DjangoJudgeHandler(JudgeHandler):
         json_log.exception(self._make_json_log(sub=self._working, info='packet processing exception'))
 
     def get_related_submission_data(self, submission):
-        _ensure_connection()  # We are called from the django-facing daemon thread. Guess what happens.
-
+        # We are called from the django-facing daemon thread, whose connection may have been idle for a long time.
         try:
-            pid, time, memory, short_circuit, lid, is_pretested, sub_date, uid, part_virtual, part_id = (
-                Submission.objects.filter(id=submission)
-                          .values_list('problem__id', 'problem__time_limit', 'problem__memory_limit',
-                                       'problem__short_circuit', 'language__id', 'is_pretested', 'date', 'user__id',
-                                       'contest__participation__virtual', 'contest__participation__id')).get()
+            pid, lid, is_pretested, sub_date, uid, part_virtual, part_id, attempt_no = _reconnecting(
+                lambda: Submission.objects.filter(id=submission)
+                                  .values_list('problem__id', 'language__id', 'is_pretested', 'date', 'user__id',
+                                               'contest__participation__virtual', 'contest__participation__id',
+                                               'attempt_no').get())
         except Submission.DoesNotExist:
             logger.error('Submission vanished: %d', submission)
             json_log.error(self._make_json_log(
@@ -70,14 +146,14 @@ class DjangoJudgeHandler(JudgeHandler):
             ))
             return
 
-        attempt_no = Submission.objects.filter(problem__id=pid, contest__participation__id=part_id, user__id=uid,
-                                               date__lt=sub_date).exclude(status__in=('CE', 'IE')).count() + 1
+        if attempt_no is None:
+            # Submitted before attempt numbers were stored, or not through the site.
+            attempt_no = Submission.objects.filter(problem__id=pid, contest__participation__id=part_id, user__id=uid,
+                                                   date__lt=sub_date).exclude(status__in=('CE', 'IE')).count() + 1
+            Submission.objects.filter(id=submission).update(attempt_no=attempt_no)
 
-        try:
-            time, memory = (LanguageLimit.objects.filter(problem__id=pid, language__id=lid)
-                                         .values_list('time_limit', 'memory_limit').get())
-        except LanguageLimit.DoesNotExist:
-            pass
+        time, memory, short_circuit, languages = get_problem_limits(pid)
+        time, memory = languages.get(lid, (time, memory))
 
         return SubmissionData(
             time=time,
@@ -99,7 +175,9 @@ class DjangoJudgeHandler(JudgeHandler):
         judge = self.judge = Judge.objects.get(name=self.name)
         judge.start_time = timezone.now()
         judge.online = True
-        judge.problems.set(Problem.objects.filter(code__in=list(self.problems.keys())))
+        # Usually the same problems as when the judge last connected, so little is written.
+        self._problem_ids = dict(judge.problems.values_list('code', 'id'))
+        self._update_problems()
         judge.runtimes.set(Language.objects.filter(key__in=list(self.executors.keys())))
 
         # Delete now in case we somehow crashed and left some over from the last connection
@@ -118,16 +196,30 @@ class DjangoJudgeHandler(JudgeHandler):
                                           executors=list(self.executors.keys())))
 
     def _disconnected(self):
+        self.server.judge_status.remove(self.name)
         Judge.objects.filter(id=self.judge.id).update(online=False)
         RuntimeVersion.objects.filter(judge=self.judge).delete()
+        Judge.invalidate_problem_judges()
+
+    def _update_problems(self):
+        """Stores the problems the judge supports, adding and deleting only the rows that changed."""
+        removed = [code for code in self._problem_ids if code not in self.problems]
+        removed_ids = [self._problem_ids.pop(code) for code in removed]
+        # Codes without a problem are looked up again every time, since the problem may have been created since.
+        added = [code for code in self.problems if code not in self._problem_ids]
+        added_ids = dict(Problem.objects.filter(code__in=added).values_list('code', 'id')) if added else {}
+        self._problem_ids.update(added_ids)
+
+        through = Judge.problems.through
+        if removed_ids:
+            through.objects.filter(judge=self.judge, problem_id__in=removed_ids).delete()
+        if added_ids:
+            through.objects.bulk_create([through(judge=self.judge, problem_id=id) for id in added_ids.values()],
+                                        ignore_conflicts=True)
+        return bool(removed_ids or added_ids)
 
     def _update_ping(self):
-        try:
-            Judge.objects.filter(name=self.name).update(ping=self.latency, load=self.load)
-        except Exception as e:
-            # What can I do? I don't want to tie this to MySQL.
-            if e.__class__.__name__ == 'OperationalError' and e.__module__ == '_mysql_exceptions' and e.args[0] == 2006:
-                db.connection.close()
+        self.server.judge_status.update(self.name, self.latency, self.load)
 
     def _post_update_submission(self, id, state, done=False):
         if self._submission_cache_id == id:
@@ -146,7 +238,7 @@ class DjangoJudgeHandler(JudgeHandler):
                 'contest': data['contest__participation__contest__key'],
                 'user': data['user_id'], 'problem': data['problem_id'],
                 'status': data['status'], 'language': data['language__key'],
-            })
+            }, key=('update-submission', id) if state == 'test-case' else None)
 
     def on_submission_processing(self, packet):
         id = packet['submission-id']
@@ -163,10 +255,12 @@ class DjangoJudgeHandler(JudgeHandler):
 
     def on_grading_begin(self, packet):
         super(DjangoJudgeHandler, self).on_grading_begin(packet)
+        self.server.writes.discard(packet['submission-id'])
         if Submission.objects.filter(id=packet['submission-id']).update(
                 status='G', is_pretested=packet['pretested'],
                 current_testcase=1, batch=False):
             SubmissionTestCase.objects.filter(submission_id=packet['submission-id']).delete()
+            self._grading_results[packet['submission-id']] = GradingResult()
             event.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'grading-begin'})
             self._post_update_submission(packet['submission-id'], 'grading-begin')
             json_log.info(self._make_json_log(packet, action='grading-begin'))
@@ -175,11 +269,11 @@ class DjangoJudgeHandler(JudgeHandler):
             json_log.error(self._make_json_log(packet, action='grading-begin', info='unknown submission'))
 
     def _submission_is_batch(self, id):
-        if not Submission.objects.filter(id=id).update(batch=True):
-            logger.warning('Unknown submission: %d', id)
+        self.server.writes.update(id, batch=True)
 
     def on_grading_end(self, packet):
         super(DjangoJudgeHandler, self).on_grading_end(packet)
+        self.server.writes.flush()
 
         try:
             submission = Submission.objects.get(id=packet['submission-id'])
@@ -188,36 +282,14 @@ class DjangoJudgeHandler(JudgeHandler):
             json_log.error(self._make_json_log(packet, action='grading-end', info='unknown submission'))
             return
 
-        time = 0
-        memory = 0
-        points = 0.0
-        total = 0
-        status = 0
-        status_codes = ['SC', 'AC', 'WA', 'MLE', 'TLE', 'IR', 'RTE', 'OLE']
-        batches = {}  # batch number: (points, total)
-
-        for case in SubmissionTestCase.objects.filter(submission=submission):
-            time += case.time
-            if not case.batch:
-                points += case.points
-                total += case.total
-            else:
-                if case.batch in batches:
-                    batches[case.batch][0] = min(batches[case.batch][0], case.points)
-                    batches[case.batch][1] = max(batches[case.batch][1], case.total)
-                else:
-                    batches[case.batch] = [case.points, case.total]
-            memory = max(memory, case.memory)
-            i = status_codes.index(case.status)
-            if i > status:
-                status = i
-
-        for i in batches:
-            points += batches[i][0]
-            total += batches[i][1]
-
-        points = round(points, 1)
-        total = round(total, 1)
+        grading = self._grading_results.pop(submission.id, None)
+        if grading is None:
+            # We did not see this submission begin grading, e.g. the bridge was restarted in the middle of it.
+            grading = GradingResult.from_test_cases(SubmissionTestCase.objects.filter(submission=submission))
+
+        time = grading.time
+        memory = grading.memory
+        points, total = grading.case_points()
         submission.case_points = points
         submission.case_total = total
 
@@ -226,12 +298,16 @@ class DjangoJudgeHandler(JudgeHandler):
         if not problem.partial and sub_points != problem.points:
             sub_points = 0
 
+        old_result = submission.result
         submission.status = 'D'
         submission.time = time
         submission.memory = memory
         submission.points = sub_points
-        submission.result = status_codes[status]
+        submission.result = grading.result
         submission.save()
+        self.server.result_counts.change(submission.problem_id, submission.user_id, submission.contest_object_id,
+                                         submission.language_id, old_result, submission.result)
+        solved = UserProblemPoints.record_submission(submission)
 
         json_log.info(self._make_json_log(
             packet, action='grading-end', time=time, memory=memory,
@@ -240,11 +316,17 @@ class DjangoJudgeHandler(JudgeHandler):
             problem=problem.code, finish=True,
         ))
 
-        submission.user._updating_stats_only = True
-        submission.user.calculate_points()
-        problem._updating_stats_only = True
-        problem.update_stats()
-        submission.update_contest()
+        if not submission.user.is_unlisted:
+            problem.adjust_stats(accepted=int(submission.result == 'AC' and sub_points >= problem.points),
+                                 users=solved)
+
+        # User points and contest results are recomputed in the background, once per burst.
+        recompute = self.server.recompute
+        recompute.schedule(('user', submission.user_id), update_user_points, submission.user_id)
+        submission.update_contest(recompute_results=False)
+        if hasattr(submission, 'contest'):
+            participation_id = submission.contest.participation_id
+            recompute.schedule(('participation', participation_id), update_participation, participation_id)
 
         finished_submission(submission)
 
@@ -256,15 +338,32 @@ class DjangoJudgeHandler(JudgeHandler):
             'total': float(problem.points),
             'result': submission.result,
         })
-        if hasattr(submission, 'contest'):
-            participation = submission.contest.participation
-            event.post('contest_%d' % participation.contest_id, {'type': 'update'})
         self._post_update_submission(submission.id, 'grading-end', done=True)
 
+    def _finish_submission(self, id, **updates):
+        """Stores the final state of a submission and counts its result. Returns False if it does not exist."""
+        try:
+            old, problem_id, user_id, contest_id, language_id, was_rejudged, is_unlisted = \
+                Submission.objects.filter(id=id).values_list('result', 'problem_id', 'user_id', 'contest_object_id',
+                                                            'language_id', 'was_rejudged', 'user__is_unlisted')[0]
+        except IndexError:
+            return False
+        Submission.objects.filter(id=id).update(**updates)
+        self.server.result_counts.change(problem_id, user_id, contest_id, language_id, old, updates['result'])
+        if was_rejudged:
+            # Rejudging cleared the points of the submission, which may have been the user's best on the problem.
+            solved = UserProblemPoints.record_submission(Submission(id=id, user_id=user_id, problem_id=problem_id,
+                                                                    was_rejudged=True))
+            if solved and not is_unlisted:
+                Problem(id=problem_id).adjust_stats(users=solved)
+            self.server.recompute.schedule(('user', user_id), update_user_points, user_id)
+        return True
+
     def on_compile_error(self, packet):
         super(DjangoJudgeHandler, self).on_compile_error(packet)
+        self._grading_results.pop(packet['submission-id'], None)
 
-        if Submission.objects.filter(id=packet['submission-id']).update(status='CE', result='CE', error=packet['log']):
+        if self._finish_submission(packet['submission-id'], status='CE', result='CE', error=packet['log']):
             event.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {
                 'type': 'compile-error',
                 'log': packet['log'],
@@ -290,9 +389,11 @@ class DjangoJudgeHandler(JudgeHandler):
 
     def on_internal_error(self, packet):
         super(DjangoJudgeHandler, self).on_internal_error(packet)
+        self._grading_results.pop(packet['submission-id'], None)
+        self.server.writes.flush()
 
         id = packet['submission-id']
-        if Submission.objects.filter(id=id).update(status='IE', result='IE', error=packet['message']):
+        if self._finish_submission(id, status='IE', result='IE', error=packet['message']):
             event.post('sub_%s' % Submission.get_id_secret(id), {'type': 'internal-error'})
             self._post_update_submission(id, 'internal-error', done=True)
             json_log.info(self._make_json_log(packet, action='internal-error', message=packet['message'],
@@ -304,8 +405,10 @@ class DjangoJudgeHandler(JudgeHandler):
 
     def on_submission_terminated(self, packet):
         super(DjangoJudgeHandler, self).on_submission_terminated(packet)
+        self._grading_results.pop(packet['submission-id'], None)
+        self.server.writes.flush()
 
-        if Submission.objects.filter(id=packet['submission-id']).update(status='AB', result='AB'):
+        if self._finish_submission(packet['submission-id'], status='AB', result='AB'):
             event.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'aborted-submission'})
             self._post_update_submission(packet['submission-id'], 'terminated', done=True)
             json_log.info(self._make_json_log(packet, action='aborted', finish=True, result='AB'))
@@ -325,14 +428,17 @@ class DjangoJudgeHandler(JudgeHandler):
     def on_test_case(self, packet, max_feedback=SubmissionTestCase._meta.get_field('feedback').max_length):
         super(DjangoJudgeHandler, self).on_test_case(packet)
         id = packet['submission-id']
-        updates = packet['cases']
-        max_position = max(map(itemgetter('position'), updates))
-
-        if not Submission.objects.filter(id=id).update(current_testcase=max_position + 1):
+        if id != self._working:
+            # Only the submission being graded on this judge can get test cases, so junk never reaches the buffer.
             logger.warning('Unknown submission: %d', id)
             json_log.error(self._make_json_log(packet, action='test-case', info='unknown submission'))
             return
 
+        updates = packet['cases']
+        max_position = max(map(itemgetter('position'), updates))
+        self.server.writes.update(id, current_testcase=max_position + 1)
+        grading = self._grading_results.get(id)
+
         bulk_test_case_updates = []
         for result in updates:
             test_case = SubmissionTestCase(submission_id=id, case=result['position'])
@@ -362,6 +468,8 @@ class DjangoJudgeHandler(JudgeHandler):
             test_case.extended_feedback = result.get('extended-feedback') or ''
             test_case.output = result['output']
             bulk_test_case_updates.append(test_case)
+            if grading is not None:
+                grading.add(test_case)
 
             json_log.info(self._make_json_log(
                 packet, action='test-case', case=test_case.case, batch=test_case.batch,
@@ -385,17 +493,19 @@ class DjangoJudgeHandler(JudgeHandler):
             self.update_counter[id] = (1, time.monotonic())
 
         if do_post:
+            # Test case updates not yet sent to the event daemon are superseded by this one.
             event.post('sub_%s' % Submission.get_id_secret(id), {
                 'type': 'test-case',
                 'id': max_position,
-            })
+            }, key=('test-case', id))
             self._post_update_submission(id, state='test-case')
 
-        SubmissionTestCase.objects.bulk_create(bulk_test_case_updates)
+        self.server.writes.add_test_cases(id, bulk_test_case_updates)
 
     def on_supported_problems(self, packet):
         super(DjangoJudgeHandler, self).on_supported_problems(packet)
-        self.judge.problems.set(Problem.objects.filter(code__in=list(self.problems.keys())))
+        if self._update_problems():
+            Judge.invalidate_problem_judges()
         json_log.info(self._make_json_log(action='update-problems', count=len(self.problems)))
 
     def _make_json_log(self, packet=None, sub=None, **kwargs):
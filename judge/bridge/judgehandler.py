@@ -43,6 +43,8 @@ class JudgeHandler(ProxyProtocolMixin, ZlibPacketHandler):
         self.in_batch = False
         self._ping_average = deque(maxlen=6)  # 1 minute average, just like load
         self._time_delta = deque(maxlen=6)
+        self._state_since = time.monotonic()
+        self._phase_start = None
 
         self.server.schedule(15, self._kill_if_no_auth)
         logger.info('Judge connected from: %s', self.client_address)
@@ -58,6 +60,7 @@ class JudgeHandler(ProxyProtocolMixin, ZlibPacketHandler):
             self.server.unschedule(self._no_response_job)
         self.server.judges.remove(self)
         if self.name is not None:
+            self._record_state('busy' if self._working else 'idle')
             self._disconnected()
         logger.info('Judge disconnected from: %s', self.client_address)
 
@@ -92,6 +95,7 @@ class JudgeHandler(ProxyProtocolMixin, ZlibPacketHandler):
         self.problems = dict(self._problems)
         self.executors = packet['executors']
         self.name = packet['id']
+        self._state_since = time.monotonic()
 
         self.send({'name': 'handshake-success'})
         logger.info('Judge authenticated: %s (%s)', self.client_address, packet['id'])
@@ -125,6 +129,7 @@ class JudgeHandler(ProxyProtocolMixin, ZlibPacketHandler):
 
     def submit(self, id, problem, language, source):
         data = self.get_related_submission_data(id)
+        self._record_state('idle')
         self._working = id
         self._no_response_job = self.server.schedule(20, self._kill_if_no_response)
         self.send({
@@ -168,6 +173,7 @@ class JudgeHandler(ProxyProtocolMixin, ZlibPacketHandler):
         if self._no_response_job:
             self.server.unschedule(self._no_response_job)
             self._no_response_job = None
+        self._phase_start = time.monotonic()
         self.on_submission_processing(packet)
 
     def abort(self):
@@ -189,7 +195,8 @@ class JudgeHandler(ProxyProtocolMixin, ZlibPacketHandler):
                 self.on_malformed(data)
             else:
                 handler = self.handlers.get(data['name'], self.on_malformed)
-                handler(data)
+                with self.server.metrics.time_packet(handler.__name__):
+                    handler(data)
         except Exception:
             logger.exception('Error in packet handling (Judge-side): %s', self.name)
             self._packet_exception()
@@ -206,20 +213,22 @@ class JudgeHandler(ProxyProtocolMixin, ZlibPacketHandler):
         logger.info('%s: Updated problem list', self.name)
         self._problems = packet['problems']
         self.problems = dict(self._problems)
-        if not self.working:
-            self.server.judges.update_problems(self)
+        self.server.judges.update_problems(self)
 
     def on_grading_begin(self, packet):
         logger.info('%s: Grading has begun on: %s', self.name, packet['submission-id'])
         self.batch_id = None
+        self._end_phase(self.server.metrics.compile)
 
     def on_grading_end(self, packet):
         logger.info('%s: Grading has ended on: %s', self.name, packet['submission-id'])
+        self._end_phase(self.server.metrics.grade)
         self._free_self(packet)
         self.batch_id = None
 
     def on_compile_error(self, packet):
         logger.info('%s: Submission failed to compile: %s', self.name, packet['submission-id'])
+        self._end_phase(self.server.metrics.compile)
         self._free_self(packet)
 
     def on_compile_message(self, packet):
@@ -263,6 +272,20 @@ class JudgeHandler(ProxyProtocolMixin, ZlibPacketHandler):
         self.load = packet['load']
         self._update_ping()
 
+    def _record_state(self, state):
+        # Counts the time since the judge last started or stopped grading as time spent in the given state.
+        now = time.monotonic()
+        self.server.metrics.judge_time.inc(now - self._state_since, self.name, state)
+        self._state_since = now
+
+    def _end_phase(self, histogram):
+        if self._phase_start is not None:
+            now = time.monotonic()
+            histogram.observe(now - self._phase_start)
+            self._phase_start = now
+
     def _free_self(self, packet):
+        self._record_state('busy')
+        self._phase_start = None
         self._working = False
         self.server.judges.on_judge_free(self, packet['submission-id'])
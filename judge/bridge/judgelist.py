@@ -1,54 +1,305 @@
 import logging
-from collections import namedtuple
+import time
+from collections import defaultdict, deque, namedtuple
+from heapq import heapify, heappop, heappush
+from itertools import count
 from operator import attrgetter
 from threading import RLock
 
-try:
-    from llist import dllist
-except ImportError:
-    from pyllist import dllist
-
 logger = logging.getLogger('judge.bridge')
 
-PriorityMarker = namedtuple('PriorityMarker', 'priority')
+QueuedSubmission = namedtuple('QueuedSubmission',
+                              'id problem language source priority sequence user contest time rank')
+
+
+class StrictPriorityPolicy(object):
+    """Lower priorities always go first, and submissions of the same priority are judged in arrival order."""
+
+    def rank(self, priority, user, contest, now, sequence):
+        return priority, sequence
+
+
+class FairSharePolicy(object):
+    """
+    Weighted fair queuing by a virtual clock per user and per contest, with priority aging.
+
+    A queued submission is ranked by a virtual start time: its arrival, pushed back until both its user's and its
+    contest's clocks have caught up. Queueing a submission moves its user's clock `user_interval` seconds ahead and
+    its contest's clock `contest_interval` seconds ahead, so a user with a hundred submissions queued is interleaved
+    with everyone else instead of going first. Each priority level adds `priority_step` seconds to the rank. Since
+    ranks are in units of arrival time, a submission that has waited that long overtakes newly queued ones of the
+    next more urgent priority, and nothing is starved.
+    """
+
+    def __init__(self, priority_step=60, user_interval=10, contest_interval=1, max_clocks=10000):
+        self.priority_step = priority_step
+        self.user_interval = user_interval
+        self.contest_interval = contest_interval
+        self.max_clocks = max_clocks
+        self._users = {}
+        self._contests = {}
+
+    def _advance(self, clocks, flow, clock, now):
+        if len(clocks) > self.max_clocks:
+            # Clocks that have fallen behind real time no longer push anything back.
+            for key in [key for key, value in clocks.items() if value <= now]:
+                del clocks[key]
+        clocks[flow] = clock
+
+    def rank(self, priority, user, contest, now, sequence):
+        start = now
+        if user is not None:
+            start = max(start, self._users.get(user, now))
+        if contest is not None:
+            start = max(start, self._contests.get(contest, now))
+        if user is not None:
+            self._advance(self._users, user, start + self.user_interval, now)
+        if contest is not None:
+            self._advance(self._contests, contest, start + self.contest_interval, now)
+        return start + priority * self.priority_step, sequence
+
+
+SCHEDULING_POLICIES = {
+    'priority': StrictPriorityPolicy,
+    'fair-share': FairSharePolicy,
+}
+
+
+class LeastLoadSelector(object):
+    """Sends a submission to the idle judge reporting the least load."""
+
+    def select(self, candidates, problem, language):
+        return min(candidates, key=attrgetter('load'))
+
+    def dispatched(self, judge, problem, language):
+        pass
+
+
+class ScoringSelector(object):
+    """
+    Sends a submission to the idle judge with the lowest score. The score adds up the judge's reported load, its
+    ping latency in seconds, and how much slower than average it historically is for the language, each weighted.
+    Judges that recently graded the same problem, and so likely still have its test data cached, get a bonus.
+    """
+
+    def __init__(self, load_weight=1.0, latency_weight=5.0, speed_weight=2.0, affinity_weight=0.5, affinity_size=20):
+        self.load_weight = load_weight
+        self.latency_weight = latency_weight
+        self.speed_weight = speed_weight
+        self.affinity_weight = affinity_weight
+        # (judge name, language): time taken relative to the average judge, see judge_speed_factors.
+        self.speeds = {}
+        self._recent = defaultdict(lambda: deque(maxlen=affinity_size))
+
+    def score(self, judge, problem, language):
+        score = self.load_weight * judge.load + self.latency_weight * (judge.latency or 0)
+        score += self.speed_weight * (self.speeds.get((judge.name, language), 1) - 1)
+        if problem in self._recent[judge.name]:
+            score -= self.affinity_weight
+        return score
+
+    def select(self, candidates, problem, language):
+        return min(candidates, key=lambda judge: self.score(judge, problem, language))
+
+    def dispatched(self, judge, problem, language):
+        self._recent[judge.name].append(problem)
+
+
+JUDGE_SELECTORS = {
+    'least-load': LeastLoadSelector,
+    'score': ScoringSelector,
+}
+
+
+def judge_speed_factors(timings, min_samples=20):
+    """
+    Estimates how much slower than average each judge is in each language, from (judge, language, case, time)
+    samples, where the case identifies a test case of a problem. Every time is compared to the mean time of the
+    same case in the same language over all judges that ran it.
+    """
+    cases = defaultdict(list)
+    for judge, language, case, time in timings:
+        cases[language, case].append((judge, time))
+
+    ratios = defaultdict(list)
+    for (language, case), samples in cases.items():
+        if len({judge for judge, time in samples}) < 2:
+            continue
+        mean = sum(time for judge, time in samples) / len(samples)
+        if mean <= 0:
+            continue
+        for judge, time in samples:
+            ratios[judge, language].append(time / mean)
+    return {key: sum(values) / len(values) for key, values in ratios.items() if len(values) >= min_samples}
+
+
+class CapabilityClass(object):
+    __slots__ = ('problems', 'executors', 'queue', 'judges')
+
+    def __init__(self, problems, executors):
+        self.problems = problems
+        self.executors = executors
+        self.queue = []
+        self.judges = 0
+
+    def can_judge(self, problem, executor):
+        return problem in self.problems and executor in self.executors
+
+
+class SubmissionQueue(object):
+    """
+    Submissions waiting for a judge, in the order given by a scheduling policy.
+
+    Judges with identical problem and executor sets share a capability class, which keeps its own heap of the
+    queued submissions it is able to grade. Enqueueing costs one check per class, and a free judge takes the head of
+    its class's heap instead of testing every queued submission. Dispatched or aborted submissions are dropped
+    lazily when they reach the head of a class heap.
+    """
+
+    def __init__(self, priorities, policy=None, wait_samples=1000):
+        self.priorities = priorities
+        self.policy = policy or StrictPriorityPolicy()
+        self._entries = {}
+        self._classes = {}
+        self._judge_class = {}
+        self._depth = [0] * priorities
+        self._waits = [deque(maxlen=wait_samples) for _ in range(priorities)]
+        # Called with the priority and wait of every dispatched submission, if set.
+        self.wait_observer = None
+        self._sequence = count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, id):
+        return id in self._entries
+
+    def __iter__(self):
+        return iter(sorted(self._entries.values(), key=attrgetter('rank')))
+
+    def attach(self, judge):
+        self.detach(judge)
+        key = frozenset(judge.problems), frozenset(judge.executors)
+        try:
+            capability = self._classes[key]
+        except KeyError:
+            capability = self._classes[key] = CapabilityClass(key[0], key[1])
+            capability.queue = [(entry.rank, entry) for entry in self._entries.values()
+                                if capability.can_judge(entry.problem, entry.language)]
+            heapify(capability.queue)
+        capability.judges += 1
+        self._judge_class[judge] = key
+
+    def detach(self, judge):
+        key = self._judge_class.pop(judge, None)
+        if key is not None:
+            capability = self._classes[key]
+            capability.judges -= 1
+            if not capability.judges:
+                del self._classes[key]
+
+    def push(self, id, problem, language, source, priority, user=None, contest=None):
+        now = time.monotonic()
+        sequence = next(self._sequence)
+        entry = QueuedSubmission(id, problem, language, source, priority, sequence, user, contest, now,
+                                 self.policy.rank(priority, user, contest, now, sequence))
+        self._entries[id] = entry
+        self._depth[priority] += 1
+        for capability in self._classes.values():
+            if capability.can_judge(problem, language):
+                heappush(capability.queue, (entry.rank, entry))
+        return entry
+
+    def remove(self, id, dispatched=False):
+        entry = self._entries.pop(id, None)
+        if entry is not None:
+            self._depth[entry.priority] -= 1
+            if dispatched:
+                self.record_wait(entry.priority, time.monotonic() - entry.time)
+        return entry
+
+    def peek(self, judge):
+        key = self._judge_class.get(judge)
+        if key is None:
+            for entry in self:
+                if judge.can_judge(entry.problem, entry.language):
+                    return entry
+            return None
+
+        entries = self._entries
+        queue = self._classes[key].queue
+        while queue:
+            entry = queue[0][1]
+            if entries.get(entry.id) is entry:
+                return entry
+            heappop(queue)
+        return None
+
+    def depth(self, priority):
+        return self._depth[priority]
+
+    def record_wait(self, priority, wait):
+        self._waits[priority].append(wait)
+        if self.wait_observer is not None:
+            self.wait_observer(wait, priority)
+
+    def wait_percentiles(self):
+        """Percentiles of the time recently dispatched submissions spent queued, in seconds, by priority."""
+        stats = {}
+        for priority, waits in enumerate(self._waits):
+            waits = sorted(waits)
+            if waits:
+                stats[priority] = {
+                    'count': len(waits),
+                    'p50': waits[len(waits) // 2],
+                    'p90': waits[len(waits) * 9 // 10],
+                    'p99': waits[len(waits) * 99 // 100],
+                    'max': waits[-1],
+                }
+        return stats
 
 
 class JudgeList(object):
     priorities = 4
 
-    def __init__(self):
-        self.queue = dllist()
-        self.priority = [self.queue.append(PriorityMarker(i)) for i in range(self.priorities)]
+    def __init__(self, policy=None, selector=None, journal=None):
+        self.queue = SubmissionQueue(self.priorities, policy)
+        self.selector = selector or LeastLoadSelector()
+        self.journal = journal
         self.judges = set()
-        self.node_map = {}
         self.submission_map = {}
+        # Submissions given to another bridge shard that has not yet confirmed taking them, and when.
+        self.handed_off = {}
         self.lock = RLock()
 
     def _handle_free_judge(self, judge):
         with self.lock:
-            node = self.queue.first
-            while node:
-                if not isinstance(node.value, PriorityMarker):
-                    id, problem, language, source = node.value
-                    if judge.can_judge(problem, language):
-                        self.submission_map[id] = judge
-                        logger.info('Dispatched queued submission %d: %s', id, judge.name)
-                        try:
-                            judge.submit(id, problem, language, source)
-                        except Exception:
-                            logger.exception('Failed to dispatch %d (%s, %s) to %s', id, problem, language, judge.name)
-                            self.judges.remove(judge)
-                            return
-                        self.queue.remove(node)
-                        del self.node_map[id]
-                        break
-                node = node.next
+            entry = self.queue.peek(judge)
+            if entry is None:
+                return
+
+            id, problem, language, source = entry.id, entry.problem, entry.language, entry.source
+            self.submission_map[id] = judge
+            self.selector.dispatched(judge, problem, language)
+            logger.info('Dispatched queued submission %d: %s', id, judge.name)
+            try:
+                judge.submit(id, problem, language, source)
+            except Exception:
+                logger.exception('Failed to dispatch %d (%s, %s) to %s', id, problem, language, judge.name)
+                del self.submission_map[id]
+                self.judges.remove(judge)
+                self.queue.detach(judge)
+                return
+            self.queue.remove(id, dispatched=True)
+            if self.journal is not None:
+                self.journal.dispatch(id)
 
     def register(self, judge):
         with self.lock:
             # Disconnect all judges with the same name, see <https://github.com/DMOJ/online-judge/issues/828>
             self.disconnect(judge, force=True)
             self.judges.add(judge)
+            self.queue.attach(judge)
             self._handle_free_judge(judge)
 
     def disconnect(self, judge_id, force=False):
@@ -58,7 +309,9 @@ class JudgeList(object):
 
     def update_problems(self, judge):
         with self.lock:
-            self._handle_free_judge(judge)
+            self.queue.attach(judge)
+            if not judge.working:
+                self._handle_free_judge(judge)
 
     def remove(self, judge):
         with self.lock:
@@ -68,7 +321,11 @@ class JudgeList(object):
                     del self.submission_map[sub]
                 except KeyError:
                     pass
+                if self.journal is not None:
+                    # The submission is marked as an internal error when its judge disconnects.
+                    self.journal.complete(sub)
             self.judges.discard(judge)
+            self.queue.detach(judge)
 
     def __iter__(self):
         return iter(self.judges)
@@ -77,6 +334,8 @@ class JudgeList(object):
         with self.lock:
             logger.info('Judge available after grading %d: %s', submission, judge.name)
             del self.submission_map[submission]
+            if self.journal is not None:
+                self.journal.complete(submission)
             self._handle_free_judge(judge)
 
     def abort(self, submission):
@@ -86,38 +345,77 @@ class JudgeList(object):
                 self.submission_map[submission].abort()
                 return True
             except KeyError:
-                try:
-                    node = self.node_map[submission]
-                except KeyError:
-                    pass
-                else:
-                    self.queue.remove(node)
-                    del self.node_map[submission]
+                self.queue.remove(submission)
+                self.handed_off.pop(submission, None)
+                if self.journal is not None:
+                    self.journal.complete(submission)
                 return False
 
+    def steal(self, count, problems, executors):
+        """
+        Hands up to `count` queued submissions of the given problems and executors, best ranked first, to another
+        bridge shard. They stay in the journal until the other shard confirms taking them with `confirm_steal`.
+        """
+        with self.lock:
+            stolen = []
+            for entry in self.queue:
+                if len(stolen) >= count:
+                    break
+                if entry.problem in problems and entry.language in executors:
+                    stolen.append(entry)
+            now = time.monotonic()
+            for entry in stolen:
+                self.queue.remove(entry.id)
+                self.handed_off[entry.id] = entry, now
+            return stolen
+
+    def confirm_steal(self, ids):
+        with self.lock:
+            for id in ids:
+                if self.handed_off.pop(id, None) is not None and self.journal is not None:
+                    self.journal.complete(id)
+
+    def reclaim_handoffs(self, timeout):
+        """Queues again the stolen submissions that were not confirmed within `timeout` seconds."""
+        with self.lock:
+            now = time.monotonic()
+            expired = [entry for entry, since in self.handed_off.values() if now - since >= timeout]
+            for entry in expired:
+                del self.handed_off[entry.id]
+                self.judge(entry.id, entry.problem, entry.language, entry.source, entry.priority, entry.user,
+                           entry.contest)
+            return len(expired)
+
     def check_priority(self, priority):
         return 0 <= priority < self.priorities
 
-    def judge(self, id, problem, language, source, priority):
+    def judge(self, id, problem, language, source, priority, user=None, contest=None):
         with self.lock:
-            if id in self.submission_map or id in self.node_map:
+            if id in self.submission_map or id in self.queue:
                 # Already judging, don't queue again. This can happen during batch rejudges, rejudges should be
                 # idempotent.
                 return
+            if self.journal is not None:
+                self.journal.enqueue(id, problem, language, source, priority, user, contest)
 
             candidates = [judge for judge in self.judges if not judge.working and judge.can_judge(problem, language)]
             logger.info('Free judges: %d', len(candidates))
             if candidates:
-                # Schedule the submission on the judge reporting least load.
-                judge = min(candidates, key=attrgetter('load'))
+                judge = self.selector.select(candidates, problem, language)
                 logger.info('Dispatched submission %d to: %s', id, judge.name)
                 self.submission_map[id] = judge
+                self.selector.dispatched(judge, problem, language)
                 try:
                     judge.submit(id, problem, language, source)
                 except Exception:
                     logger.exception('Failed to dispatch %d (%s, %s) to %s', id, problem, language, judge.name)
+                    del self.submission_map[id]
                     self.judges.discard(judge)
-                    return self.judge(id, problem, language, source, priority)
+                    self.queue.detach(judge)
+                    return self.judge(id, problem, language, source, priority, user, contest)
+                self.queue.record_wait(priority, 0)
+                if self.journal is not None:
+                    self.journal.dispatch(id)
             else:
-                self.node_map[id] = self.queue.insert((id, problem, language, source), self.priority[priority])
+                self.queue.push(id, problem, language, source, priority, user, contest)
                 logger.info('Queued submission: %d', id)
@@ -1,31 +1,144 @@
+import json
 import logging
 import os
 import threading
 import time
 
-from event_socket_server import get_preferred_engine
-from judge.models import Judge
-from .judgelist import JudgeList
+from django import db
+from django.conf import settings
+from django.core.cache import cache
+
+from event_socket_server import DEFAULT_ENGINES, get_preferred_engine
+from judge.models import Judge, SubmissionTestCase
+from .journal import QueueJournal
+from .judgelist import JUDGE_SELECTORS, JudgeList, SCHEDULING_POLICIES, judge_speed_factors
+from .metrics import BridgeMetrics
+from .recompute import RecomputeQueue
+from .sharding import ShardCoordinator
+from .writebuffer import JudgeStatusBuffer, ResultCountBuffer, SubmissionWriteBuffer
 
 logger = logging.getLogger('judge.bridge')
 
 
-def reset_judges():
-    Judge.objects.update(online=False, ping=None, load=None)
+def reset_judges(queryset=None):
+    (Judge.objects.all() if queryset is None else queryset).update(online=False, ping=None, load=None)
+    Judge.invalidate_problem_judges()
+
+
+def load_judge_speeds(samples):
+    timings = SubmissionTestCase.objects.filter(status='AC', time__gt=0, submission__judged_on__isnull=False) \
+        .order_by('-id').values_list('submission__judged_on__name', 'submission__language__key',
+                                     'submission__problem_id', 'case', 'time')[:samples]
+    return judge_speed_factors((judge, language, (problem, case), time)
+                               for judge, language, problem, case, time in timings)
+
 
+class JudgeServer(get_preferred_engine(getattr(settings, 'BRIDGED_ENGINES', DEFAULT_ENGINES))):
+    # Only used by the asyncio engine, which handles packets from judges on this many threads.
+    workers = getattr(settings, 'BRIDGED_WORKER_THREADS', 8)
 
-class JudgeServer(get_preferred_engine()):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, journal_path=None, shard=None, shards=(), **kwargs):
         super(JudgeServer, self).__init__(*args, **kwargs)
-        reset_judges()
-        self.judges = JudgeList()
+        if shard is None:
+            self.shards = None
+            reset_judges()
+        else:
+            # Judges connected to the other shards stay online.
+            self.shards = ShardCoordinator(self, shard, shards, getattr(settings, 'BRIDGED_SHARD_INTERVAL', 2),
+                                           getattr(settings, 'BRIDGED_SHARD_STEAL_THRESHOLD', 1),
+                                           getattr(settings, 'BRIDGED_SHARD_TIMEOUT', 5),
+                                           getattr(settings, 'BRIDGED_SHARD_HANDOFF_TIMEOUT', 30))
+            reset_judges(Judge.objects.exclude(name__in=self.shards.judges_elsewhere()))
+        policy = SCHEDULING_POLICIES[getattr(settings, 'BRIDGED_SCHEDULING_POLICY', 'priority')]
+        selector = JUDGE_SELECTORS[getattr(settings, 'BRIDGED_JUDGE_SELECTOR', 'least-load')]
+        journal_path = journal_path or getattr(settings, 'BRIDGED_QUEUE_JOURNAL', None)
+        self.journal = QueueJournal(journal_path) if journal_path else None
+        self.judges = JudgeList(policy(**getattr(settings, 'BRIDGED_SCHEDULING_OPTIONS', {})),
+                                selector(**getattr(settings, 'BRIDGED_JUDGE_SELECTOR_OPTIONS', {})), self.journal)
+        if self.journal is not None:
+            for submission in self.journal.replay():
+                self.judges.judge(*submission)
+            self.journal_interval = getattr(settings, 'BRIDGED_QUEUE_JOURNAL_SYNC_INTERVAL', 0.2)
+            self.schedule(self.journal_interval, self.sync_journal)
+        if hasattr(self.judges.selector, 'speeds'):
+            self.speed_samples = getattr(settings, 'BRIDGED_JUDGE_SPEED_SAMPLES', 50000)
+            self.speed_interval = getattr(settings, 'BRIDGED_JUDGE_SPEED_INTERVAL', 3600)
+            self.schedule(0, self.update_judge_speeds)
+        self.writes = SubmissionWriteBuffer(getattr(settings, 'BRIDGED_WRITE_BUFFER_SIZE', 500))
+        self.write_interval = getattr(settings, 'BRIDGED_WRITE_BUFFER_INTERVAL', 0.5)
+        self.write_stats_interval = getattr(settings, 'BRIDGED_WRITE_BUFFER_STATS_INTERVAL', 60)
+        self._last_write_stats = time.monotonic()
+        self.result_counts = ResultCountBuffer()
+        self.schedule(self.write_interval, self.flush_writes)
+        self.recompute = RecomputeQueue(getattr(settings, 'BRIDGED_RECOMPUTE_DELAY', 2),
+                                        getattr(settings, 'BRIDGED_RECOMPUTE_WORKERS', 1))
+        self.judge_status_interval = getattr(settings, 'BRIDGED_JUDGE_STATUS_INTERVAL', 10)
+        self.judge_status = JudgeStatusBuffer(3 * self.judge_status_interval, JudgeStatusBuffer.shard_cache_key(shard))
+        self.schedule(self.judge_status_interval, self.flush_judge_status)
+        self.metrics = BridgeMetrics(self)
+        self.judges.queue.wait_observer = self.metrics.queue_wait.observe
         self.ping_judge_thread = threading.Thread(target=self.ping_judge, args=())
         self.ping_judge_thread.daemon = True
         self.ping_judge_thread.start()
+        if self.shards is not None:
+            self.shards.start()
 
     def on_shutdown(self):
         super(JudgeServer, self).on_shutdown()
-        reset_judges()
+        self.writes.flush()
+        self.result_counts.flush()
+        self.recompute.stop()
+        cache.delete(self.judge_status.cache_key)
+        if self.journal is not None:
+            self.journal.close()
+        if self.shards is None:
+            reset_judges()
+        else:
+            # The engine has already closed this shard's judges, which marks each of them offline.
+            self.shards.stop()
+
+    def flush_writes(self):
+        try:
+            self.writes.flush()
+            self.result_counts.flush()
+            if time.monotonic() - self._last_write_stats >= self.write_stats_interval:
+                self._last_write_stats = time.monotonic()
+                logger.info('Write buffer: %s', json.dumps(self.writes.stats()))
+                logger.info('Recompute queue: %s', json.dumps(self.recompute.stats()))
+                with self.judges.lock:
+                    waits = self.judges.queue.wait_percentiles()
+                logger.info('Queue wait: %s', json.dumps(waits))
+                if hasattr(self, 'loop_stats'):
+                    logger.info('Event loop: %s', json.dumps(self.loop_stats()))
+        finally:
+            self.schedule(self.write_interval, self.flush_writes)
+
+    def sync_journal(self):
+        try:
+            self.journal.sync()
+        except Exception:
+            logger.exception('Failed to sync the queue journal')
+        finally:
+            self.schedule(self.journal_interval, self.sync_journal)
+
+    def flush_judge_status(self):
+        try:
+            self.judge_status.flush()
+        finally:
+            self.schedule(self.judge_status_interval, self.flush_judge_status)
+
+    def update_judge_speeds(self):
+        # The query can take a while, so it runs off the event loop.
+        threading.Thread(target=self._load_judge_speeds, daemon=True).start()
+        self.schedule(self.speed_interval, self.update_judge_speeds)
+
+    def _load_judge_speeds(self):
+        try:
+            self.judges.selector.speeds = load_judge_speeds(self.speed_samples)
+        except Exception:
+            logger.exception('Failed to load judge speeds')
+        finally:
+            db.connection.close()
 
     def ping_judge(self):
         try:
@@ -0,0 +1,194 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from django import db
+
+logger = logging.getLogger('judge.bridge')
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800)
+
+
+def _format_labels(names, values, extra=''):
+    labels = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+              for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{%s}' % ','.join(labels) if labels else ''
+
+
+class Counter(object):
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield '%s%s %s' % (self.name, _format_labels(self.labels, labels), value)
+
+
+class Histogram(object):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # labels: [count per bucket, then +Inf], sum
+        self.values = {}
+
+    def observe(self, value, *labels):
+        with self.lock:
+            try:
+                counts, total = self.values[labels]
+            except KeyError:
+                counts, total = [0] * (len(self.buckets) + 1), 0
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[labels] = counts, total + value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, *labels)
+
+    def render(self):
+        with self.lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self.values.items())
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '%s_bucket%s %d' % (self.name, _format_labels(self.labels, labels, 'le="%s"' % bound),
+                                          cumulative)
+            yield '%s_sum%s %s' % (self.name, _format_labels(self.labels, labels), total)
+            yield '%s_count%s %d' % (self.name, _format_labels(self.labels, labels), cumulative)
+
+
+class Gauge(object):
+    """A gauge read when metrics are collected, from a function returning {label values: value}."""
+    type = 'gauge'
+
+    def __init__(self, name, help, labels, collect):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def render(self):
+        for labels, value in sorted(self.collect().items()):
+            yield '%s%s %s' % (self.name, _format_labels(self.labels, labels), value)
+
+
+class BridgeMetrics(object):
+    """Live counters of the judge bridge, rendered in the Prometheus text format."""
+
+    def __init__(self, server):
+        self.queue_wait = Histogram('bridge_queue_wait_seconds', 'Time submissions spent queued for a judge.',
+                                    ('priority',))
+        self.compile = Histogram('bridge_compile_seconds',
+                                 'Time from a judge acknowledging a submission to grading or a compile error.')
+        self.grade = Histogram('bridge_grade_seconds', 'Time from grading beginning to grading ending.')
+        self.callback = Histogram('bridge_callback_seconds', 'Time spent handling judge packets.', ('packet',))
+        self.callback_db = Histogram('bridge_callback_db_seconds',
+                                     'Time spent in database queries while handling judge packets.', ('packet',))
+        self.judge_time = Counter('bridge_judge_seconds_total', 'Time judges spent busy and idle.',
+                                  ('judge', 'state'))
+        self.server = server
+        self.metrics = [
+            Gauge('bridge_queue_depth', 'Submissions queued for a judge.', ('priority',), self._queue_depth),
+            Gauge('bridge_judge_working', 'Whether each connected judge is grading.', ('judge',), self._working),
+            Gauge('bridge_write_buffer', 'Statistics of the buffered submission writes.', ('stat',),
+                  lambda: {(key,): value for key, value in server.writes.stats().items()
+                           if isinstance(value, (int, float))}),
+            Gauge('bridge_recompute_queue', 'Statistics of the background recompute queue.', ('stat',),
+                  lambda: {(key,): value for key, value in server.recompute.stats().items()
+                           if isinstance(value, (int, float))}),
+            self.queue_wait, self.compile, self.grade, self.callback, self.callback_db, self.judge_time,
+        ]
+        if hasattr(server, 'loop_stats'):
+            self.metrics.append(Gauge('bridge_event_loop', 'Event loop lag in seconds and pending worker calls.',
+                                      ('stat',), lambda: {(key,): value for key, value in server.loop_stats().items()}))
+
+    def _queue_depth(self):
+        judges = self.server.judges
+        with judges.lock:
+            return {(priority,): judges.queue.depth(priority) for priority in range(judges.priorities)}
+
+    def _working(self):
+        with self.server.judges.lock:
+            return {(judge.name,): int(judge.working) for judge in self.server.judges if judge.name}
+
+    @contextmanager
+    def time_packet(self, name):
+        """Times the handling of a judge packet, and separately the database queries it makes."""
+        queries = [0]
+
+        def measure(execute, sql, params, many, context):
+            start = time.monotonic()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries[0] += time.monotonic() - start
+
+        with self.callback.time(name), db.connection.execute_wrapper(measure):
+            yield
+        self.callback_db.observe(queries[0], name)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = list(metric.render())
+            except Exception:
+                logger.exception('Failed to collect metric: %s', metric.name)
+                continue
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines += samples
+        return '\n'.join(lines) + '\n'
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve_metrics(metrics, address):
+    """Serves the metrics over HTTP on a daemon thread, at any path."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _ThreadingHTTPServer(address, MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info('Serving metrics on %s:%d', *server.server_address[:2])
+    return server
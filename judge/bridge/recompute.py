@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+
+from django import db
+
+from judge import event_poster as event
+from judge.models import ContestParticipation, Profile
+
+logger = logging.getLogger('judge.bridge')
+
+
+class RecomputeQueue(object):
+    """
+    Runs expensive post-grading recomputations off the bridge's event loop.
+
+    Jobs are keyed by what they recompute, e.g. ('user', 42). A job waits `delay` seconds before running, and
+    scheduling a key that is already waiting does nothing, so a burst of submissions by one user results in a single
+    recomputation. A key is never run by two workers at once; scheduling it while it runs queues one more run.
+    """
+
+    def __init__(self, delay, workers=1):
+        self.delay = delay
+        self._pending = {}
+        self._running = set()
+        self._condition = threading.Condition()
+        self._stop = False
+
+        self.scheduled = 0
+        self.coalesced = 0
+        self.executed = 0
+        self.failed = 0
+        self.busy_time = 0.0
+
+        self._threads = [threading.Thread(target=self._work, name='recompute-%d' % i) for i in range(workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def schedule(self, key, func, *args):
+        with self._condition:
+            self.scheduled += 1
+            if key in self._pending:
+                self.coalesced += 1
+                return
+            self._pending[key] = (time.monotonic() + self.delay, func, args)
+            self._condition.notify()
+
+    def _next_job(self):
+        # Called with the condition held. Returns the key of a due job that is not already running, or the time to
+        # wait until one might be.
+        timeout = None
+        now = time.monotonic()
+        for key, (due, func, args) in self._pending.items():
+            if key in self._running:
+                continue
+            if due <= now or self._stop:
+                return key, None
+            timeout = due - now if timeout is None else min(timeout, due - now)
+        return None, timeout
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    key, timeout = self._next_job()
+                    if key is not None:
+                        break
+                    if self._stop and not self._pending:
+                        return
+                    self._condition.wait(timeout)
+                due, func, args = self._pending.pop(key)
+                self._running.add(key)
+
+            start = time.monotonic()
+            try:
+                db.close_old_connections()
+                func(*args)
+            except Exception:
+                self.failed += 1
+                logger.exception('Failed to recompute %r', key)
+                db.connection.close()
+            finally:
+                with self._condition:
+                    self.executed += 1
+                    self.busy_time += time.monotonic() - start
+                    self._running.discard(key)
+                    self._condition.notify_all()
+
+    def stop(self, timeout=None):
+        """Runs everything still pending without waiting out the delay, then stops the workers."""
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'pending': len(self._pending),
+                'running': len(self._running),
+                'scheduled': self.scheduled,
+                'coalesced': self.coalesced,
+                'executed': self.executed,
+                'failed': self.failed,
+                'busy_time': self.busy_time,
+            }
+
+
+def update_user_points(profile_id):
+    profile = Profile.objects.get(id=profile_id)
+    profile._updating_stats_only = True
+    profile.calculate_points()
+
+
+def update_participation(participation_id):
+    participation = ContestParticipation.objects.select_related('contest').get(id=participation_id)
+    participation.recompute_results()
+    event.post('contest_%d' % participation.contest_id, {'type': 'update'})
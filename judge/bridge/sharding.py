@@ -0,0 +1,131 @@
+import logging
+import threading
+
+from django import db
+from django.conf import settings
+from django.core.cache import cache
+
+from judge.judgeapi import BridgeError, BridgePool, SHARD_STATE_KEY, shard_connect_address
+from judge.models import Judge
+
+logger = logging.getLogger('judge.bridge')
+
+
+class ShardCoordinator(object):
+    """
+    Runs alongside a judge server that is one of several bridge shards. It periodically publishes the problems and
+    executors of the shard's judges and the length of its queue, which the site routes submissions by. When judges
+    of this shard are idle, it steals queued submissions they can judge from the most backed up other shard.
+
+    Coordination talks to the cache, the database and the other shards, so it runs on its own thread rather than as
+    a job of the server, where a slow peer would hold up every judge.
+    """
+
+    def __init__(self, server, index, shards, interval=2, steal_threshold=1, timeout=5, handoff_timeout=30):
+        self.server = server
+        self.index = index
+        self.interval = interval
+        self.steal_threshold = steal_threshold
+        self.handoff_timeout = handoff_timeout
+        self.peers = {peer: BridgePool(shard_connect_address(shard), 1, timeout)
+                      for peer, shard in enumerate(shards) if peer != index}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self.update()
+            if self._stop.wait(self.interval):
+                break
+
+    def _peer_states(self):
+        states = cache.get_many([SHARD_STATE_KEY % peer for peer in self.peers])
+        return {peer: states[SHARD_STATE_KEY % peer] for peer in self.peers if SHARD_STATE_KEY % peer in states}
+
+    def judges_elsewhere(self):
+        """Names of the judges the other shards last published as connected."""
+        return set().union(*(state['names'] for state in self._peer_states().values()))
+
+    def update(self):
+        try:
+            self.publish()
+            self.steal()
+            reclaimed = self.server.judges.reclaim_handoffs(self.handoff_timeout)
+            if reclaimed:
+                logger.warning('Requeued %d submissions that another bridge shard did not confirm taking', reclaimed)
+        except Exception:
+            logger.exception('Failed to coordinate with other bridge shards')
+            db.connection.close()
+
+    def _idle_judges(self):
+        return [judge for judge in self.server.judges if judge.name and not judge.working]
+
+    def publish(self):
+        judges = self.server.judges
+        with judges.lock:
+            connected = [judge for judge in judges if judge.name]
+            state = {
+                'names': [judge.name for judge in connected],
+                'judges': len(connected),
+                'idle': len(self._idle_judges()),
+                'queue': len(judges.queue),
+                'problems': set().union(*(judge.problems for judge in connected)),
+                'executors': set().union(*(judge.executors for judge in connected)),
+            }
+        cache.set(SHARD_STATE_KEY % self.index, state, self.interval * 3)
+        # Another shard starting up may have marked them offline before they were published.
+        if state['names'] and Judge.objects.filter(name__in=state['names'], online=False).update(online=True):
+            Judge.invalidate_problem_judges()
+
+    def steal(self):
+        with self.server.judges.lock:
+            idle = self._idle_judges()
+            if not idle:
+                return
+            problems = set().union(*(judge.problems for judge in idle))
+            executors = set().union(*(judge.executors for judge in idle))
+
+        backlog = [(state['queue'], peer) for peer, state in self._peer_states().items()
+                   if state['queue'] >= self.steal_threshold]
+        if not backlog:
+            return
+        victim = max(backlog)[1]
+        try:
+            response = self.peers[victim].request({
+                'name': 'steal-submissions', 'count': len(idle),
+                'problems': sorted(problems), 'executors': sorted(executors),
+            })
+        except (BridgeError, OSError):
+            logger.exception('Failed to steal submissions from bridge shard %d', victim)
+            return
+
+        submissions = response.get('submissions', [])
+        if not submissions:
+            return
+        for submission in submissions:
+            self.server.judges.judge(submission['submission-id'], submission['problem-id'], submission['language'],
+                                     submission['source'], submission['priority'], submission.get('user-id'),
+                                     submission.get('contest-key'))
+        logger.info('Stole %d submissions from bridge shard %d', len(submissions), victim)
+
+        # The other shard keeps the submissions in its journal until they are safely in ours. If it never hears back,
+        # it queues them again: a submission may then be judged twice, but is never lost.
+        if self.server.judges.journal is not None:
+            self.server.judges.journal.sync()
+        try:
+            self.peers[victim].request({
+                'name': 'steal-confirm', 'submission-ids': [submission['submission-id'] for submission in submissions],
+            })
+        except (BridgeError, OSError):
+            logger.exception('Failed to confirm stealing submissions from bridge shard %d', victim)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        cache.delete(SHARD_STATE_KEY % self.index)
+        for pool in self.peers.values():
+            pool.close()
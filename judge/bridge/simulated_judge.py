@@ -0,0 +1,151 @@
+import json
+import logging
+import queue
+import random
+import socket
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger('judge.bridge')
+
+size_pack = struct.Struct('!I')
+
+
+class SimulatedJudge(object):
+    """
+    A judge that speaks the bridge protocol without running anything: it acknowledges each submission, then reports
+    grading, every test case and the end of grading, taking the given time per case. Packets are read on one thread
+    and submissions graded on another, so that pings are answered while grading.
+
+    `on_request` and `on_end` are called with the submission id when a submission is received and when grading ends.
+    """
+
+    def __init__(self, address, name, key, problems, executors, cases=10, case_time=0.01, compile_time=0,
+                 fail_rate=0, seed=None, on_request=None, on_end=None):
+        self.address = address
+        self.name = name
+        self.key = key
+        self.problems = problems
+        self.executors = executors
+        self.cases = cases
+        self.case_time = case_time
+        self.compile_time = compile_time
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.on_request = on_request
+        self.on_end = on_end
+        self.graded = 0
+        self._socket = None
+        self._send_lock = threading.Lock()
+        self._submissions = queue.Queue()
+        self._aborted = threading.Event()
+
+    def _read_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise EOFError('connection to bridge closed')
+            data += chunk
+        return data
+
+    def read(self):
+        size, = size_pack.unpack(self._read_exactly(size_pack.size))
+        return json.loads(zlib.decompress(self._read_exactly(size)).decode('utf-8'))
+
+    def send(self, packet):
+        data = zlib.compress(json.dumps(packet, separators=(',', ':')).encode('utf-8'))
+        with self._send_lock:
+            self._socket.sendall(size_pack.pack(len(data)) + data)
+
+    def connect(self):
+        """Connects and completes the handshake, then starts grading on background threads."""
+        self._socket = socket.create_connection(self.address)
+        self.send({
+            'name': 'handshake',
+            'id': self.name,
+            'key': self.key,
+            'problems': [[problem, 0] for problem in self.problems],
+            'executors': {executor: [['simulated', [1, 0]]] for executor in self.executors},
+        })
+        response = self.read()
+        if response.get('name') != 'handshake-success':
+            raise ValueError('judge %s failed to authenticate: %r' % (self.name, response))
+        threading.Thread(target=self._read_loop, daemon=True).start()
+        threading.Thread(target=self._grade_loop, daemon=True).start()
+
+    def close(self):
+        self._submissions.put(None)
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+
+    def _read_loop(self):
+        try:
+            while True:
+                packet = self.read()
+                name = packet.get('name')
+                if name == 'submission-request':
+                    if self.on_request is not None:
+                        self.on_request(packet['submission-id'])
+                    self._aborted.clear()
+                    self.send({'name': 'submission-acknowledged', 'submission-id': packet['submission-id']})
+                    self._submissions.put(packet['submission-id'])
+                elif name == 'terminate-submission':
+                    self._aborted.set()
+                elif name == 'ping':
+                    self.send({'name': 'ping-response', 'when': packet['when'], 'time': time.time(), 'load': 0})
+                elif name == 'disconnect':
+                    break
+        except (EOFError, OSError):
+            pass
+        finally:
+            self._submissions.put(None)
+
+    def _sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds * self.random.uniform(0.5, 1.5))
+
+    def _grade_loop(self):
+        try:
+            while True:
+                id = self._submissions.get()
+                if id is None:
+                    break
+                self._grade(id)
+        except OSError:
+            logger.exception('Simulated judge %s lost its connection', self.name)
+
+    def _grade(self, id):
+        self._sleep(self.compile_time)
+        self.send({'name': 'grading-begin', 'submission-id': id, 'pretested': False})
+        for position in range(1, self.cases + 1):
+            if self._aborted.is_set():
+                self.send({'name': 'submission-terminated', 'submission-id': id})
+                return
+            self._sleep(self.case_time)
+            failed = self.random.random() < self.fail_rate
+            self.send({
+                'name': 'test-case-status',
+                'submission-id': id,
+                'cases': [{
+                    'position': position,
+                    'status': 1 if failed else 0,
+                    'time': self.case_time,
+                    'memory': 1024,
+                    'points': 0 if failed else 1,
+                    'total-points': 1,
+                    'output': '',
+                    'feedback': '',
+                    'extended-feedback': '',
+                }],
+            })
+        self.send({'name': 'grading-end', 'submission-id': id})
+        self.graded += 1
+        if self.on_end is not None:
+            self.on_end(id)
@@ -0,0 +1,230 @@
+import logging
+import time
+from collections import Counter, defaultdict
+from threading import RLock
+
+from django import db
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, FloatField, Value, When
+
+from judge.models import Judge, Submission, SubmissionResultCount, SubmissionTestCase
+
+logger = logging.getLogger('judge.bridge')
+
+
+class SubmissionWriteBuffer(object):
+    """
+    Write-behind buffer for the bridge's per-test-case database writes.
+
+    Test case rows and column updates on in-flight submissions are collected across all judges and written with one
+    multi-row INSERT and one UPDATE per column at each flush, instead of a few round trips per packet. Flushes happen
+    on a timer, when the buffer holds too many rows, and explicitly whenever a submission finishes.
+    """
+
+    max_failures = 3
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = RLock()
+        self._test_cases = defaultdict(list)
+        self._updates = defaultdict(dict)
+        self._pending = 0
+        self._failures = 0
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.updates_written = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.flush_time = 0.0
+        self.started = time.monotonic()
+
+    def __len__(self):
+        return self._pending
+
+    def add_test_cases(self, id, test_cases):
+        with self.lock:
+            self._test_cases[id].extend(test_cases)
+            self._pending += len(test_cases)
+            if self._pending >= self.size:
+                self.flush()
+
+    def update(self, id, **fields):
+        with self.lock:
+            self._updates[id].update(fields)
+
+    def discard(self, id):
+        with self.lock:
+            self._pending -= len(self._test_cases.pop(id, ()))
+            self._updates.pop(id, None)
+
+    def flush(self):
+        with self.lock:
+            if not self._test_cases and not self._updates:
+                return
+
+            start = time.monotonic()
+            try:
+                rows, updates = self._write(self._test_cases, self._updates)
+            except Exception:
+                self._failures += 1
+                logger.exception('Failed to flush %d buffered test cases (attempt %d)', self._pending, self._failures)
+                db.connection.close()
+                if self._failures < self.max_failures:
+                    # The batch is kept, and written with the next flush.
+                    return
+                rows, updates = self._write_each()
+            self.flushes += 1
+            self.rows_written += rows
+            self.updates_written += updates
+            self.last_batch_size = rows
+            self.max_batch_size = max(self.max_batch_size, rows)
+            self.flush_time += time.monotonic() - start
+            logger.debug('Flushed %d test cases and %d submission updates in %.3fs',
+                         rows, updates, time.monotonic() - start)
+
+            self._test_cases = defaultdict(list)
+            self._updates = defaultdict(dict)
+            self._pending = 0
+            self._failures = 0
+
+    def _write_each(self):
+        # A batch keeps failing, most likely because of the rows of one submission, so each submission is written on
+        # its own and only the ones that still fail are dropped.
+        rows = updates = 0
+        for id in sorted(set(self._test_cases) | set(self._updates)):
+            test_cases = {id: self._test_cases[id]} if id in self._test_cases else {}
+            fields = {id: self._updates[id]} if id in self._updates else {}
+            try:
+                written = self._write(test_cases, fields)
+            except Exception:
+                logger.exception('Dropping %d buffered test cases and updates %r for submission %d',
+                                 len(test_cases.get(id, ())), fields.get(id), id)
+                db.connection.close()
+            else:
+                rows += written[0]
+                updates += written[1]
+        return rows, updates
+
+    def _write(self, test_cases, updates):
+        ids = set(test_cases) | set(updates)
+        existing = set(Submission.objects.filter(id__in=ids).values_list('id', flat=True))
+        for id in ids - existing:
+            logger.warning('Unknown submission: %d', id)
+
+        fields = defaultdict(dict)
+        for id, values in updates.items():
+            if id in existing:
+                for field, value in values.items():
+                    fields[field][id] = value
+        rows = [case for id, cases in test_cases.items() if id in existing for case in cases]
+
+        with transaction.atomic():
+            for field, values in fields.items():
+                Submission.objects.filter(id__in=list(values)).update(**{
+                    field: Case(*[When(id=id, then=Value(value)) for id, value in values.items()],
+                                output_field=Submission._meta.get_field(field)),
+                })
+            SubmissionTestCase.objects.bulk_create(rows)
+        return len(rows), len(existing.intersection(updates))
+
+    def stats(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                'pending': self._pending,
+                'flushes': self.flushes,
+                'flush_rate': self.flushes / elapsed if elapsed else 0,
+                'rows_written': self.rows_written,
+                'updates_written': self.updates_written,
+                'last_batch_size': self.last_batch_size,
+                'max_batch_size': self.max_batch_size,
+                'mean_batch_size': self.rows_written / self.flushes if self.flushes else 0,
+                'flush_time': self.flush_time,
+            }
+
+
+class JudgeStatusBuffer(object):
+    """
+    The latest ping and load of every connected judge.
+
+    Samples are written to the database for all judges that reported since the last flush with a single UPDATE, and
+    each flush publishes a snapshot of the live values to the cache under `cache_key`, or a key of its own for each
+    bridge shard, where the status pages read them instead of the database.
+    """
+
+    cache_key = 'bridge:judge_status'
+
+    def __init__(self, cache_timeout=60, cache_key=cache_key):
+        self.cache_timeout = cache_timeout
+        self.cache_key = cache_key
+        self.lock = RLock()
+        self._status = {}
+        self._pending = set()
+
+    @classmethod
+    def shard_cache_key(cls, shard=None):
+        """The key a bridge shard, or an unsharded bridge for None, publishes its snapshot under."""
+        return cls.cache_key if shard is None else '%s:%d' % (cls.cache_key, shard)
+
+    def update(self, name, ping, load):
+        with self.lock:
+            self._status[name] = ping, load
+            self._pending.add(name)
+
+    def remove(self, name):
+        with self.lock:
+            self._status.pop(name, None)
+            self._pending.discard(name)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self._status)
+
+    def flush(self):
+        with self.lock:
+            pending = {name: self._status[name] for name in self._pending}
+            self._pending = set()
+            snapshot = dict(self._status)
+
+        if pending:
+            try:
+                Judge.objects.filter(name__in=list(pending)).update(
+                    ping=Case(*[When(name=name, then=Value(ping)) for name, (ping, load) in pending.items()],
+                              output_field=FloatField()),
+                    load=Case(*[When(name=name, then=Value(load)) for name, (ping, load) in pending.items()],
+                              output_field=FloatField()),
+                )
+            except Exception:
+                logger.exception('Failed to write ping and load of %d judges', len(pending))
+                db.connection.close()
+        cache.set(self.cache_key, snapshot, self.cache_timeout)
+
+
+class ResultCountBuffer(object):
+    """
+    Changes to the submission result counts from submissions the bridge finished, added up between flushes, so that
+    a burst of results in the same scopes costs a couple of queries instead of several per submission.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self._deltas = Counter()
+
+    def change(self, problem_id, user_id, contest_id, language_id, old, new):
+        with self.lock:
+            SubmissionResultCount.count_change(self._deltas, problem_id, user_id, contest_id, language_id, old, new)
+
+    def flush(self):
+        with self.lock:
+            deltas, self._deltas = self._deltas, Counter()
+        if not deltas:
+            return
+        try:
+            SubmissionResultCount.apply(deltas)
+        except Exception:
+            logger.exception('Failed to write %d result count changes', len(deltas))
+            db.connection.close()
+            with self.lock:
+                self._deltas.update(deltas)
@@ -1,6 +1,5 @@
 from datetime import timedelta
 from django.core.exceptions import ValidationError
-from django.db.models import Max, Min
 from django.template.defaultfilters import floatformat
 from django.urls import reverse
 from django.utils.functional import cached_property
@@ -49,48 +48,49 @@ class DefaultContestFormat(BaseContestFormat):
         self.config.update(config or {})
         self.contest = contest
 
-    def update_participation(self, participation):
-        querysets = None
-
-        if self.contest.freeze_scoreboard_after:
-            querysets = [
-                participation.submissions.filter(submission__date__lt=self.contest.freeze_scoreboard_after),
-                participation.submissions
-            ]
-        else:
-            querysets = [participation.submissions]
-
-        data = [ContestParticipationData() for _ in range(len(querysets))]
-
-
-        for i, queryset in enumerate(querysets):
-            for result_only_point in queryset.values('problem_id').annotate(points=Max('points')):
-                result = queryset.filter(
-                    problem_id=result_only_point['problem_id'],
-                    points=result_only_point['points']
-                ).order_by('submission__date').first()
-
-                result = {
-                    'time': result.submission.date,
-                    'points': result_only_point['points'],
-                    'problem_id': result_only_point['problem_id'],
-                }
+    penalized_results = frozenset(('WA', 'TLE', 'MLE', 'OLE', 'IR', 'RTE'))
 
-                ws_count = queryset.filter(problem_id=result['problem_id'], submission__date__lt=result['time'],
-                    submission__result__in=['WA', 'TLE', 'MLE', 'OLE', 'IR', 'RTE']).count() if self.config['penalty'] > 0 else 0
-
-                dt = (result['time'] - participation.start).total_seconds()
-
-                if result['points']:
-                    data[i].cumtime += dt + (ws_count * self.config['penalty'] * 60)
-
-                data[i].format_data[str(result['problem_id'])] = {'time': dt, 'points': result['points'], 'penalty': ws_count}
-
-                data[i].points += result['points']
-
-        participation.cumtime = max(data[-1].cumtime, 0)
-        participation.score = data[-1].points
-        participation.format_data = data[-1].format_data
+    def update_participation(self, participation):
+        # Both the live and the frozen results are computed from one date-ordered pass over the participation's
+        # submissions. For each problem we keep the earliest submission with the highest score, and the number of
+        # penalized submissions made strictly before it.
+        freeze_after = self.contest.freeze_scoreboard_after
+        penalize = self.config['penalty'] > 0
+        best = [{}, {}]
+        penalties = [{}, {}]
+
+        submissions = participation.submissions.order_by('submission__date', 'id') \
+                                   .values_list('problem_id', 'points', 'submission__date', 'submission__result')
+        for problem_id, points, date, result in submissions:
+            for i in (0, 1) if freeze_after is not None and date < freeze_after else (1,):
+                current = best[i].get(problem_id)
+                if current is None or points > current[0]:
+                    penalty = 0
+                    if penalize and problem_id in penalties[i]:
+                        count, last_date, at_last_date = penalties[i][problem_id]
+                        penalty = count - at_last_date if last_date == date else count
+                    best[i][problem_id] = points, date, penalty
+
+                if penalize and result in self.penalized_results:
+                    count, last_date, at_last_date = penalties[i].get(problem_id, (0, None, 0))
+                    penalties[i][problem_id] = count + 1, date, at_last_date + 1 if last_date == date else 1
+
+        data = [ContestParticipationData() for _ in best]
+        for i, problems in enumerate(best):
+            for problem_id in sorted(problems):
+                points, date, penalty = problems[problem_id]
+                dt = (date - participation.start).total_seconds()
+                if points:
+                    data[i].cumtime += dt + (penalty * self.config['penalty'] * 60)
+                data[i].format_data[str(problem_id)] = {'time': dt, 'points': points, 'penalty': penalty}
+                data[i].points += points
+
+        if freeze_after is None:
+            data[0] = data[1]
+
+        participation.cumtime = max(data[1].cumtime, 0)
+        participation.score = data[1].points
+        participation.format_data = data[1].format_data
 
         participation.frozen_cumtime = max(data[0].cumtime, 0)
         participation.frozen_score = data[0].points
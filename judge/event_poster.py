@@ -1,15 +1,18 @@
 from django.conf import settings
 
-__all__ = ['last', 'post']
+__all__ = ['last', 'post', 'use_async']
 
 if not getattr(settings, 'EVENT_DAEMON_USE', False):
     real = False
 
-    def post(channel, message):
+    def post(channel, message, key=None):
         return 0
 
     def last():
         return 0
+
+    def use_async(enabled=True):
+        pass
 else:
-    from .event_poster_ws import last, post
+    from .event_poster_ws import last, post, use_async
     real = True
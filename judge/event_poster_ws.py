@@ -1,12 +1,18 @@
+import atexit
 import json
+import logging
+import os
 import socket
 import threading
+import time
+from collections import OrderedDict
 
 from django.conf import settings
 from websocket import WebSocketException, create_connection
 
-__all__ = ['EventPostingError', 'EventPoster', 'post', 'last']
+__all__ = ['EventPostingError', 'EventPoster', 'AsyncEventPoster', 'post', 'last', 'use_async']
 _local = threading.local()
+logger = logging.getLogger('judge.event_poster')
 
 
 class EventPostingError(RuntimeError):
@@ -39,6 +45,23 @@ class EventPoster(object):
             self._connect()
             return self.post(channel, message, tries + 1)
 
+    def post_batch(self, messages, tries=0):
+        try:
+            self._conn.send(json.dumps({
+                'command': 'post-batch',
+                'messages': [{'channel': channel, 'message': message} for channel, message in messages],
+            }))
+            resp = json.loads(self._conn.recv())
+            if resp['status'] == 'error':
+                raise EventPostingError(resp['code'])
+            else:
+                return resp['ids']
+        except WebSocketException:
+            if tries > 10:
+                raise
+            self._connect()
+            return self.post_batch(messages, tries + 1)
+
     def last(self, tries=0):
         try:
             self._conn.send('{"command": "last-msg"}')
@@ -54,13 +77,125 @@ class EventPoster(object):
             return self.last(tries + 1)
 
 
+class AsyncEventPoster(object):
+    """
+    Posts events from a background thread, so that callers never wait for the event daemon. Queued messages are sent
+    in batches of up to `batch_size` per frame. A message posted with a key replaces the queued message with the same
+    key if that has not been sent yet, and when more than `queue_size` messages are waiting, the oldest are dropped.
+    A batch that fails to reach the daemon goes back to the front of the queue, to be retried after `retry_delay`
+    seconds. A batch the daemon rejects is logged and dropped, since sending it again would fail the same way.
+    """
+
+    def __init__(self, batch_size=100, queue_size=10000, retry_delay=1):
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.retry_delay = retry_delay
+        self._queue = OrderedDict()
+        self._sequence = 0
+        self._cond = threading.Condition()
+        self._sending = False
+        self._pid = None
+        self.stats = {'posted': 0, 'merged': 0, 'dropped': 0, 'sent': 0, 'batches': 0, 'failed': 0, 'rejected': 0}
+
+    def post(self, channel, message, key=None):
+        with self._cond:
+            self._start()
+            self.stats['posted'] += 1
+            if key is not None and key in self._queue:
+                self._queue[key] = channel, message
+                self.stats['merged'] += 1
+                return 0
+            if key is None:
+                self._sequence += 1
+                key = self._sequence
+            self._queue[key] = channel, message
+            if len(self._queue) > self.queue_size:
+                self._queue.popitem(last=False)
+                self.stats['dropped'] += 1
+            self._cond.notify()
+        return 0
+
+    def _start(self):
+        # The sender thread does not survive a fork, so each process starts its own.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._queue.clear()
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def _take(self):
+        with self._cond:
+            while not self._queue:
+                self._sending = False
+                self._cond.notify_all()
+                self._cond.wait()
+            self._sending = True
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popitem(last=False))
+            return batch
+
+    def _requeue(self, batch):
+        with self._cond:
+            for key, item in reversed(batch):
+                # A newer message posted with the same key while sending replaces this one.
+                if key not in self._queue:
+                    self._queue[key] = item
+                    self._queue.move_to_end(key, last=False)
+            while len(self._queue) > self.queue_size:
+                self._queue.popitem(last=False)
+                self.stats['dropped'] += 1
+
+    def _run(self):
+        poster = None
+        while True:
+            batch = self._take()
+            try:
+                if poster is None:
+                    poster = EventPoster()
+                poster.post_batch([item for key, item in batch])
+            except EventPostingError:
+                logger.exception('Event daemon rejected %d events', len(batch))
+                with self._cond:
+                    self.stats['rejected'] += len(batch)
+            except (WebSocketException, socket.error):
+                logger.exception('Failed to post %d events', len(batch))
+                poster = None
+                with self._cond:
+                    self.stats['failed'] += len(batch)
+                self._requeue(batch)
+                time.sleep(self.retry_delay)
+            else:
+                with self._cond:
+                    self.stats['sent'] += len(batch)
+                    self.stats['batches'] += 1
+
+    def flush(self, timeout=None):
+        """Waits until every queued message was sent, or for at most `timeout` seconds."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._sending, timeout)
+
+
+_async_poster = AsyncEventPoster(getattr(settings, 'EVENT_DAEMON_BATCH_SIZE', 100),
+                                 getattr(settings, 'EVENT_DAEMON_QUEUE_SIZE', 10000))
+_async = False
+atexit.register(_async_poster.flush, 5)
+
+
+def use_async(enabled=True):
+    """Makes `post` queue events for the background sender instead of waiting for the daemon to take them."""
+    global _async
+    _async = enabled
+
+
 def _get_poster():
     if 'poster' not in _local.__dict__:
         _local.poster = EventPoster()
     return _local.poster
 
 
-def post(channel, message):
+def post(channel, message, key=None):
+    if _async:
+        return _async_poster.post(channel, message, key)
     try:
         return _get_poster().post(channel, message)
     except (WebSocketException, socket.error):
@@ -1,10 +1,18 @@
+import itertools
 import json
 import logging
+import os
 import socket
 import struct
+import threading
 import zlib
+from collections import Counter
+from operator import attrgetter
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, When
 
 from judge import event_poster as event
 
@@ -21,48 +29,273 @@ def _post_update_submission(submission, done=False):
                                    'status': submission.status, 'language': submission.language.key})
 
 
+class BridgeError(Exception):
+    pass
+
+
+class BridgeConnection(object):
+    """
+    A persistent connection to the bridge. Requests carry a request id and may be pipelined from any number of
+    threads; replies are matched back to them by that id. There is no reader thread: whichever waiting thread finds
+    the socket idle reads replies until its own arrives, handing the others over as it goes.
+    """
+
+    def __init__(self, address, timeout):
+        self.sock = socket.create_connection(address, timeout)
+        self.send_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.replies = {}
+        self.ignored = set()
+        self.in_flight = 0
+        self.reading = False
+        self.error = None
+        self.used = False
+        self.ids = itertools.count()
+
+    def send(self, packet, reply=True):
+        with self.condition:
+            if self.error is not None:
+                raise self.error
+            request_id = next(self.ids)
+            if reply:
+                self.in_flight += 1
+            else:
+                self.ignored.add(request_id)
+
+        packet = dict(packet)
+        packet['request-id'] = request_id
+        output = zlib.compress(json.dumps(packet, separators=(',', ':')).encode('utf-8'))
+        try:
+            with self.send_lock:
+                self.sock.sendall(size_pack.pack(len(output)) + output)
+        except Exception as e:
+            self.fail(e)
+            raise self.error
+        return request_id
+
+    def receive(self, request_id):
+        try:
+            while True:
+                with self.condition:
+                    while request_id not in self.replies and self.error is None and self.reading:
+                        self.condition.wait()
+                    if request_id in self.replies:
+                        self.used = True
+                        return self.replies.pop(request_id)
+                    if self.error is not None:
+                        raise self.error
+                    self.reading = True
+
+                try:
+                    reply = self._read_packet()
+                except Exception as e:
+                    self.fail(e)
+                    raise self.error
+
+                with self.condition:
+                    self.reading = False
+                    reply_id = reply.pop('request-id', None)
+                    if reply_id in self.ignored:
+                        self.ignored.discard(reply_id)
+                    else:
+                        self.replies[reply_id] = reply
+                    self.condition.notify_all()
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+
+    def _read_exactly(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise BridgeError('Judge did not respond')
+            data += chunk
+        return bytes(data)
+
+    def _read_packet(self):
+        length = size_pack.unpack(self._read_exactly(size_pack.size))[0]
+        return json.loads(zlib.decompress(self._read_exactly(length)).decode('utf-8'))
+
+    def fail(self, error):
+        with self.condition:
+            if self.error is None:
+                self.error = error if isinstance(error, BridgeError) else BridgeError(error)
+                self.reading = False
+                self.condition.notify_all()
+        self.close()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class BridgePool(object):
+    """
+    A per-process pool of persistent bridge connections. New connections are only opened while every open one
+    has requests in flight, up to the pool size.
+    """
+
+    def __init__(self, address, size, timeout):
+        self.address = address
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.connections = []
+        self.pid = os.getpid()
+
+    def _connection(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # Forked workers must not share the parent's sockets.
+                self.connections = []
+                self.pid = os.getpid()
+            self.connections = [conn for conn in self.connections if conn.error is None]
+            idle = [conn for conn in self.connections if not conn.in_flight]
+            if idle:
+                return idle[0]
+            if len(self.connections) < self.size:
+                conn = BridgeConnection(self.address, self.timeout)
+                self.connections.append(conn)
+                return conn
+            return min(self.connections, key=attrgetter('in_flight'))
+
+    def request(self, packet, reply=True):
+        while True:
+            conn = self._connection()
+            try:
+                request_id = conn.send(packet, reply)
+                return conn.receive(request_id) if reply else None
+            except BridgeError:
+                # A connection that has served requests before most likely went stale because the bridge
+                # restarted. Requests are idempotent, so retry on a fresh connection; fail if that one fails too.
+                if not conn.used:
+                    raise
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+
+
+# Each bridge shard publishes the problems and executors of its judges and the length of its queue under this key.
+SHARD_STATE_KEY = 'bridge:shard:%d'
+
+
+def shard_connect_address(shard):
+    return shard.get('django_connect') or shard['django_address'][0]
+
+
+class ShardRouter(object):
+    """
+    Spreads bridge requests over several bridge shards. A submission goes to the least loaded shard with a judge
+    that has its problem and executor, judged by the state each shard publishes to the cache, or to a shard picked
+    by its problem when none does. Requests about a submission or judge whose shard is unknown go to every shard.
+    """
+
+    def __init__(self, shards, size, timeout):
+        self.pools = [BridgePool(shard_connect_address(shard), size, timeout) for shard in shards]
+
+    def states(self):
+        states = cache.get_many([SHARD_STATE_KEY % index for index in range(len(self.pools))])
+        return [states.get(SHARD_STATE_KEY % index) for index in range(len(self.pools))]
+
+    def candidates(self, problem, language, states):
+        """Shards to send a submission to, best first."""
+        capable = [((state['queue'] - state['idle']) / max(state['judges'], 1), index)
+                   for index, state in enumerate(states)
+                   if state is not None and problem in state['problems'] and language in state['executors']]
+        order = [index for load, index in sorted(capable)]
+        start = zlib.crc32(problem.encode('utf-8')) % len(self.pools)
+        return order + [index % len(self.pools) for index in range(start, start + len(self.pools))
+                        if index % len(self.pools) not in order]
+
+    def _request(self, indices, packet):
+        # Falls back to the next shard if one is down.
+        for index in indices[:-1]:
+            try:
+                return self.pools[index].request(packet)
+            except (BridgeError, OSError):
+                logger.exception('Bridge shard %d failed', index)
+        return self.pools[indices[-1]].request(packet)
+
+    def submit(self, packet):
+        states = self.states()
+        if 'submissions' not in packet:
+            return self._request(self.candidates(packet['problem-id'], packet['language'], states), packet)
+
+        shards = {}
+        for submission in packet['submissions']:
+            indices = tuple(self.candidates(submission['problem-id'], submission['language'], states))
+            shards.setdefault(indices, []).append(submission)
+
+        received, rejected = [], []
+        for indices, submissions in shards.items():
+            try:
+                response = self._request(indices, dict(packet, submissions=submissions))
+            except (BridgeError, OSError):
+                logger.exception('Failed to send %d submissions to any bridge shard', len(submissions))
+                rejected += [submission['submission-id'] for submission in submissions]
+            else:
+                received += response.get('submission-ids', [])
+                rejected += response.get('rejected-ids', [])
+        return {'name': 'submission-received', 'submission-ids': received, 'rejected-ids': rejected}
+
+    def broadcast(self, packet, reply=True):
+        responses = []
+        for index, pool in enumerate(self.pools):
+            try:
+                responses.append(pool.request(packet, reply))
+            except (BridgeError, OSError):
+                logger.exception('Bridge shard %d failed', index)
+        if not responses:
+            raise BridgeError('No bridge shard responded')
+        return responses
+
+    def request(self, packet, reply=True):
+        if packet['name'] == 'submission-request':
+            return self.submit(packet)
+        responses = self.broadcast(packet, reply)
+        if packet['name'] == 'terminate-submission':
+            # Only the shard that has the submission can have aborted it.
+            return max(responses, key=lambda response: response.get('judge-aborted', True))
+        return responses[0]
+
+
+_pool = BridgePool(getattr(settings, 'BRIDGED_DJANGO_CONNECT', None) or settings.BRIDGED_DJANGO_ADDRESS[0],
+                   getattr(settings, 'BRIDGED_DJANGO_POOL_SIZE', 4), getattr(settings, 'BRIDGED_DJANGO_TIMEOUT', 60))
+_router = None
+if getattr(settings, 'BRIDGED_SHARDS', None):
+    _router = ShardRouter(settings.BRIDGED_SHARDS, getattr(settings, 'BRIDGED_DJANGO_POOL_SIZE', 4),
+                          getattr(settings, 'BRIDGED_DJANGO_TIMEOUT', 60))
+
+
 def judge_request(packet, reply=True):
-    sock = socket.create_connection(getattr(settings, 'BRIDGED_DJANGO_CONNECT', None) or
-                                    settings.BRIDGED_DJANGO_ADDRESS[0])
-
-    output = json.dumps(packet, separators=(',', ':'))
-    output = zlib.compress(output.encode('utf-8'))
-    writer = sock.makefile('wb')
-    writer.write(size_pack.pack(len(output)))
-    writer.write(output)
-    writer.close()
-
-    if reply:
-        reader = sock.makefile('rb', -1)
-        input = reader.read(size_pack.size)
-        if not input:
-            raise ValueError('Judge did not respond')
-        length = size_pack.unpack(input)[0]
-        input = reader.read(length)
-        if not input:
-            raise ValueError('Judge did not respond')
-        reader.close()
-        sock.close()
-
-        result = json.loads(zlib.decompress(input).decode('utf-8'))
-        return result
+    if _router is not None:
+        return _router.request(packet, reply)
+    return _pool.request(packet, reply)
 
 
-def judge_submission(submission, rejudge, batch_rejudge=False):
-    from .models import ContestSubmission, Submission, SubmissionTestCase
+CONTEST_SUBMISSION_PRIORITY = 0
+DEFAULT_PRIORITY = 1
+REJUDGE_PRIORITY = 2
+BATCH_REJUDGE_PRIORITY = 3
 
-    CONTEST_SUBMISSION_PRIORITY = 0
-    DEFAULT_PRIORITY = 1
-    REJUDGE_PRIORITY = 2
-    BATCH_REJUDGE_PRIORITY = 3
+
+def judge_submission(submission, rejudge, batch_rejudge=False):
+    from .models import ContestSubmission, Submission, SubmissionResultCount, SubmissionTestCase
 
     updates = {'time': None, 'memory': None, 'points': None, 'result': None, 'error': None,
                'was_rejudged': rejudge, 'status': 'QU'}
+    contest = None
     try:
         # This is set proactively; it might get unset in judgecallback's on_grading_begin if the problem doesn't
         # actually have pretests stored on the judge.
-        updates['is_pretested'] = ContestSubmission.objects.filter(submission=submission) \
-            .values_list('problem__contest__run_pretests_only', flat=True)[0]
+        updates['is_pretested'], contest = ContestSubmission.objects.filter(submission=submission) \
+            .values_list('problem__contest__run_pretests_only', 'problem__contest__key')[0]
     except IndexError:
         priority = DEFAULT_PRIORITY
     else:
@@ -76,8 +309,18 @@ def judge_submission(submission, rejudge, batch_rejudge=False):
     # as that would prevent people from knowing a submission is being scheduled for rejudging.
     # It is worth noting that this mechanism does not prevent a new rejudge from being scheduled
     # while already queued, but that does not lead to data corruption.
+    previous = rejudge and Submission.objects.filter(id=submission.id).values_list(
+        'result', 'points', 'problem__points', 'user__is_unlisted').first()
     if not Submission.objects.filter(id=submission.id).exclude(status__in=('P', 'G')).update(**updates):
         return False
+    if previous:
+        # Until it is graded again, the rejudged submission's result is no longer counted, and if it was accepted,
+        # it no longer counts towards the problem's statistics.
+        result, points, problem_points, is_unlisted = previous
+        if result == 'AC' and not is_unlisted and points is not None and points >= problem_points:
+            submission.problem.adjust_stats(accepted=-1)
+        SubmissionResultCount.record(submission.problem_id, submission.user_id, submission.contest_object_id,
+                                     submission.language_id, result, None)
 
     SubmissionTestCase.objects.filter(submission_id=submission.id).delete()
 
@@ -89,29 +332,113 @@ def judge_submission(submission, rejudge, batch_rejudge=False):
             'language': submission.language.key,
             'source': submission.source.source,
             'priority': BATCH_REJUDGE_PRIORITY if batch_rejudge else REJUDGE_PRIORITY if rejudge else priority,
+            'user-id': submission.user_id,
+            'contest-key': contest,
         })
     except BaseException:
         logger.exception('Failed to send request to judge')
         Submission.objects.filter(id=submission.id).update(status='IE')
         success = False
     else:
-        if response['name'] != 'submission-received' or response['submission-id'] != submission.id:
+        if response.get('name') != 'submission-received' or response.get('submission-id') != submission.id:
             Submission.objects.filter(id=submission.id).update(status='IE')
         _post_update_submission(submission)
         success = True
     return success
 
 
+def judge_submissions(submission_ids, rejudge, batch_rejudge=False):
+    """
+    Does what judge_submission does for a chunk of submissions at once, with one UPDATE and one DELETE for all of
+    them, one query for their sources and a single bridge request. Returns the ids of the submissions queued.
+    """
+    from .models import ContestSubmission, Problem, Submission, SubmissionResultCount, SubmissionSource, \
+        SubmissionTestCase
+
+    contest = {id: (pretests, key) for id, pretests, key in
+               ContestSubmission.objects.filter(submission_id__in=submission_ids)
+                                .values_list('submission_id', 'problem__contest__run_pretests_only',
+                                             'submission__contest_object__key')}
+
+    with transaction.atomic():
+        # The rows are locked first so that we know which ones the conditional update is going to change.
+        ids = list(Submission.objects.filter(id__in=submission_ids).exclude(status__in=('P', 'G'))
+                                     .select_for_update().values_list('id', flat=True))
+        if not ids:
+            return []
+        submissions = list(Submission.objects.filter(id__in=ids).values_list(
+            'id', 'problem_id', 'problem__code', 'problem__is_public', 'user_id', 'language__key',
+            'result', 'points', 'problem__points', 'user__is_unlisted', 'contest_object_id', 'language_id',
+        ))
+
+        Submission.objects.filter(id__in=ids).update(
+            time=None, memory=None, points=None, result=None, error=None, was_rejudged=rejudge, status='QU',
+            is_pretested=Case(
+                When(id__in=[id for id in ids if id in contest and contest[id][0]], then=True),
+                When(id__in=[id for id in ids if id in contest and not contest[id][0]], then=False),
+                default=F('is_pretested'),
+            ),
+        )
+
+    SubmissionTestCase.objects.filter(submission_id__in=ids).delete()
+    sources = dict(SubmissionSource.objects.filter(submission_id__in=ids).values_list('submission_id', 'source'))
+
+    requests = []
+    accepted = Counter()
+    results = Counter()
+    for id, problem_id, code, is_public, user_id, language, result, points, problem_points, is_unlisted, \
+            contest_id, language_id in submissions:
+        requests.append({
+            'submission-id': id,
+            'problem-id': code,
+            'language': language,
+            'source': sources.get(id, ''),
+            'priority': BATCH_REJUDGE_PRIORITY if batch_rejudge else REJUDGE_PRIORITY if rejudge else
+            CONTEST_SUBMISSION_PRIORITY if id in contest else DEFAULT_PRIORITY,
+            'user-id': user_id,
+            'contest-key': contest[id][1] if id in contest else None,
+        })
+        if rejudge and result == 'AC' and not is_unlisted and points is not None and points >= problem_points:
+            accepted[problem_id] += 1
+        SubmissionResultCount.count_change(results, problem_id, user_id, contest_id, language_id, result, None)
+
+    # A rejudged accepted submission stops counting towards the problem's statistics until it is graded again.
+    for problem_id, count in accepted.items():
+        Problem(id=problem_id).adjust_stats(accepted=-count)
+    SubmissionResultCount.apply(results)
+
+    try:
+        response = judge_request({'name': 'submission-request', 'submissions': requests})
+    except BaseException:
+        logger.exception('Failed to send request to judge')
+        Submission.objects.filter(id__in=ids).update(status='IE')
+        return []
+
+    queued = set(response.get('submission-ids', ()))
+    if len(queued) < len(ids):
+        Submission.objects.filter(id__in=[id for id in ids if id not in queued]).update(status='IE')
+    for id, problem_id, code, is_public, user_id, language, result, points, problem_points, is_unlisted, \
+            contest_id, language_id in submissions:
+        if is_public:
+            event.post('submissions', {'type': 'update-submission', 'id': id,
+                                       'contest': contest[id][1] if id in contest else None,
+                                       'user': user_id, 'problem': problem_id,
+                                       'status': 'QU' if id in queued else 'IE', 'language': language})
+    return [id for id in ids if id in queued]
+
+
 def disconnect_judge(judge, force=False):
     judge_request({'name': 'disconnect-judge', 'judge-id': judge.name, 'force': force}, reply=False)
 
 
 def abort_submission(submission):
-    from .models import Submission
+    from .models import Submission, SubmissionResultCount
     response = judge_request({'name': 'terminate-submission', 'submission-id': submission.id})
     # This defaults to true, so that in the case the judgelist fails to remove the submission from the queue,
     # and returns a bad-request, the submission is not falsely shown as "Aborted" when it will still be judged.
     if not response.get('judge-aborted', True):
         Submission.objects.filter(id=submission.id).update(status='AB', result='AB')
+        SubmissionResultCount.record(submission.problem_id, submission.user_id, submission.contest_object_id,
+                                     submission.language_id, submission.result, 'AB')
         event.post('sub_%s' % Submission.get_id_secret(submission.id), {'type': 'aborted-submission'})
         _post_update_submission(submission, done=True)
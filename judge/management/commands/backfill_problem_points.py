@@ -0,0 +1,73 @@
+from operator import mul
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max
+
+from judge.models import Problem, Profile, Submission, UserProblemPoints
+
+
+def summarize(data, extradata, table=Profile._pp_table):
+    bonus_function = getattr(settings, 'DMOJ_PP_BONUS_FUNCTION', lambda n: 300 * (1 - 0.997 ** n))
+    entries = min(len(data), len(table))
+    return sum(data), len(data), sum(map(mul, table[:entries], data[:entries])) + bonus_function(extradata)
+
+
+def legacy_points(profile):
+    # The full recomputation Profile.calculate_points performed before best results were stored.
+    data = list(Problem.objects.filter(submission__user=profile, submission__points__isnull=False, is_public=True)
+                       .annotate(max_points=Max('submission__points')).order_by('-max_points')
+                       .values_list('max_points', flat=True).filter(max_points__gt=0))
+    # Solved problems are counted the same way as in the problem's user count.
+    extradata = Problem.objects.filter(submission__user=profile, submission__result='AC', is_public=True,
+                                       submission__points__gte=F('points')).values('id').distinct().count()
+    return summarize(data, extradata)
+
+
+def stored_points(profile):
+    best = list(profile.problem_points.filter(problem__is_public=True).order_by('-points')
+                       .values_list('points', 'is_accepted'))
+    return summarize([points for points, accepted in best if points > 0], sum(accepted for points, accepted in best))
+
+
+class Command(BaseCommand):
+    help = 'rebuilds the per-user best points table from all submissions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='rows to insert per query')
+        parser.add_argument('--verify', action='store_true',
+                            help='compare the points of every user against a full recomputation instead of '
+                                 'rebuilding')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self.verify()
+
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            UserProblemPoints.objects.all().delete()
+            batch = []
+            total = 0
+            for row in UserProblemPoints.best_submissions(Submission.objects.all()).iterator():
+                batch.append(UserProblemPoints(user_id=row['user_id'], problem_id=row['problem_id'],
+                                               points=row['best'], is_accepted=bool(row['accepted'])))
+                if len(batch) >= batch_size:
+                    UserProblemPoints.objects.bulk_create(batch)
+                    total += len(batch)
+                    batch = []
+            UserProblemPoints.objects.bulk_create(batch)
+            total += len(batch)
+        self.stdout.write('Stored %d best results' % total)
+
+    def verify(self):
+        mismatches = 0
+        checked = 0
+        for profile in Profile.objects.select_related('user').iterator():
+            expected = legacy_points(profile)
+            actual = stored_points(profile)
+            checked += 1
+            if actual[1] != expected[1] or any(abs(a - b) > 1e-6 for a, b in zip(actual, expected)):
+                mismatches += 1
+                self.stdout.write('%s: stored %r, recomputed %r' % (profile.user.username, actual, expected))
+        self.stdout.write('Checked %d users, %d mismatched' % (checked, mismatches))
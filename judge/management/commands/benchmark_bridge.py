@@ -0,0 +1,157 @@
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from judge import judgeapi
+from judge.bridge import DjangoHandler, DjangoJudgeHandler, DjangoServer, JudgeServer
+from judge.bridge.simulated_judge import SimulatedJudge
+from judge.models import Judge, Language, Problem, ProblemGroup, Profile, Submission, SubmissionSource
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return 'none'
+    return 'p50 %.3fs, p90 %.3fs, p99 %.3fs, max %.3fs' % (
+        values[len(values) // 2], values[len(values) * 9 // 10], values[len(values) * 99 // 100], values[-1],
+    )
+
+
+class Command(BaseCommand):
+    help = 'load tests the bridge with simulated judges, reporting throughput, queue wait and end-to-end latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-j', '--judges', type=int, default=10, help='number of simulated judges')
+        parser.add_argument('-s', '--submissions', type=int, default=1000, help='number of submissions to judge')
+        parser.add_argument('--problems', type=int, default=10, help='number of problems to submit to')
+        parser.add_argument('--cases', type=int, default=10, help='test cases graded per submission')
+        parser.add_argument('--case-time', type=float, default=0.01, help='seconds each test case takes on average')
+        parser.add_argument('--compile-time', type=float, default=0, help='seconds compiling takes on average')
+        parser.add_argument('--fail-rate', type=float, default=0.2, help='fraction of test cases that fail')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='submissions per second to submit at, or as fast as possible if 0')
+        parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for all submissions')
+        parser.add_argument('--seed', type=int, default=0, help='random seed for the workload')
+
+    def handle(self, *args, **options):
+        # The bridge runs in this process, against the configured database. Like runbridged, it marks every judge
+        # offline when it starts and stops.
+        judge_server = JudgeServer([('127.0.0.1', 0)], DjangoJudgeHandler)
+        django_server = DjangoServer(judge_server.judges, [('127.0.0.1', 0)], DjangoHandler)
+        judge_address = next(iter(judge_server._servers)).getsockname()[:2]
+        django_address = next(iter(django_server._servers)).getsockname()[:2]
+        judge_thread = threading.Thread(target=judge_server.serve_forever, daemon=True)
+        judge_thread.start()
+        threading.Thread(target=django_server.serve_forever, daemon=True).start()
+
+        pool, router = judgeapi._pool, judgeapi._router
+        judgeapi._pool, judgeapi._router = judgeapi.BridgePool(django_address, 4, 60), None
+        rng = random.Random(options['seed'])
+        tag = 'bench%d' % rng.randrange(10 ** 6)
+        judges = []
+        try:
+            language, problems, submissions = self.make_submissions(tag, rng, options)
+            judges = self.connect_judges(tag, judge_address, language, problems, options)
+            self.run(judge_server, judges, submissions, options)
+        finally:
+            for judge in judges:
+                judge.close()
+            judgeapi._pool.close()
+            judgeapi._pool, judgeapi._router = pool, router
+            django_server.stop()
+            judge_server.stop()
+            judge_thread.join()
+            self.clean_up(tag)
+
+    def make_submissions(self, tag, rng, options):
+        language = Language.objects.first() or Language.objects.create(key=tag, name=tag, short_name=tag)
+        group = ProblemGroup.objects.create(name=tag, full_name=tag)
+        problems = [Problem.objects.create(code='%sp%d' % (tag, i), name=tag, description='', time_limit=1,
+                                           memory_limit=65536, points=10, group=group, is_public=True, partial=True)
+                    for i in range(options['problems'])]
+        users = [Profile.objects.create(user=User.objects.create(username='%su%d' % (tag, i)), language=language)
+                 for i in range(20)]
+
+        Submission.objects.bulk_create(Submission(user=rng.choice(users), problem=rng.choice(problems),
+                                                  language=language) for i in range(options['submissions']))
+        # Primary keys are not set by bulk_create on every backend.
+        submissions = Submission.objects.filter(problem__code__startswith=tag).order_by('id')
+        SubmissionSource.objects.bulk_create(SubmissionSource(submission_id=id, source='simulated')
+                                             for id in submissions.values_list('id', flat=True))
+        return language, problems, list(submissions.select_related('problem', 'language', 'source'))
+
+    def connect_judges(self, tag, address, language, problems, options):
+        self.received = {}
+        self.ended = {}
+
+        def on_request(id):
+            self.received[id] = time.monotonic()
+
+        def on_end(id):
+            self.ended[id] = time.monotonic()
+
+        judges = []
+        for i in range(options['judges']):
+            judge = Judge.objects.create(name='%sj%d' % (tag, i), auth_key=tag)
+            judges.append(SimulatedJudge(address, judge.name, judge.auth_key, [problem.code for problem in problems],
+                                         [language.key], options['cases'], options['case_time'],
+                                         options['compile_time'], options['fail_rate'], options['seed'] + i,
+                                         on_request, on_end))
+            judges[-1].connect()
+        return judges
+
+    def clean_up(self, tag):
+        Submission.objects.filter(problem__code__startswith=tag).delete()
+        Problem.objects.filter(code__startswith=tag).delete()
+        ProblemGroup.objects.filter(name=tag).delete()
+        Judge.objects.filter(name__startswith=tag).delete()
+        User.objects.filter(username__startswith=tag).delete()
+        Language.objects.filter(key=tag).delete()
+
+    def run(self, judge_server, judges, submissions, options):
+        self.stdout.write('Judging %d submissions with %d cases each on %d judges' % (
+            len(submissions), options['cases'], len(judges),
+        ))
+        submitted = {}
+        start = time.monotonic()
+        for i, submission in enumerate(submissions):
+            if options['rate']:
+                delay = start + i / options['rate'] - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            submitted[submission.id] = time.monotonic()
+            judgeapi.judge_submission(submission, rejudge=False)
+        submit_time = time.monotonic() - start
+        self.stdout.write('Submitted in %.2fs, %.0f submissions/s' % (submit_time, len(submissions) / submit_time))
+
+        # A submission is finished once the bridge has stored its result, not when the judge reports it.
+        finished = {}
+        ids = [submission.id for submission in submissions]
+        done = Submission.objects.filter(id__gte=ids[0], id__lte=ids[-1], status='D')
+        while len(finished) < len(ids) and time.monotonic() - start < options['timeout']:
+            now = time.monotonic()
+            for id in done.values_list('id', flat=True):
+                finished.setdefault(id, now)
+            time.sleep(0.05)
+        elapsed = max(finished.values(), default=start) - start
+
+        if len(finished) < len(ids):
+            self.stderr.write('%d submissions did not finish in %ds' % (len(ids) - len(finished),
+                                                                         options['timeout']))
+        self.stdout.write('Finished %d submissions in %.2fs, %.1f submissions/s' % (
+            len(finished), elapsed, len(finished) / elapsed if elapsed else 0,
+        ))
+        self.stdout.write('Queue wait: %s' % percentiles([self.received[id] - submitted[id]
+                                                          for id in self.received if id in submitted]))
+        self.stdout.write('Judge to stored result: %s' % percentiles([finished[id] - self.ended[id]
+                                                                      for id in finished if id in self.ended]))
+        self.stdout.write('End to end (polled every 50ms): %s' % percentiles([finished[id] - submitted[id]
+                                                                               for id in finished]))
+        with judge_server.judges.lock:
+            waits = judge_server.judges.queue.wait_percentiles()
+        for priority, stats in sorted(waits.items()):
+            self.stdout.write('Bridge queue wait at priority %d: %s' % (priority, ', '.join(
+                '%s %s' % (key, value if key == 'count' else '%.3fs' % value) for key, value in stats.items())))
@@ -0,0 +1,152 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from judge.contest_format.default import ContestParticipationData, DefaultContestFormat
+from judge.models import Contest, ContestParticipation, ContestProblem, ContestSubmission, Language, Problem, \
+    ProblemGroup, Profile, Submission
+
+RESULTS = ['AC', 'WA', 'TLE', 'MLE', 'OLE', 'IR', 'RTE', 'CE']
+
+
+def legacy_update_participation(format, participation):
+    # The per-problem query implementation that DefaultContestFormat.update_participation replaced.
+    if format.contest.freeze_scoreboard_after:
+        querysets = [
+            participation.submissions.filter(submission__date__lt=format.contest.freeze_scoreboard_after),
+            participation.submissions,
+        ]
+    else:
+        querysets = [participation.submissions]
+
+    data = [ContestParticipationData() for _ in range(len(querysets))]
+    for i, queryset in enumerate(querysets):
+        for result_only_point in queryset.values('problem_id').annotate(points=Max('points')):
+            result = queryset.filter(
+                problem_id=result_only_point['problem_id'],
+                points=result_only_point['points'],
+            ).order_by('submission__date').first()
+            result = {
+                'time': result.submission.date,
+                'points': result_only_point['points'],
+                'problem_id': result_only_point['problem_id'],
+            }
+            ws_count = queryset.filter(problem_id=result['problem_id'], submission__date__lt=result['time'],
+                                       submission__result__in=['WA', 'TLE', 'MLE', 'OLE', 'IR', 'RTE']).count() \
+                if format.config['penalty'] > 0 else 0
+            dt = (result['time'] - participation.start).total_seconds()
+            if result['points']:
+                data[i].cumtime += dt + (ws_count * format.config['penalty'] * 60)
+            data[i].format_data[str(result['problem_id'])] = {'time': dt, 'points': result['points'],
+                                                              'penalty': ws_count}
+            data[i].points += result['points']
+
+    participation.cumtime = max(data[-1].cumtime, 0)
+    participation.score = data[-1].points
+    participation.format_data = data[-1].format_data
+    participation.frozen_cumtime = max(data[0].cumtime, 0)
+    participation.frozen_score = data[0].points
+    participation.frozen_format_data = data[0].format_data
+    participation.save()
+
+
+def snapshot(participation):
+    return (participation.cumtime, participation.score, participation.format_data,
+            participation.frozen_cumtime, participation.frozen_score, participation.frozen_format_data)
+
+
+class Command(BaseCommand):
+    help = 'benchmarks the default contest format against its previous implementation on a synthetic contest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-p', '--problems', type=int, default=15, help='number of contest problems')
+        parser.add_argument('-u', '--users', type=int, default=50, help='number of participants')
+        parser.add_argument('-s', '--submissions', type=int, default=60, help='submissions per participant')
+        parser.add_argument('--penalty', type=int, default=20, help='penalty minutes per wrong submission')
+        parser.add_argument('--no-freeze', action='store_true', help='do not freeze the scoreboard')
+        parser.add_argument('--seed', type=int, default=0, help='random seed for the workload')
+
+    def handle(self, *args, **options):
+        # Everything is created inside a transaction that is rolled back at the end.
+        with transaction.atomic():
+            participations, format = self.make_contest(options)
+            self.run(participations, format)
+            transaction.set_rollback(True)
+
+    def make_contest(self, options):
+        rng = random.Random(options['seed'])
+        start = timezone.now() - timedelta(hours=5)
+        tag = 'bench%d' % rng.randrange(10 ** 6)
+
+        language = Language.objects.first() or Language.objects.create(key=tag, name=tag, short_name=tag)
+        group = ProblemGroup.objects.create(name=tag, full_name=tag)
+        contest = Contest.objects.create(key=tag, name=tag, start_time=start, end_time=start + timedelta(hours=5),
+                                         freeze_scoreboard_after=None if options['no_freeze'] else
+                                         start + timedelta(hours=4),
+                                         format_config={'penalty': options['penalty']})
+
+        contest_problems = []
+        for i in range(options['problems']):
+            problem = Problem.objects.create(code='%sp%d' % (tag, i), name=tag, description='', time_limit=1,
+                                             memory_limit=65536, points=100, group=group)
+            contest_problems.append(ContestProblem.objects.create(problem=problem, contest=contest, points=100,
+                                                                  partial=rng.random() < 0.5, order=i))
+
+        participations = []
+        for i in range(options['users']):
+            profile = Profile.objects.create(user=User.objects.create(username='%su%d' % (tag, i)),
+                                             language=language)
+            participation = ContestParticipation.objects.create(contest=contest, user=profile, real_start=start)
+            participations.append(participation)
+
+            contest_submissions = []
+            for j in range(options['submissions']):
+                contest_problem = rng.choice(contest_problems)
+                result = rng.choice(RESULTS)
+                points = 100 if result == 'AC' else rng.choice([0, 0, 25, 50]) if contest_problem.partial else 0
+                submission = Submission.objects.create(user=profile, problem=contest_problem.problem,
+                                                       language=language, status='D', result=result, points=points)
+                # The date field is auto_now_add, so it is set afterwards. Whole minutes make some dates collide.
+                Submission.objects.filter(id=submission.id).update(date=start + timedelta(minutes=rng.randrange(300)))
+                contest_submissions.append(ContestSubmission(submission=submission, problem=contest_problem,
+                                                             participation=participation, points=points))
+            ContestSubmission.objects.bulk_create(contest_submissions)
+        return participations, contest.format
+
+    def measure(self, name, update, participations, format):
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_queries):
+            start = time.perf_counter()
+            results = []
+            for participation in participations:
+                update(format, participation)
+                results.append(snapshot(participation))
+            elapsed = time.perf_counter() - start
+        self.stdout.write('%s: %.3fs total, %.2fms and %.1f queries per participation' % (
+            name, elapsed, elapsed / len(participations) * 1000, queries[0] / len(participations),
+        ))
+        return results
+
+    def run(self, participations, format):
+        self.stdout.write('Updating %d participations on a %d problem contest' % (
+            len(participations), format.contest.contest_problems.count(),
+        ))
+        legacy = self.measure('legacy', legacy_update_participation, participations, format)
+        single = self.measure('single pass', DefaultContestFormat.update_participation, participations, format)
+
+        mismatches = sum(a != b for a, b in zip(legacy, single))
+        if mismatches:
+            self.stderr.write('%d participations differ from the previous implementation' % mismatches)
+        else:
+            self.stdout.write('Results are identical')
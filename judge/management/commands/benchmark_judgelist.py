@@ -0,0 +1,163 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from judge.bridge.judgelist import JudgeList, QueuedSubmission, SubmissionQueue
+
+
+class SimulatedJudge(object):
+    def __init__(self, name, problems, executors):
+        self.name = name
+        self.problems = problems
+        self.executors = executors
+        self.load = 0
+        self._working = False
+
+    def can_judge(self, problem, executor):
+        return problem in self.problems and executor in self.executors
+
+    @property
+    def working(self):
+        return bool(self._working)
+
+    def submit(self, id, problem, language, source):
+        self._working = id
+
+    def get_current_submission(self):
+        return self._working or None
+
+    def abort(self):
+        pass
+
+    def disconnect(self, force=False):
+        pass
+
+
+class LinearSubmissionQueue(object):
+    """The previous dispatch strategy: scan every queued submission in order until a judge can take one."""
+
+    def __init__(self, priorities):
+        self._queue = []
+        self._ids = set()
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __contains__(self, id):
+        return id in self._ids
+
+    def push(self, id, problem, language, source, priority, user=None, contest=None):
+        entry = QueuedSubmission(id, problem, language, source, priority, self._sequence, user, contest, 0,
+                                 (priority, self._sequence))
+        self._sequence += 1
+        index = len(self._queue)
+        while index and self._queue[index - 1].priority > priority:
+            index -= 1
+        self._queue.insert(index, entry)
+        self._ids.add(id)
+        return entry
+
+    def attach(self, judge):
+        pass
+
+    def detach(self, judge):
+        pass
+
+    def remove(self, id, dispatched=False):
+        for index, entry in enumerate(self._queue):
+            if entry.id == id:
+                self._ids.discard(id)
+                return self._queue.pop(index)
+
+    def peek(self, judge):
+        for entry in self._queue:
+            if judge.can_judge(entry.problem, entry.language):
+                return entry
+
+    def record_wait(self, priority, wait):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'replays a synthetic submission queue against simulated judges to benchmark bridge dispatch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--submissions', type=int, default=50000, help='number of queued submissions')
+        parser.add_argument('-j', '--judges', type=int, default=100, help='number of simulated judges')
+        parser.add_argument('--problems', type=int, default=500, help='number of distinct problems')
+        parser.add_argument('--languages', type=int, default=20, help='number of distinct languages')
+        parser.add_argument('--pools', type=int, default=10,
+                            help='number of distinct judge configurations the judges are drawn from')
+        parser.add_argument('--coverage', type=float, default=0.5,
+                            help='fraction of problems and languages each judge configuration supports')
+        parser.add_argument('--seed', type=int, default=0, help='random seed for the workload')
+        parser.add_argument('--compare', action='store_true',
+                            help='also replay with the linear scan and check that dispatch order is identical')
+
+    def make_workload(self, options):
+        rng = random.Random(options['seed'])
+        problems = ['p%d' % i for i in range(options['problems'])]
+        languages = ['L%d' % i for i in range(options['languages'])]
+        pools = [(set(rng.sample(problems, max(1, int(len(problems) * options['coverage'])))),
+                  set(rng.sample(languages, max(1, int(len(languages) * options['coverage'])))))
+                 for _ in range(options['pools'])]
+        judges = [('judge%d' % i,) + rng.choice(pools) for i in range(options['judges'])]
+        submissions = [(id, rng.choice(problems), rng.choice(languages), rng.randrange(JudgeList.priorities))
+                       for id in range(1, options['submissions'] + 1)]
+        return judges, submissions
+
+    def replay(self, queue_class, judges, submissions, seed):
+        rng = random.Random(seed)
+        judge_list = JudgeList()
+        judge_list.queue = queue_class(JudgeList.priorities)
+        for id, problem, language, priority in submissions:
+            judge_list.judge(id, problem, language, '', priority)
+
+        simulated = [SimulatedJudge(name, problems, executors) for name, problems, executors in judges]
+        order = []
+        for judge in simulated:
+            judge_list.register(judge)
+            if judge.working:
+                order.append(judge.get_current_submission())
+
+        timings = []
+        busy = [judge for judge in simulated if judge.working]
+        while busy:
+            judge = busy.pop(rng.randrange(len(busy)))
+            submission = judge.get_current_submission()
+            judge._working = False
+            start = time.perf_counter()
+            judge_list.on_judge_free(judge, submission)
+            timings.append(time.perf_counter() - start)
+            if judge.working:
+                order.append(judge.get_current_submission())
+                busy.append(judge)
+        return order, timings, len(judge_list.queue)
+
+    def report(self, name, order, timings, remaining):
+        timings.sort()
+        total = sum(timings)
+        self.stdout.write('%s: %d dispatched, %d left unjudgeable, %.3fs total, mean %.1fus, p50 %.1fus, '
+                          'p99 %.1fus, max %.1fus' % (
+                              name, len(order), remaining, total, total / len(timings) * 1e6,
+                              timings[len(timings) // 2] * 1e6, timings[len(timings) * 99 // 100] * 1e6,
+                              timings[-1] * 1e6,
+                          ))
+
+    def handle(self, *args, **options):
+        judges, submissions = self.make_workload(options)
+        self.stdout.write('Replaying %d submissions against %d judges' % (len(submissions), len(judges)))
+
+        order, timings, remaining = self.replay(SubmissionQueue, judges, submissions, options['seed'])
+        self.report('indexed', order, timings, remaining)
+
+        if options['compare']:
+            linear_order, timings, remaining = self.replay(LinearSubmissionQueue, judges, submissions,
+                                                           options['seed'])
+            self.report('linear', linear_order, timings, remaining)
+            if linear_order != order:
+                self.stderr.write('Dispatch order differs from the linear scan')
+            else:
+                self.stdout.write('Dispatch order is identical')
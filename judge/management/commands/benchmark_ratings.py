@@ -0,0 +1,124 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from judge.ratings import WP, normal_CDF_inverse, recalculate_ratings
+
+
+def legacy_recalculate_ratings(old_rating, old_volatility, actual_rank, times_rated):
+    # The pairwise pure Python implementation that recalculate_ratings replaced.
+    N = len(old_rating)
+    new_rating = old_rating[:]
+    new_volatility = old_volatility[:]
+    if N <= 1:
+        return new_rating, new_volatility
+
+    ave_rating = float(sum(old_rating)) / N
+    sum1 = sum(i * i for i in old_volatility) / N
+    sum2 = sum((i - ave_rating) ** 2 for i in old_rating) / (N - 1)
+    CF = math.sqrt(sum1 + sum2)
+
+    for i in range(N):
+        ERank = 0.5
+        for j in range(N):
+            ERank += WP(old_rating[i], old_rating[j], old_volatility[i], old_volatility[j])
+
+        EPerf = -normal_CDF_inverse((ERank - 0.5) / N)
+        APerf = -normal_CDF_inverse((actual_rank[i] - 0.5) / N)
+        PerfAs = old_rating[i] + CF * (APerf - EPerf)
+        Weight = 1.0 / (1 - (0.42 / (times_rated[i] + 1) + 0.18)) - 1.0
+        if old_rating[i] > 2500:
+            Weight *= 0.8
+        elif old_rating[i] >= 2000:
+            Weight *= 0.9
+
+        Cap = 150.0 + 1500.0 / (times_rated[i] + 2)
+
+        new_rating[i] = (old_rating[i] + Weight * PerfAs) / (1.0 + Weight)
+
+        if times_rated[i] == 0:
+            new_volatility[i] = 385
+        else:
+            new_volatility[i] = math.sqrt(((new_rating[i] - old_rating[i]) ** 2) / Weight +
+                                          (old_volatility[i] ** 2) / (Weight + 1))
+        if abs(old_rating[i] - new_rating[i]) > Cap:
+            if old_rating[i] < new_rating[i]:
+                new_rating[i] = old_rating[i] + Cap
+            else:
+                new_rating[i] = old_rating[i] - Cap
+
+    adjust = float(sum(old_rating) - sum(new_rating)) / N
+    new_rating = list(map(adjust.__add__, new_rating))
+    best_rank = min(actual_rank)
+    for i in range(N):
+        if abs(actual_rank[i] - best_rank) <= 1e-3 and new_rating[i] < old_rating[i] + 1:
+            new_rating[i] = old_rating[i] + 1
+    return list(map(int, map(round, new_rating))), list(map(int, map(round, new_volatility)))
+
+
+def random_contest(rng, N):
+    # Mostly returning users with a spread of ratings, some new users, and ties in the standings.
+    old_rating, old_volatility, times_rated = [], [], []
+    for _ in range(N):
+        if rng.random() < 0.2:
+            old_rating.append(1200)
+            old_volatility.append(535)
+            times_rated.append(0)
+        else:
+            old_rating.append(int(rng.gauss(1500, 400)))
+            old_volatility.append(rng.randint(80, 535))
+            times_rated.append(rng.randint(1, 60))
+
+    scores = sorted((rng.randrange(max(2, N // 3)) for _ in range(N)), reverse=True)
+    actual_rank = []
+    position = 0
+    while position < N:
+        end = position
+        while end < N and scores[end] == scores[position]:
+            end += 1
+        actual_rank += [(position + 1 + end) / 2.0] * (end - position)
+        position = end
+    return old_rating, old_volatility, actual_rank, times_rated
+
+
+class Command(BaseCommand):
+    help = 'compares the vectorized rating calculation with the pairwise implementation on random contests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--participants', type=int, default=5000,
+                            help='number of participants in the benchmarked contest')
+        parser.add_argument('--trials', type=int, default=200,
+                            help='number of random contests to compare both implementations on')
+        parser.add_argument('--max-size', type=int, default=300, help='largest random contest to compare on')
+        parser.add_argument('--skip-legacy', action='store_true',
+                            help='only time the vectorized implementation in the benchmark')
+        parser.add_argument('--seed', type=int, default=0, help='random seed')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        mismatches = 0
+        for trial in range(options['trials']):
+            contest = random_contest(rng, rng.randint(1, options['max_size']))
+            expected = legacy_recalculate_ratings(*contest)
+            actual = recalculate_ratings(*contest)
+            if actual != expected:
+                mismatches += 1
+                differing = sum(a != b for a, b in zip(actual[0] + actual[1], expected[0] + expected[1]))
+                self.stderr.write('Contest %d with %d participants: %d values differ' % (
+                    trial, len(contest[0]), differing,
+                ))
+        self.stdout.write('Compared %d random contests, %d mismatched' % (options['trials'], mismatches))
+
+        contest = random_contest(rng, options['participants'])
+        start = time.perf_counter()
+        actual = recalculate_ratings(*contest)
+        self.stdout.write('vectorized: %.3fs for %d participants' % (time.perf_counter() - start, len(contest[0])))
+        if not options['skip_legacy']:
+            start = time.perf_counter()
+            expected = legacy_recalculate_ratings(*contest)
+            self.stdout.write('pairwise: %.3fs for %d participants' % (time.perf_counter() - start,
+                                                                        len(contest[0])))
+            self.stdout.write('Results are identical' if actual == expected else 'Results differ')
@@ -0,0 +1,161 @@
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from judge import judgeapi
+from judge.bridge.djangohandler import DjangoHandler
+from judge.bridge.djangoserver import DjangoServer
+from judge.models import Contest, ContestParticipation, ContestProblem, ContestSubmission, Language, Problem, \
+    ProblemGroup, Profile, Submission, SubmissionSource, SubmissionTestCase
+from judge.tasks.submission import REJUDGE_CHUNK_SIZE
+
+RESULTS = ['AC', 'AC', 'WA', 'TLE', 'RTE', 'CE']
+
+
+class RecordingJudgeList(object):
+    # Stands in for the bridge's judge list, so that nothing is actually judged.
+    journal = None
+
+    def __init__(self):
+        self.queued = {}
+
+    def check_priority(self, priority):
+        return 0 <= priority < 4
+
+    def judge(self, id, problem, language, source, priority, user=None, contest=None):
+        self.queued[id] = (problem, language, source, priority)
+
+    def abort(self, id):
+        return False
+
+    def disconnect(self, judge_id, force=False):
+        pass
+
+
+def snapshot(problem, judges):
+    return (
+        list(Submission.objects.filter(problem=problem).order_by('id')
+             .values_list('id', 'status', 'result', 'points', 'was_rejudged', 'is_pretested')),
+        SubmissionTestCase.objects.filter(submission__problem=problem).count(),
+        Problem.objects.filter(id=problem.id).values_list('ac_count', flat=True)[0],
+        sorted(judges.queued.items()),
+    )
+
+
+class Command(BaseCommand):
+    help = 'measures rejudge throughput of the bulk path against judging submissions one at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--submissions', type=int, default=2000, help='number of submissions to rejudge')
+        parser.add_argument('--cases', type=int, default=10, help='test cases stored per submission')
+        parser.add_argument('--source-size', type=int, default=2000, help='bytes of source per submission')
+        parser.add_argument('--seed', type=int, default=0, help='random seed for the workload')
+
+    def handle(self, *args, **options):
+        judges = RecordingJudgeList()
+        server = DjangoServer(judges, [('127.0.0.1', 0)], DjangoHandler)
+        address = next(iter(server._servers)).getsockname()[:2]
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        pool, judgeapi._pool = judgeapi._pool, judgeapi.BridgePool(address, 4, 60)
+        try:
+            # Everything is created inside a transaction that is rolled back at the end.
+            with transaction.atomic():
+                problem = self.make_submissions(options)
+                self.run(problem, judges, options)
+                transaction.set_rollback(True)
+        finally:
+            judgeapi._pool.close()
+            judgeapi._pool = pool
+            server.stop()
+
+    def make_submissions(self, options):
+        rng = random.Random(options['seed'])
+        tag = 'bench%d' % rng.randrange(10 ** 6)
+
+        language = Language.objects.first() or Language.objects.create(key=tag, name=tag, short_name=tag)
+        group = ProblemGroup.objects.create(name=tag, full_name=tag)
+        problem = Problem.objects.create(code=tag, name=tag, description='', time_limit=1, memory_limit=65536,
+                                         points=10, group=group, is_public=True)
+        contest = Contest.objects.create(key=tag, name=tag, start_time=timezone.now(),
+                                         end_time=timezone.now() + timedelta(hours=5), run_pretests_only=True)
+        contest_problem = ContestProblem.objects.create(problem=problem, contest=contest, points=10, order=0)
+        users = [Profile.objects.create(user=User.objects.create(username='%su%d' % (tag, i)), language=language)
+                 for i in range(20)]
+        participations = {user.id: ContestParticipation.objects.create(contest=contest, user=user) for user in users}
+
+        submissions = []
+        for i in range(options['submissions']):
+            result = rng.choice(RESULTS)
+            submissions.append(Submission(user=rng.choice(users), problem=problem, language=language, status='D',
+                                          result=result, points=10 if result == 'AC' else 0))
+        Submission.objects.bulk_create(submissions)
+        # Primary keys are not set by bulk_create on every backend.
+        submissions = list(Submission.objects.filter(problem=problem).order_by('id'))
+
+        source = 'x' * options['source_size']
+        SubmissionSource.objects.bulk_create(SubmissionSource(submission=submission, source=source)
+                                             for submission in submissions)
+        SubmissionTestCase.objects.bulk_create(SubmissionTestCase(submission=submission, case=case, status='AC')
+                                               for submission in submissions for case in range(options['cases']))
+        in_contest = [submission for submission in submissions if rng.random() < 0.3]
+        ContestSubmission.objects.bulk_create(ContestSubmission(submission=submission, problem=contest_problem,
+                                                                participation=participations[submission.user_id])
+                                              for submission in in_contest)
+        Submission.objects.filter(id__in=[submission.id for submission in in_contest]).update(contest_object=contest)
+        problem.update_stats()
+        return problem
+
+    def reset(self, problem, state, judges):
+        for id, status, result, points, was_rejudged, is_pretested in state[0]:
+            Submission.objects.filter(id=id).update(status=status, result=result, points=points,
+                                                    was_rejudged=was_rejudged, is_pretested=is_pretested)
+        problem.update_stats()
+        judges.queued.clear()
+
+    def measure(self, name, rejudge, problem, judges):
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        count = Submission.objects.filter(problem=problem).count()
+        with connection.execute_wrapper(count_queries):
+            start = time.perf_counter()
+            rejudge(problem)
+            elapsed = time.perf_counter() - start
+        self.stdout.write('%s: %.0f submissions/s, %.2f queries per submission' % (
+            name, count / elapsed, queries[0] / count,
+        ))
+        return snapshot(problem, judges)
+
+    def run(self, problem, judges, options):
+        def one_at_a_time(problem):
+            for submission in Submission.objects.filter(problem=problem).iterator():
+                submission.judge(rejudge=True, batch_rejudge=True)
+
+        def bulk(problem):
+            ids = list(Submission.objects.filter(problem=problem).order_by('id').values_list('id', flat=True))
+            for start in range(0, len(ids), REJUDGE_CHUNK_SIZE):
+                judgeapi.judge_submissions(ids[start:start + REJUDGE_CHUNK_SIZE], rejudge=True, batch_rejudge=True)
+
+        initial = snapshot(problem, judges)
+        self.stdout.write('Rejudging %d submissions with %d cases each' % (len(initial[0]), options['cases']))
+        legacy = self.measure('one at a time', one_at_a_time, problem, judges)
+        self.reset(problem, initial, judges)
+        SubmissionTestCase.objects.bulk_create(SubmissionTestCase(submission_id=id, case=case, status='AC')
+                                               for id, *rest in initial[0] for case in range(options['cases']))
+        batched = self.measure('bulk', bulk, problem, judges)
+
+        if legacy == batched:
+            self.stdout.write('Resulting states are identical')
+        else:
+            self.stderr.write('Resulting states differ')
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+
+from judge.models import Problem, Submission
+
+
+class Command(BaseCommand):
+    help = 'recounts problem submission statistics and repairs counters that have drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('problems', nargs='*', help='codes of problems to reconcile, default all')
+
+    def handle(self, *args, **options):
+        problems = Problem.objects.all()
+        submissions = Submission.objects.all()
+        if options['problems']:
+            problems = problems.filter(code__in=options['problems'])
+            submissions = submissions.filter(problem__code__in=options['problems'])
+
+        totals = dict(submissions.values_list('problem_id').annotate(count=Count('id')).order_by())
+        accepted = {row['problem_id']: (row['users'], row['count']) for row in
+                    submissions.filter(result='AC', points__gte=F('problem__points'), user__is_unlisted=False)
+                               .values('problem_id').annotate(users=Count('user_id', distinct=True), count=Count('id'))
+                               .order_by()}
+
+        checked = repaired = 0
+        for problem in problems.only('code', 'user_count', 'ac_count', 'submission_count', 'ac_rate').iterator():
+            checked += 1
+            submission_count = totals.get(problem.id, 0)
+            user_count, ac_count = accepted.get(problem.id, (0, 0))
+            ac_rate = 100.0 * ac_count / submission_count if submission_count else 0
+            stored = problem.user_count, problem.ac_count, problem.submission_count
+            if stored == (user_count, ac_count, submission_count) and abs(problem.ac_rate - ac_rate) < 1e-6:
+                continue
+
+            repaired += 1
+            self.stdout.write('%s: users %d -> %d, accepted %d -> %d, submissions %d -> %d' % (
+                problem.code, problem.user_count, user_count, problem.ac_count, ac_count,
+                problem.submission_count, submission_count,
+            ))
+            Problem.objects.filter(id=problem.id).update(user_count=user_count, ac_count=ac_count,
+                                                         submission_count=submission_count, ac_rate=ac_rate)
+        self.stdout.write('Checked %d problems, repaired %d' % (checked, repaired))
@@ -0,0 +1,50 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from judge.models import Submission, SubmissionResultCount
+
+SCOPE_FIELDS = {
+    'global': None,
+    'problem': 'problem_id',
+    'user': 'user_id',
+    'contest': 'contest_object_id',
+    'language': 'language_id',
+}
+
+
+class Command(BaseCommand):
+    help = 'recounts submission results by scope and repairs counts that have drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scopes', nargs='*', help='scopes to reconcile, out of %s, default all' %
+                                                          ', '.join(SCOPE_FIELDS))
+
+    def handle(self, *args, **options):
+        for scope in options['scopes']:
+            if scope not in SCOPE_FIELDS:
+                raise CommandError('unknown scope: %s' % scope)
+        for scope in options['scopes'] or SCOPE_FIELDS:
+            self.reconcile(scope, SCOPE_FIELDS[scope])
+
+    def reconcile(self, scope, field):
+        submissions = Submission.objects.filter(result__isnull=False)
+        if field is None:
+            rows = ((0, result, count) for result, count in
+                    submissions.values_list('result').annotate(count=Count('id')).order_by())
+        else:
+            rows = submissions.filter(**{field + '__isnull': False}).values_list(field, 'result') \
+                              .annotate(count=Count('id')).order_by()
+        expected = {(key, result): count for key, result, count in rows}
+
+        # Correcting the counts by the difference, rather than overwriting them, keeps the changes that the bridge
+        # makes after they are read.
+        stored = dict(((key, result), count) for key, result, count in
+                      SubmissionResultCount.objects.filter(scope=scope).values_list('key', 'result', 'count'))
+        deltas = Counter({(scope, key, result): expected.get((key, result), 0) - stored.get((key, result), 0)
+                          for key, result in set(expected) | set(stored)})
+        SubmissionResultCount.apply(deltas)
+        self.stdout.write('%s: checked %d counts, repaired %d' % (
+            scope, len(expected), sum(1 for delta in deltas.values() if delta),
+        ))
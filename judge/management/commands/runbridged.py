@@ -3,12 +3,19 @@ import threading
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from judge import event_poster as event
 from judge.bridge import DjangoHandler, DjangoServer
 from judge.bridge import DjangoJudgeHandler, JudgeServer
+from judge.bridge.metrics import serve_metrics
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--shard', type=int, help='run as this shard of BRIDGED_SHARDS')
+
     def handle(self, *args, **options):
+        # Judges report far more often than the site posts, so the bridge does not wait for the event daemon.
+        event.use_async()
         judge_handler = DjangoJudgeHandler
 
         try:
@@ -20,8 +27,19 @@ class Command(BaseCommand):
             if proxies:
                 judge_handler = judge_handler.with_proxy_set(proxies)
 
-        judge_server = JudgeServer(settings.BRIDGED_JUDGE_ADDRESS, judge_handler)
-        django_server = DjangoServer(judge_server.judges, settings.BRIDGED_DJANGO_ADDRESS, DjangoHandler)
+        if options['shard'] is None:
+            judge_server = JudgeServer(settings.BRIDGED_JUDGE_ADDRESS, judge_handler)
+            django_server = DjangoServer(judge_server.judges, settings.BRIDGED_DJANGO_ADDRESS, DjangoHandler)
+            metrics_address = getattr(settings, 'BRIDGED_METRICS_ADDRESS', None)
+        else:
+            shards = settings.BRIDGED_SHARDS
+            shard = shards[options['shard']]
+            judge_server = JudgeServer(shard['judge_address'], judge_handler, journal_path=shard.get('queue_journal'),
+                                       shard=options['shard'], shards=shards)
+            django_server = DjangoServer(judge_server.judges, shard['django_address'], DjangoHandler)
+            metrics_address = shard.get('metrics_address')
+
+        metrics_server = metrics_address and serve_metrics(judge_server.metrics, metrics_address)
 
         # TODO: Merge the two servers
         threading.Thread(target=django_server.serve_forever).start()
@@ -31,3 +49,5 @@ class Command(BaseCommand):
             pass
         finally:
             django_server.stop()
+            if metrics_server:
+                metrics_server.shutdown()
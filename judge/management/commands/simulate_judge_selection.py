@@ -0,0 +1,171 @@
+import math
+import random
+from collections import OrderedDict
+from heapq import heappop, heappush
+
+from django.core.management.base import BaseCommand
+
+from judge.bridge.judgelist import JUDGE_SELECTORS, JudgeList, judge_speed_factors
+
+
+class SimulatedJudge(object):
+    """A judge with its own speed per language, background load, latency and a cache of recent problem data."""
+
+    def __init__(self, simulation, name, speeds, background, latency):
+        self.simulation = simulation
+        self.name = name
+        self.speeds = speeds
+        self.background = background
+        self.latency = latency
+        self.problems = simulation.problems
+        self.executors = set(speeds)
+        self.cache = OrderedDict()
+        self.busy = 0
+        self.updated = 0
+        self._working = False
+
+    @property
+    def load(self):
+        # Reported load is the background load plus a one minute moving average of being busy, like loadavg.
+        decay = math.exp(-(self.simulation.now - self.updated) / 60)
+        return self.background + self.busy * decay + (1 - decay) * bool(self._working)
+
+    def _update_load(self):
+        self.busy = self.load - self.background
+        self.updated = self.simulation.now
+
+    def can_judge(self, problem, executor):
+        return executor in self.executors
+
+    @property
+    def working(self):
+        return bool(self._working)
+
+    def get_current_submission(self):
+        return self._working or None
+
+    def submit(self, id, problem, language, source):
+        self._update_load()
+        self._working = id
+        self.simulation.start(self, id, problem, language)
+
+    def finish(self):
+        self._update_load()
+        self._working = False
+
+
+class Simulation(object):
+    def __init__(self, options, workload):
+        self.options = options
+        self.problems, self.base, self.arrivals, self.judges = workload
+        self.now = 0
+        self.events = []
+        self.finished = {}
+        self.hits = 0
+        self.timings = []
+
+    def start(self, judge, id, problem, language):
+        hit = problem in judge.cache
+        if hit:
+            self.hits += 1
+            judge.cache.move_to_end(problem)
+        else:
+            judge.cache[problem] = True
+            if len(judge.cache) > self.options['cache_size']:
+                judge.cache.popitem(last=False)
+
+        rng = random.Random(id)
+        slowdown = judge.speeds[language] * (1 + 0.25 * judge.background)
+        cases = [self.base[problem] / self.options['cases'] * slowdown * rng.uniform(0.9, 1.1)
+                 for _ in range(self.options['cases'])]
+        self.timings += [(judge.name, language, (problem, case), time) for case, time in enumerate(cases)]
+        duration = sum(cases) + 2 * judge.latency + (0 if hit else self.options['cold_penalty'])
+        heappush(self.events, (self.now + duration, id, judge))
+
+    def run(self, judge_list):
+        judges = [SimulatedJudge(self, name, speeds, background, latency)
+                  for name, speeds, background, latency in self.judges]
+        for judge in judges:
+            judge_list.register(judge)
+
+        arrivals = iter(self.arrivals)
+        next_arrival = next(arrivals, None)
+        while next_arrival is not None or self.events:
+            if next_arrival is not None and (not self.events or next_arrival[0] <= self.events[0][0]):
+                self.now, id, problem, language = next_arrival
+                judge_list.judge(id, problem, language, '', 1)
+                next_arrival = next(arrivals, None)
+            else:
+                self.now, id, judge = heappop(self.events)
+                self.finished[id] = self.now
+                judge.finish()
+                judge_list.on_judge_free(judge, id)
+        return self.finished
+
+
+class Command(BaseCommand):
+    help = 'simulates judges with differing speed, load, latency and cached problems to compare judge selectors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--submissions', type=int, default=20000, help='number of submissions')
+        parser.add_argument('-j', '--judges', type=int, default=12, help='number of simulated judges')
+        parser.add_argument('--problems', type=int, default=300, help='number of distinct problems')
+        parser.add_argument('--languages', type=int, default=5, help='number of distinct languages')
+        parser.add_argument('--utilization', type=float, default=0.85, help='offered load relative to capacity')
+        parser.add_argument('--cases', type=int, default=10, help='test cases per problem')
+        parser.add_argument('--cache-size', type=int, default=20, help='problems whose data each judge keeps')
+        parser.add_argument('--cold-penalty', type=float, default=1.0,
+                            help='seconds spent fetching test data that is not cached')
+        parser.add_argument('--seed', type=int, default=0, help='random seed for the workload')
+        for weight in ('load', 'latency', 'speed', 'affinity'):
+            parser.add_argument('--%s-weight' % weight, type=float, help='%s weight of the score selector' % weight)
+
+    def make_workload(self, options):
+        rng = random.Random(options['seed'])
+        problems = ['p%d' % i for i in range(options['problems'])]
+        languages = ['L%d' % i for i in range(options['languages'])]
+        base = {problem: rng.lognormvariate(0, 0.8) for problem in problems}
+        judges = [('judge%d' % i, {language: rng.uniform(0.7, 1.6) for language in languages},
+                   rng.uniform(0, 1.5), rng.uniform(0.005, 0.2)) for i in range(options['judges'])]
+
+        # Problem popularity follows a Zipf distribution, so a few problems get most submissions.
+        weights = [1 / (rank + 1) for rank in range(len(problems))]
+        mean_time = sum(base[problem] * weight for problem, weight in zip(problems, weights)) / sum(weights)
+        capacity = sum(1 / (mean_time * sum(speeds.values()) / len(speeds) * (1 + 0.25 * background) +
+                            2 * latency + options['cold_penalty'] / 2)
+                       for name, speeds, background, latency in judges)
+        rate = options['utilization'] * capacity
+        now = 0
+        arrivals = []
+        for id, problem in enumerate(rng.choices(problems, weights, k=options['submissions']), 1):
+            now += rng.expovariate(rate)
+            arrivals.append((now, id, problem, rng.choice(languages)))
+        return set(problems), base, arrivals, judges
+
+    def report(self, name, arrivals, finished, hits):
+        times = sorted(finished[id] - arrived for arrived, id, problem, language in arrivals)
+        self.stdout.write('%s: mean %.2fs, p50 %.2fs, p90 %.2fs, p99 %.2fs queue to finish, %.1f%% cache hits' % (
+            name, sum(times) / len(times), times[len(times) // 2], times[len(times) * 9 // 10],
+            times[len(times) * 99 // 100], 100.0 * hits / len(times),
+        ))
+
+    def handle(self, *args, **options):
+        workload = self.make_workload(options)
+        arrivals = workload[2]
+        self.stdout.write('Simulating %d submissions on %d judges over %.0fs' % (
+            len(arrivals), options['judges'], arrivals[-1][0],
+        ))
+
+        # Speeds are learned from test case timings, like the bridge does from SubmissionTestCase, here those of a
+        # run with the least load selector.
+        history = Simulation(options, workload)
+        self.report('least-load', arrivals, history.run(JudgeList(selector=JUDGE_SELECTORS['least-load']())),
+                    history.hits)
+        speeds = judge_speed_factors(history.timings)
+
+        selector = JUDGE_SELECTORS['score'](**{'%s_weight' % weight: options['%s_weight' % weight]
+                                               for weight in ('load', 'latency', 'speed', 'affinity')
+                                               if options['%s_weight' % weight] is not None})
+        selector.speeds = speeds
+        simulation = Simulation(options, workload)
+        self.report('score', arrivals, simulation.run(JudgeList(selector=selector)), simulation.hits)
@@ -6,6 +6,7 @@ from django.utils.http import urlquote
 from preferences import preferences
 
 from judge.models import Contest, ContestParticipation
+from judge.scoreboard import post_contest_update
 
 class ShortCircuitMiddleware:
     def __init__(self, get_response):
@@ -81,6 +82,8 @@ class ContestMiddleware(object):
                         contest=active_contest, user=profile, virtual=(-1 if is_organizer else 0),
                         real_start=timezone.now(),
                     )
+                    if participation.live:
+                        post_contest_update(active_contest.id)
 
                 profile.current_contest = participation
                 profile.save()
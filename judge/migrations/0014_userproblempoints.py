@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_problem_points(apps, schema_editor):
+    # Profile.calculate_points only reads this table, so it must hold every user's best results before it is used.
+    Submission = apps.get_model('judge', 'Submission')
+    UserProblemPoints = apps.get_model('judge', 'UserProblemPoints')
+    best = Submission.objects.filter(points__isnull=False).values('user_id', 'problem_id').annotate(
+        best=models.Max('points'),
+        accepted=models.Max(models.Case(models.When(result='AC', points__gte=models.F('problem__points'), then=1),
+                                        default=0, output_field=models.IntegerField())),
+    ).order_by()
+    batch = []
+    for row in best.iterator():
+        batch.append(UserProblemPoints(user_id=row['user_id'], problem_id=row['problem_id'], points=row['best'],
+                                       is_accepted=bool(row['accepted'])))
+        if len(batch) >= 5000:
+            UserProblemPoints.objects.bulk_create(batch)
+            batch = []
+    UserProblemPoints.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0013_auto_20200308_1527'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProblemPoints',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.FloatField(default=0, verbose_name='best points')),
+                ('is_accepted', models.BooleanField(default=False, verbose_name='has accepted submission')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='judge.Problem', verbose_name='problem')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='problem_points', to='judge.Profile', verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'user problem points',
+                'verbose_name_plural': 'user problem points',
+                'unique_together': {('user', 'problem')},
+            },
+        ),
+        migrations.RunPython(backfill_problem_points, migrations.RunPython.noop),
+    ]
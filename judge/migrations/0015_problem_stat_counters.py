@@ -0,0 +1,39 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+def backfill_stat_counters(apps, schema_editor):
+    # The counters are adjusted in place from now on, so they must start from the real counts.
+    Problem = apps.get_model('judge', 'Problem')
+    Submission = apps.get_model('judge', 'Submission')
+    totals = dict(Submission.objects.values_list('problem_id').annotate(count=models.Count('id')).order_by())
+    accepted = dict(Submission.objects.filter(result='AC', points__gte=models.F('problem__points'),
+                                              user__is_unlisted=False)
+                    .values_list('problem_id').annotate(count=models.Count('id')).order_by())
+    for id in Problem.objects.values_list('id', flat=True):
+        submission_count = totals.get(id, 0)
+        ac_count = accepted.get(id, 0)
+        Problem.objects.filter(id=id).update(submission_count=submission_count, ac_count=ac_count,
+                                             ac_rate=100.0 * ac_count / submission_count if submission_count else 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0014_userproblempoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='ac_count',
+            field=models.IntegerField(default=0, verbose_name='number of accepted submissions'),
+        ),
+        migrations.AddField(
+            model_name='problem',
+            name='submission_count',
+            field=models.IntegerField(default=0, verbose_name='number of submissions'),
+        ),
+        migrations.RunPython(backfill_stat_counters, migrations.RunPython.noop),
+    ]
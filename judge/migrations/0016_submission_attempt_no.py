@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0015_problem_stat_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='attempt_no',
+            field=models.IntegerField(blank=True, null=True, verbose_name='attempt number'),
+        ),
+    ]
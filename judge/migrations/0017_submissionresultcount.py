@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0016_submission_attempt_no'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionResultCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('global', 'all submissions'), ('problem', 'problem'), ('user', 'user'), ('contest', 'contest'), ('language', 'language')], max_length=8, verbose_name='scope')),
+                ('key', models.IntegerField(default=0, verbose_name='scope ID')),
+                ('result', models.CharField(choices=[('AC', 'Accepted'), ('WA', 'Wrong Answer'), ('TLE', 'Time Limit Exceeded'), ('MLE', 'Memory Limit Exceeded'), ('OLE', 'Output Limit Exceeded'), ('IR', 'Invalid Return'), ('RTE', 'Runtime Error'), ('CE', 'Compile Error'), ('IE', 'Internal Error'), ('SC', 'Short circuit'), ('AB', 'Aborted')], max_length=3, verbose_name='result')),
+                ('count', models.IntegerField(default=0, verbose_name='submission count')),
+            ],
+            options={
+                'verbose_name': 'submission result count',
+                'verbose_name_plural': 'submission result counts',
+                'unique_together': {('scope', 'key', 'result')},
+            },
+        ),
+    ]
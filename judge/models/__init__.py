@@ -9,6 +9,7 @@ from judge.models.problem_data import CHECKERS, ProblemData, ProblemTestCase, pr
     problem_directory_file
 from judge.models.profile import Profile
 from judge.models.runtime import Judge, Language, RuntimeVersion
-from judge.models.submission import SUBMISSION_RESULT, Submission, SubmissionSource, SubmissionTestCase
+from judge.models.submission import SUBMISSION_RESULT, Submission, SubmissionResultCount, SubmissionSource, \
+    SubmissionTestCase, UserProblemPoints
 from judge.models.ticket import Ticket, TicketMessage
 from judge.models.preferences import SitePreferences
@@ -13,6 +13,7 @@ from judge import contest_format
 from judge.models.problem import Problem
 from judge.models.profile import Profile
 from judge.models.submission import Submission
+from judge.scoreboard import update_contest_scoreboard
 
 __all__ = ['Contest', 'ContestTag', 'ContestParticipation', 'ContestProblem', 'ContestSubmission', 'Rating']
 
@@ -279,6 +280,7 @@ class ContestParticipation(models.Model):
 
     def recompute_results(self):
         self.contest.format.update_participation(self)
+        update_contest_scoreboard(self)
     recompute_results.alters_data = True
 
     @property
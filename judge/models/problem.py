@@ -5,7 +5,7 @@ from django.contrib.contenttypes.fields import GenericRelation
 from django.core.cache import cache
 from django.core.validators import MaxValueValidator, MinValueValidator, RegexValidator
 from django.db import models
-from django.db.models import CASCADE, F, QuerySet, SET_NULL
+from django.db.models import CASCADE, ExpressionWrapper, F, FloatField, QuerySet, SET_NULL
 from django.db.models.expressions import RawSQL
 from django.db.models.functions import Coalesce
 from django.urls import reverse
@@ -144,6 +144,8 @@ class Problem(models.Model):
     user_count = models.IntegerField(verbose_name=_('number of users'), default=0,
                                      help_text=_('The number of users who solved the problem.'))
     ac_rate = models.FloatField(verbose_name=_('solve rate'), default=0)
+    submission_count = models.IntegerField(verbose_name=_('number of submissions'), default=0)
+    ac_count = models.IntegerField(verbose_name=_('number of accepted submissions'), default=0)
 
     objects = TranslatedProblemQuerySet.as_manager()
     tickets = GenericRelation('Ticket')
@@ -252,18 +254,33 @@ class Problem(models.Model):
         return ProblemClarification.objects.filter(problem=self)
 
     def update_stats(self):
-        self.user_count = self.submission_set.filter(points__gte=self.points, result='AC',
-                                                     user__is_unlisted=False).values('user').distinct().count()
-        submissions = self.submission_set.count()
-        if submissions:
-            self.ac_rate = 100.0 * self.submission_set.filter(points__gte=self.points, result='AC',
-                                                              user__is_unlisted=False).count() / submissions
+        accepted = self.submission_set.filter(points__gte=self.points, result='AC', user__is_unlisted=False)
+        self.user_count = accepted.values('user').distinct().count()
+        self.ac_count = accepted.count()
+        self.submission_count = self.submission_set.count()
+        if self.submission_count:
+            self.ac_rate = 100.0 * self.ac_count / self.submission_count
         else:
             self.ac_rate = 0
         self.save()
 
     update_stats.alters_data = True
 
+    def adjust_stats(self, submissions=0, accepted=0, users=0):
+        """
+        Applies a change in the submission counters in place of a full update_stats. Counters that drift, e.g. from
+        deleted users or changed problem points, are repaired by the reconcile_problem_stats command.
+        """
+        if not (submissions or accepted or users):
+            return
+        Problem.objects.filter(id=self.id).update(submission_count=F('submission_count') + submissions,
+                                                  ac_count=F('ac_count') + accepted,
+                                                  user_count=F('user_count') + users)
+        Problem.objects.filter(id=self.id, submission_count__gt=0).update(ac_rate=ExpressionWrapper(
+            100.0 * F('ac_count') / F('submission_count'), output_field=FloatField()))
+
+    adjust_stats.alters_data = True
+
     def _get_limits(self, key):
         global_limit = getattr(self, key)
         limits = {limit['language_id']: (limit['language__name'], limit[key])
@@ -4,7 +4,6 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
 from django.db import models
-from django.db.models import Max
 from django.urls import reverse
 from django.utils.functional import cached_property
 from django.utils.timezone import now
@@ -68,12 +67,12 @@ class Profile(models.Model):
                  for i in range(getattr(settings, 'DMOJ_PP_ENTRIES', 100))]
 
     def calculate_points(self, table=_pp_table):
-        from judge.models import Problem
-        data = (Problem.objects.filter(submission__user=self, submission__points__isnull=False, is_public=True)
-                       .annotate(max_points=Max('submission__points')).order_by('-max_points')
-                       .values_list('max_points', flat=True).filter(max_points__gt=0))
-        extradata = Problem.objects.filter(submission__user=self, submission__result='AC', is_public=True) \
-                           .values('id').distinct().count()
+        # Best points per problem are maintained in UserProblemPoints as submissions are graded, so this is linear in
+        # the number of problems attempted rather than in the number of submissions.
+        best = list(self.problem_points.filter(problem__is_public=True).order_by('-points')
+                        .values_list('points', 'is_accepted'))
+        data = [points for points, accepted in best if points > 0]
+        extradata = sum(accepted for points, accepted in best)
         bonus_function = getattr(settings, 'DMOJ_PP_BONUS_FUNCTION', lambda n: 300 * (1 - 0.997 ** n))
         points = sum(data)
         problems = len(data)
@@ -1,3 +1,4 @@
+import time
 from collections import OrderedDict, defaultdict
 from operator import attrgetter
 
@@ -128,6 +129,33 @@ class Judge(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def _problem_judges_version(cls):
+        version = cache.get('judge:problems:version')
+        if version is None:
+            # A new namespace, so that entries cached before the version was evicted are never used.
+            cache.add('judge:problems:version', int(time.time() * 1000), None)
+            version = cache.get('judge:problems:version', 0)
+        return version
+
+    @classmethod
+    def get_online_for_problem(cls, problem_id):
+        """Online judges able to grade the problem, cached until a judge connects, disconnects or changes problems."""
+        key = 'judge:problems:%d:%d' % (cls._problem_judges_version(), problem_id)
+        result = cache.get(key)
+        if result is not None:
+            return result
+        result = list(cls.objects.filter(online=True, problems=problem_id).only('id', 'name').order_by('name'))
+        cache.set(key, result, 86400)
+        return result
+
+    @classmethod
+    def invalidate_problem_judges(cls):
+        try:
+            cache.incr('judge:problems:version')
+        except ValueError:
+            cache.add('judge:problems:version', int(time.time() * 1000), None)
+
     def disconnect(self, force=False):
         disconnect_judge(self, force=force)
 
@@ -1,9 +1,11 @@
 import hashlib
 import hmac
+from collections import Counter
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, IntegerField, Max, Q, Value, When
 from django.urls import reverse
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
@@ -14,7 +16,8 @@ from judge.models.profile import Profile
 from judge.models.runtime import Language
 from judge.utils.unicode import utf8bytes
 
-__all__ = ['SUBMISSION_RESULT', 'Submission', 'SubmissionSource', 'SubmissionTestCase']
+__all__ = ['SUBMISSION_RESULT', 'Submission', 'SubmissionResultCount', 'SubmissionSource', 'SubmissionTestCase',
+           'UserProblemPoints']
 
 SUBMISSION_RESULT = (
     ('AC', _('Accepted')),
@@ -81,6 +84,7 @@ class Submission(models.Model):
     is_pretested = models.BooleanField(verbose_name=_('was ran on pretests only'), default=False)
     contest_object = models.ForeignKey('Contest', verbose_name=_('contest'), null=True, blank=True,
                                        on_delete=models.SET_NULL, related_name='+')
+    attempt_no = models.IntegerField(verbose_name=_('attempt number'), null=True, blank=True)
 
     objects = TranslatedProblemForeignKeyQuerySet.as_manager()
 
@@ -121,7 +125,7 @@ class Submission(models.Model):
 
     abort.alters_data = True
 
-    def update_contest(self):
+    def update_contest(self, recompute_results=True):
         try:
             contest = self.contest
         except AttributeError:
@@ -133,10 +137,23 @@ class Submission(models.Model):
         if not contest_problem.partial and contest.points != contest_problem.points:
             contest.points = 0
         contest.save()
-        contest.participation.recompute_results()
+        if recompute_results:
+            contest.participation.recompute_results()
 
     update_contest.alters_data = True
 
+    def get_attempt_no(self):
+        """
+        Counts this and earlier submissions to the problem in the same participation, except CE and IE.
+
+        The count is stored in attempt_no when the submission is made, and not updated afterwards: an earlier
+        submission that was still queued is counted even if it later fails to compile, and rejudging keeps the number.
+        """
+        return Submission.objects.filter(
+            problem_id=self.problem_id, user_id=self.user_id, date__lt=self.date,
+            contest__participation_id=self.contest_or_none and self.contest_or_none.participation_id,
+        ).exclude(status__in=('CE', 'IE')).count() + 1
+
     @property
     def is_graded(self):
         return self.status not in ('QU', 'P', 'G')
@@ -213,3 +230,144 @@ class SubmissionTestCase(models.Model):
     class Meta:
         verbose_name = _('submission test case')
         verbose_name_plural = _('submission test cases')
+
+
+class UserProblemPoints(models.Model):
+    user = models.ForeignKey(Profile, verbose_name=_('user'), related_name='problem_points', on_delete=models.CASCADE)
+    problem = models.ForeignKey(Problem, verbose_name=_('problem'), related_name='+', on_delete=models.CASCADE)
+    points = models.FloatField(verbose_name=_('best points'), default=0)
+    is_accepted = models.BooleanField(verbose_name=_('has accepted submission'), default=False)
+
+    @classmethod
+    def record_submission(cls, submission):
+        """
+        Folds a newly graded submission into its author's best result on the problem. This only writes when the
+        submission beats the stored result, except for rejudges, which may have lowered the previous best.
+
+        Returns 1 if the user has now solved the problem and had not before, -1 if a rejudge took that away, else 0.
+        Like the problem's user count, a problem is solved by an accepted submission worth its full points.
+        """
+        if submission.was_rejudged:
+            solved = cls.objects.filter(user_id=submission.user_id, problem_id=submission.problem_id,
+                                        is_accepted=True)
+            before = solved.exists()
+            cls.recompute(submission.user_id, submission.problem_id)
+            return solved.exists() - before
+        if submission.points is None:
+            return 0
+
+        accepted = submission.result == 'AC' and submission.points >= submission.problem.points
+        best, created = cls.objects.get_or_create(user_id=submission.user_id, problem_id=submission.problem_id,
+                                                  defaults={'points': submission.points, 'is_accepted': accepted})
+        if created:
+            return int(accepted)
+        if submission.points > best.points:
+            cls.objects.filter(id=best.id, points__lt=submission.points).update(points=submission.points)
+        if accepted and not best.is_accepted:
+            return cls.objects.filter(id=best.id, is_accepted=False).update(is_accepted=True)
+        return 0
+
+    @classmethod
+    def best_submissions(cls, submissions):
+        return (submissions.filter(points__isnull=False).values('user_id', 'problem_id')
+                           .annotate(best=Max('points'),
+                                     accepted=Max(Case(When(result='AC', points__gte=F('problem__points'), then=1),
+                                                       default=0,
+                                                       output_field=IntegerField())))
+                           .order_by())
+
+    @classmethod
+    def recompute(cls, user_id, problem_id=None):
+        """Rebuilds a user's best results from their submissions, on one problem or on all of them."""
+        submissions = Submission.objects.filter(user_id=user_id)
+        existing = cls.objects.filter(user_id=user_id)
+        if problem_id is not None:
+            submissions = submissions.filter(problem_id=problem_id)
+            existing = existing.filter(problem_id=problem_id)
+
+        with transaction.atomic():
+            existing.delete()
+            cls.objects.bulk_create([
+                cls(user_id=user_id, problem_id=row['problem_id'], points=row['best'],
+                    is_accepted=bool(row['accepted']))
+                for row in cls.best_submissions(submissions)
+            ])
+
+    class Meta:
+        unique_together = ('user', 'problem')
+        verbose_name = _('user problem points')
+        verbose_name_plural = _('user problem points')
+
+
+class SubmissionResultCount(models.Model):
+    """
+    How many submissions have each result, overall and per problem, user, contest and language, so that result
+    distributions can be read without counting submissions. Kept up to date as results change; the
+    reconcile_result_counts command rebuilds it.
+    """
+    SCOPES = (
+        ('global', _('all submissions')),
+        ('problem', _('problem')),
+        ('user', _('user')),
+        ('contest', _('contest')),
+        ('language', _('language')),
+    )
+
+    scope = models.CharField(verbose_name=_('scope'), max_length=8, choices=SCOPES)
+    key = models.IntegerField(verbose_name=_('scope ID'), default=0)
+    result = models.CharField(verbose_name=_('result'), max_length=3, choices=SUBMISSION_RESULT)
+    count = models.IntegerField(verbose_name=_('submission count'), default=0)
+
+    @staticmethod
+    def scopes(problem_id, user_id, contest_id, language_id):
+        scopes = [('global', 0), ('problem', problem_id), ('user', user_id), ('language', language_id)]
+        if contest_id is not None:
+            scopes.append(('contest', contest_id))
+        return scopes
+
+    @classmethod
+    def count_change(cls, deltas, problem_id, user_id, contest_id, language_id, old, new):
+        """Adds a submission's result changing from old to new, either of which may be None, to a Counter."""
+        if old == new:
+            return
+        for scope, key in cls.scopes(problem_id, user_id, contest_id, language_id):
+            if old is not None:
+                deltas[scope, key, old] -= 1
+            if new is not None:
+                deltas[scope, key, new] += 1
+
+    @classmethod
+    def apply(cls, deltas, chunk_size=500):
+        """Adds a Counter of (scope, key, result) to the stored counts, in a few queries however many it has."""
+        deltas = [(row, delta) for row, delta in deltas.items() if delta]
+        for start in range(0, len(deltas), chunk_size):
+            chunk = deltas[start:start + chunk_size]
+            cls.objects.bulk_create([cls(scope=scope, key=key, result=result) for (scope, key, result), delta in chunk],
+                                    ignore_conflicts=True)
+            matches = [(Q(scope=scope, key=key, result=result), delta) for (scope, key, result), delta in chunk]
+            condition = Q()
+            for match, delta in matches:
+                condition |= match
+            cls.objects.filter(condition).update(count=F('count') + Case(
+                *[When(match, then=Value(delta)) for match, delta in matches],
+                default=Value(0), output_field=IntegerField(),
+            ))
+
+    @classmethod
+    def record(cls, problem_id, user_id, contest_id, language_id, old, new):
+        deltas = Counter()
+        cls.count_change(deltas, problem_id, user_id, contest_id, language_id, old, new)
+        cls.apply(deltas)
+
+    @classmethod
+    def results(cls, scope, key=0, results=None):
+        """The number of submissions with each result in a scope, optionally only for the given results."""
+        counts = cls.objects.filter(scope=scope, key=key, count__gt=0)
+        if results:
+            counts = counts.filter(result__in=results)
+        return dict(counts.values_list('result', 'count'))
+
+    class Meta:
+        unique_together = ('scope', 'key', 'result')
+        verbose_name = _('submission result count')
+        verbose_name_plural = _('submission result counts')
@@ -2,10 +2,12 @@ import math
 from bisect import bisect
 from operator import itemgetter
 
+import numpy as np
 from django.db import connection, transaction
 from django.db.models import Count
 from django.utils import timezone
 
+from judge.scoreboard import post_contest_update
 from judge.utils.ranker import tie_ranker
 
 
@@ -35,6 +37,78 @@ def WP(RA, RB, VA, VB):
     return (math.erf((RB - RA) / math.sqrt(2 * (VA * VA + VB * VB))) + 1) / 2.0
 
 
+# Coefficients of W. J. Cody's rational Chebyshev approximations to erf and erfc, as used by SPECFUN's CALERF.
+ERF_A = [3.16112374387056560e00, 1.13864154151050156e02, 3.77485237685302021e02, 3.20937758913846947e03,
+         1.85777706184603153e-1]
+ERF_B = [2.36012909523441209e01, 2.44024637934444173e02, 1.28261652607737228e03, 2.84423683343917062e03]
+ERF_C = [5.64188496988670089e-1, 8.88314979438837594e00, 6.61191906371416295e01, 2.98635138197400131e02,
+         8.81952221241769090e02, 1.71204761263407058e03, 2.05107837782607147e03, 1.23033935479799725e03,
+         2.15311535474403846e-8]
+ERF_D = [1.57449261107098347e01, 1.17693950891312499e02, 5.37181101862009858e02, 1.62138957456669019e03,
+         3.29079923573345963e03, 4.36261909014324716e03, 3.43936767414372164e03, 1.23033935480374942e03]
+ERF_P = [3.05326634961232344e-1, 3.60344899949804439e-1, 1.25781726111229246e-1, 1.60837851487422766e-2,
+         6.58749161529837803e-4, 1.63153871373020978e-2]
+ERF_Q = [2.56852019228982242e00, 1.87295284992346725e00, 5.27905102951428412e-1, 6.05183413124413191e-2,
+         2.33520497626869185e-3]
+
+
+def erf(x):
+    """Element-wise erf of a NumPy array, accurate to within a few ulps of math.erf."""
+    y = np.abs(x)
+    result = np.empty_like(y)
+
+    small = y <= 0.46875
+    ysq = y[small] ** 2
+    num, den = ERF_A[4] * ysq, ysq
+    for a, b in zip(ERF_A[:3], ERF_B[:3]):
+        num, den = (num + a) * ysq, (den + b) * ysq
+    result[small] = y[small] * (num + ERF_A[3]) / (den + ERF_B[3])
+
+    # erfc(y) = exp(-y^2) R(y), with exp(-y^2) split to avoid losing precision in y^2.
+    medium = (y > 0.46875) & (y <= 4.0)
+    ym = y[medium]
+    num, den = ERF_C[8] * ym, ym
+    for c, d in zip(ERF_C[:7], ERF_D[:7]):
+        num, den = (num + c) * ym, (den + d) * ym
+    erfc = (num + ERF_C[7]) / (den + ERF_D[7])
+    ysq = np.trunc(ym * 16.0) / 16.0
+    erfc *= np.exp(-ysq * ysq) * np.exp(-(ym - ysq) * (ym + ysq))
+    result[medium] = (0.5 - erfc) + 0.5
+
+    large = y > 4.0
+    yl = y[large]
+    inv = 1.0 / (yl * yl)
+    num, den = ERF_P[5] * inv, inv
+    for p, q in zip(ERF_P[:4], ERF_Q[:4]):
+        num, den = (num + p) * inv, (den + q) * inv
+    erfc = (1 / math.sqrt(math.pi) - inv * (num + ERF_P[4]) / (den + ERF_Q[4])) / yl
+    ysq = np.trunc(yl * 16.0) / 16.0
+    erfc *= np.exp(-ysq * ysq) * np.exp(-(yl - ysq) * (yl + ysq))
+    result[large] = (0.5 - erfc) + 0.5
+
+    return np.copysign(result, x)
+
+
+def expected_ranks(old_rating, old_volatility, block_size=2 ** 20):
+    """
+    Returns 0.5 plus the sum of WP against every participant, for each participant. The N by N matrix of win
+    probabilities is evaluated a block of rows at a time, each of about block_size entries, to bound memory use.
+    """
+    rating = np.array(old_rating, dtype=np.float64)
+    variance = np.array(old_volatility, dtype=np.float64) ** 2
+    N = len(rating)
+    ranks = np.empty(N)
+    rows = max(1, block_size // N)
+    for start in range(0, N, rows):
+        stop = min(start + rows, N)
+        wp = (erf((rating - rating[start:stop, None]) /
+                  np.sqrt(2 * (variance[start:stop, None] + variance))) + 1) / 2.0
+        # Accumulate left to right from 0.5, in the same order as summing the WP terms one by one.
+        wp[:, 0] += 0.5
+        ranks[start:stop] = np.cumsum(wp, axis=1)[:, -1]
+    return ranks.tolist()
+
+
 def recalculate_ratings(old_rating, old_volatility, actual_rank, times_rated):
     # actual_rank: 1 is first place, N is last place
     # if there are ties, use the average of places (if places 2, 3, 4, 5 tie, use 3.5 for all of them)
@@ -53,10 +127,9 @@ def recalculate_ratings(old_rating, old_volatility, actual_rank, times_rated):
     sum2 = sum((i - ave_rating) ** 2 for i in old_rating) / (N - 1)
     CF = math.sqrt(sum1 + sum2)
 
+    expected = expected_ranks(old_rating, old_volatility)
     for i in range(N):
-        ERank = 0.5
-        for j in range(N):
-            ERank += WP(old_rating[i], old_rating[j], old_volatility[i], old_volatility[j])
+        ERank = expected[i]
 
         EPerf = -normal_CDF_inverse((ERank - 0.5) / N)
         APerf = -normal_CDF_inverse((actual_rank[i] - 0.5) / N)
@@ -93,9 +166,8 @@ def recalculate_ratings(old_rating, old_volatility, actual_rank, times_rated):
     return list(map(int, map(round, new_rating))), list(map(int, map(round, new_volatility)))
 
 
-def rate_contest(contest):
-    from judge.models import Rating, Profile
-
+def previous_ratings(contest):
+    """Maps the contest's participants to their (rating, volatility, times rated) before the contest."""
     cursor = connection.cursor()
     cursor.execute('''
         SELECT judge_rating.user_id, judge_rating.rating, judge_rating.volatility, r.times
@@ -116,7 +188,17 @@ def rate_contest(contest):
     ''', (contest.id, contest.end_time, contest.id))
     data = {user: (rating, volatility, times) for user, rating, volatility, times in cursor.fetchall()}
     cursor.close()
+    return data
+
+
+def rate_contest(contest, previous=None):
+    """
+    Rates the contest. `previous` may map user ids to their (rating, volatility, times rated) before the contest, as
+    returned by previous_ratings, when the caller already knows them. Returns the same mapping for after the contest.
+    """
+    from judge.models import Rating, Profile
 
+    data = previous_ratings(contest) if previous is None else previous
     users = contest.users.order_by('-score', 'cumtime').annotate(submissions=Count('submission')) \
                    .exclude(user_id__in=contest.rate_exclude.all()).filter(virtual=0, user__is_unlisted=False) \
                    .values_list('id', 'user_id', 'score', 'cumtime')
@@ -151,7 +233,8 @@ def rate_contest(contest):
         ''' % Profile._meta.db_table)
     cursor.execute('DROP TABLE _profile_rating_update')
     cursor.close()
-    return old_rating, old_volatility, ranking, times_ranked, rating, volatility
+    post_contest_update(contest.id)
+    return {user: (r, v, times + 1) for user, r, v, times in zip(user_ids, rating, volatility, times_ranked)}
 
 
 RATING_LEVELS = ['Newbie', 'Amateur', 'Expert', 'Candidate Master', 'Master', 'Grandmaster', 'Target']
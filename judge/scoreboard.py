@@ -0,0 +1,156 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+
+from judge import event_poster as event
+
+ContestRankingProfile = namedtuple(
+    'ContestRankingProfile',
+    'id user css_class username points cumtime participation '
+    'participation_rating problem_cells result_cell',
+)
+
+SCOREBOARD_TIMEOUT = getattr(settings, 'DMOJ_SCOREBOARD_CACHE_TIMEOUT', 3600)
+
+
+def make_contest_ranking_profile(contest, participation, contest_problems, is_scoreboard_frozen):
+    user = participation.user
+
+    return ContestRankingProfile(
+        id=user.id,
+        user=user.user,
+        css_class=user.css_class,
+        username=user.username,
+        points=participation.frozen_score if is_scoreboard_frozen else participation.score,
+        cumtime=participation.frozen_cumtime if is_scoreboard_frozen else participation.cumtime,
+        participation_rating=participation.rating.rating if hasattr(participation, 'rating') else None,
+        problem_cells=[contest.format.display_user_problem(participation, contest_problem, is_scoreboard_frozen)
+                       for contest_problem in contest_problems],
+        result_cell=contest.format.display_participation_result(participation, is_scoreboard_frozen),
+        participation=participation,
+    )
+
+
+# The scoreboard of live participants is cached as an index of participation ids per contest, plus one entry per
+# participation holding its score and rendered cells. Results are recomputed one participation at a time, so only that
+# entry is rebuilt, and an entry that has been evicted is simply rebuilt on the next read. User fields such as names,
+# colours and whether the user is unlisted are read fresh every time, so nothing needs invalidating when a profile
+# changes. The index is dropped by post_contest_update whenever the set of rows or the way they render changes.
+
+ScoreboardRow = namedtuple('ScoreboardRow', 'user_id points cumtime participation participation_rating '
+                                            'problem_cells result_cell')
+
+
+def _index_key(contest_id, is_scoreboard_frozen):
+    return 'contest_scoreboard:%d:%d' % (contest_id, is_scoreboard_frozen)
+
+
+def _row_key(participation_id, is_scoreboard_frozen):
+    return 'contest_scoreboard_row:%d:%d' % (participation_id, is_scoreboard_frozen)
+
+
+def _live_participations(contest):
+    return contest.users.filter(virtual=0).select_related('rating')
+
+
+def _make_rows(contest, participations, problems, is_scoreboard_frozen):
+    rows = {}
+    for participation in participations:
+        participation.contest = contest
+        rows[participation.id] = ScoreboardRow(
+            user_id=participation.user_id,
+            points=participation.frozen_score if is_scoreboard_frozen else participation.score,
+            cumtime=participation.frozen_cumtime if is_scoreboard_frozen else participation.cumtime,
+            participation=participation,
+            participation_rating=participation.rating.rating if hasattr(participation, 'rating') else None,
+            problem_cells=[contest.format.display_user_problem(participation, contest_problem, is_scoreboard_frozen)
+                           for contest_problem in problems],
+            result_cell=contest.format.display_participation_result(participation, is_scoreboard_frozen),
+        )
+        # Don't store a copy of the contest or the user in every row; they are attached again when the rows are read.
+        participation._state.fields_cache.pop('contest', None)
+        participation._state.fields_cache.pop('user', None)
+    cache.set_many({_row_key(id, is_scoreboard_frozen): row for id, row in rows.items()}, SCOREBOARD_TIMEOUT)
+    return rows
+
+
+def get_contest_scoreboard(contest, problems, is_scoreboard_frozen, is_show_full_scoreboard=False):
+    """Returns the ranking rows of the contest's live participants, best first."""
+    from judge.models import Profile
+
+    index = cache.get(_index_key(contest.id, is_scoreboard_frozen))
+    if index is None:
+        rows = _make_rows(contest, _live_participations(contest), problems, is_scoreboard_frozen)
+        index = list(rows)
+        cache.set(_index_key(contest.id, is_scoreboard_frozen), index, SCOREBOARD_TIMEOUT)
+    else:
+        cached = cache.get_many([_row_key(id, is_scoreboard_frozen) for id in index])
+        rows = {row.participation.id: row for row in cached.values()}
+        missing = [id for id in index if id not in rows]
+        if missing:
+            rows.update(_make_rows(contest, _live_participations(contest).filter(id__in=missing), problems,
+                                   is_scoreboard_frozen))
+
+    rows = [rows[id] for id in index if id in rows]
+    profiles = Profile.objects.filter(id__in=[row.user_id for row in rows], is_unlisted=False)
+    if not is_show_full_scoreboard and contest.primary_group is not None:
+        profiles = profiles.filter(user__groups=contest.primary_group)
+    profiles = {profile.id: profile for profile in profiles.select_related('user').defer('about')}
+
+    ranking = []
+    for row in rows:
+        profile = profiles.get(row.user_id)
+        if profile is None:
+            continue
+        row.participation.contest = contest
+        row.participation.user = profile
+        ranking.append(ContestRankingProfile(
+            id=profile.id,
+            user=profile.user,
+            css_class=profile.css_class,
+            username=profile.username,
+            points=row.points,
+            cumtime=row.cumtime,
+            participation=row.participation,
+            participation_rating=row.participation_rating,
+            problem_cells=row.problem_cells,
+            result_cell=row.result_cell,
+        ))
+    ranking.sort(key=lambda row: (-row.points, row.cumtime))
+    return ranking
+
+
+def update_contest_scoreboard(participation):
+    """Re-renders a participation's scoreboard rows after its results have been recomputed."""
+    if not participation.live:
+        return
+
+    contest = participation.contest
+    cached = cache.get_many([_index_key(contest.id, False), _index_key(contest.id, True)])
+    frozen = [is_scoreboard_frozen for is_scoreboard_frozen in (False, True)
+              if _index_key(contest.id, is_scoreboard_frozen) in cached]
+    if not frozen:
+        return
+
+    try:
+        participation = _live_participations(contest).get(id=participation.id)
+    except ObjectDoesNotExist:
+        return
+    problems = list(contest.contest_problems.select_related('problem').defer('problem__description').order_by('order'))
+    for is_scoreboard_frozen in frozen:
+        _make_rows(contest, [participation], problems, is_scoreboard_frozen)
+
+
+def invalidate_contest_scoreboard(contest_id):
+    cache.delete_many([_index_key(contest_id, False), _index_key(contest_id, True)])
+
+
+def post_contest_update(contest_id):
+    """
+    Drops the contest's cached scoreboard and posts the contest_%d event, on which open ranking pages reload it.
+    Called whenever the contest's participants, problems or format change, or it is rated.
+    """
+    invalidate_contest_scoreboard(contest_id)
+    event.post('contest_%d' % contest_id, {'type': 'update'})
@@ -9,8 +9,8 @@ from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 from .caching import finished_submission
-from .models import BlogPost, Comment, Contest, ContestSubmission, EFFECTIVE_MATH_ENGINES, Judge, Language, License, \
-    Problem, Profile, Submission
+from .models import BlogPost, Comment, Contest, ContestSubmission, EFFECTIVE_MATH_ENGINES, Judge, Language, \
+    LanguageLimit, License, Problem, Profile, Submission, SubmissionResultCount, UserProblemPoints
 
 
 def get_pdf_path(basename):
@@ -33,7 +33,7 @@ def problem_update(sender, instance, **kwargs):
     cache.delete_many([
         make_template_fragment_key('submission_problem', (instance.id,)),
         make_template_fragment_key('problem_feed', (instance.id,)),
-        'problem_tls:%s' % instance.id, 'problem_mls:%s' % instance.id,
+        'problem_tls:%s' % instance.id, 'problem_mls:%s' % instance.id, 'problem_limits:%s' % instance.id,
     ])
     cache.delete_many([make_template_fragment_key('problem_html', (instance.id, engine, lang))
                        for lang, _ in settings.LANGUAGES for engine in EFFECTIVE_MATH_ENGINES])
@@ -47,6 +47,14 @@ def problem_update(sender, instance, **kwargs):
             unlink_if_exists(get_pdf_path('%s.%s.log' % (instance.code, lang)))
 
 
+@receiver(post_save, sender=LanguageLimit)
+@receiver(post_delete, sender=LanguageLimit)
+def language_limit_update(sender, instance, **kwargs):
+    # Language limits are saved after their problem in the admin, so the problem's signal is too early.
+    cache.delete_many(['problem_tls:%s' % instance.problem_id, 'problem_mls:%s' % instance.problem_id,
+                       'problem_limits:%s' % instance.problem_id])
+
+
 @receiver(post_save, sender=Profile)
 def profile_update(sender, instance, **kwargs):
     if hasattr(instance, '_updating_stats_only'):
@@ -80,6 +88,7 @@ def language_update(sender, instance, **kwargs):
 @receiver(post_save, sender=Judge)
 def judge_update(sender, instance, **kwargs):
     cache.delete(make_template_fragment_key('judge_html', (instance.id,)))
+    Judge.invalidate_problem_judges()
 
 
 @receiver(post_save, sender=Comment)
@@ -98,10 +107,19 @@ def post_update(sender, instance, **kwargs):
                        for engine in EFFECTIVE_MATH_ENGINES])
 
 
+@receiver(post_save, sender=Submission)
+def submission_update(sender, instance, created, **kwargs):
+    if created:
+        instance.problem.adjust_stats(submissions=1)
+
+
 @receiver(post_delete, sender=Submission)
 def submission_delete(sender, instance, **kwargs):
     finished_submission(instance)
+    SubmissionResultCount.record(instance.problem_id, instance.user_id, instance.contest_object_id,
+                                 instance.language_id, instance.result, None)
     instance.problem.update_stats()
+    UserProblemPoints.recompute(instance.user_id, instance.problem_id)
     instance.user.calculate_points()
 
 
@@ -0,0 +1,96 @@
+from celery import shared_task
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.translation import gettext as _
+
+from judge.models import Contest, Profile, Rating
+from judge.ratings import rate_contest
+from judge.utils.celery import Progress
+
+__all__ = ('rate_all_contests',)
+
+RATE_ALL_CHECKPOINT = 'rate_all_contests:checkpoint'
+# Holds the id of the running task. It is released when the task ends; the timeout only matters if its worker dies.
+RATE_ALL_LOCK = 'rate_all_contests:lock'
+RATE_ALL_LOCK_TIMEOUT = 86400
+
+
+def _clear_ratings():
+    if connection.vendor == 'sqlite':
+        Rating.objects.all().delete()
+    else:
+        cursor = connection.cursor()
+        cursor.execute('TRUNCATE TABLE `%s`' % Rating._meta.db_table)
+        cursor.close()
+    Profile.objects.update(rating=None)
+
+
+def _stored_ratings(contests, previous=None):
+    # Rebuilds the in-memory ratings after the given contests from the ratings table, on top of `previous`.
+    previous = previous or {}
+    ratings = {}
+    for user_id, rating, volatility in Rating.objects.filter(contest__in=contests) \
+            .order_by('contest__end_time', 'contest_id').values_list('user_id', 'rating', 'volatility'):
+        ratings[user_id] = rating, volatility, ratings.get(user_id, previous.get(user_id, (0, 0, 0)))[2] + 1
+    return ratings
+
+
+@shared_task(bind=True)
+def rate_all_contests(self):
+    """
+    Re-rates every rated contest in chronological order. Each contest's results are kept in memory as the input to
+    the next, instead of being queried back from the ratings table. Progress is checkpointed after every contest, so
+    running the task again after it was interrupted continues where it stopped.
+
+    Only one instance runs at a time. The lock is normally taken by whoever starts the task, with the task's id; if
+    another instance holds it, this one does nothing and returns None.
+    """
+    if cache.get(RATE_ALL_LOCK) != self.request.id and \
+            not cache.add(RATE_ALL_LOCK, self.request.id, RATE_ALL_LOCK_TIMEOUT):
+        return None
+    try:
+        return _rate_all_contests(self)
+    finally:
+        if cache.get(RATE_ALL_LOCK) == self.request.id:
+            cache.delete(RATE_ALL_LOCK)
+
+
+def _rate_all_contests(task):
+    contests = list(Contest.objects.filter(is_rated=True).order_by('end_time', 'id'))
+    checkpoint = cache.get(RATE_ALL_CHECKPOINT)
+    done = 0
+    if checkpoint is not None:
+        done = next((i + 1 for i, contest in enumerate(contests) if contest.id == checkpoint), 0)
+
+    # Ratings before a contest only include contests that ended strictly earlier, so results are only made visible
+    # to later contests once the end time moves on.
+    if done:
+        end_time = contests[done - 1].end_time
+        ratings = _stored_ratings([contest for contest in contests[:done] if contest.end_time < end_time])
+        pending = _stored_ratings([contest for contest in contests[:done] if contest.end_time == end_time], ratings)
+        Rating.objects.filter(contest__in=contests[done:]).delete()
+    else:
+        end_time = None
+        ratings, pending = {}, {}
+        with transaction.atomic():
+            _clear_ratings()
+
+    with Progress(task, len(contests), stage=_('Rating contests')) as p:
+        p.done = done
+        for contest in contests[done:]:
+            if contest.end_time != end_time:
+                ratings.update(pending)
+                pending = {}
+                end_time = contest.end_time
+            with transaction.atomic():
+                results = rate_contest(contest, ratings)
+            for user_id, (rating, volatility, times) in results.items():
+                if user_id in pending:
+                    # Rated in another contest that ended at the same time, which counts too.
+                    times = pending[user_id][2] + 1
+                pending[user_id] = rating, volatility, times
+            cache.set(RATE_ALL_CHECKPOINT, contest.id, None)
+            p.did(1)
+
+    cache.delete(RATE_ALL_CHECKPOINT)
+    return len(contests)
@@ -2,11 +2,14 @@ from celery import shared_task
 from django.core.cache import cache
 from django.utils.translation import gettext as _
 
-from judge.models import Problem, Profile, Submission
+from judge.judgeapi import judge_submissions
+from judge.models import Problem, Profile, Submission, UserProblemPoints
 from judge.utils.celery import Progress
 
 __all__ = ('apply_submission_filter', 'rejudge_problem_filter', 'rescore_problem')
 
+REJUDGE_CHUNK_SIZE = 1000
+
 
 def apply_submission_filter(queryset, id_range, languages, results):
     if id_range:
@@ -23,14 +26,14 @@ def apply_submission_filter(queryset, id_range, languages, results):
 def rejudge_problem_filter(self, problem_id, id_range=None, languages=None, results=None):
     queryset = Submission.objects.filter(problem_id=problem_id)
     queryset = apply_submission_filter(queryset, id_range, languages, results)
+    ids = list(queryset.order_by('id').values_list('id', flat=True))
 
     rejudged = 0
-    with Progress(self, queryset.count()) as p:
-        for submission in queryset.iterator():
-            submission.judge(rejudge=True, batch_rejudge=True)
-            rejudged += 1
-            if rejudged % 10 == 0:
-                p.done = rejudged
+    with Progress(self, len(ids)) as p:
+        for start in range(0, len(ids), REJUDGE_CHUNK_SIZE):
+            judge_submissions(ids[start:start + REJUDGE_CHUNK_SIZE], rejudge=True, batch_rejudge=True)
+            rejudged = min(start + REJUDGE_CHUNK_SIZE, len(ids))
+            p.done = rejudged
     return rejudged
 
 
@@ -52,11 +55,16 @@ def rescore_problem(self, problem_id):
             if rescored % 10 == 0:
                 p.done = rescored
 
+    # Every submission's points may have moved relative to the problem's, so recount instead of adjusting.
+    problem._updating_stats_only = True
+    problem.update_stats()
+
     with Progress(self, submissions.values('user_id').distinct().count(), stage=_('Recalculating user points')) as p:
         users = 0
         profiles = Profile.objects.filter(id__in=submissions.values_list('user_id', flat=True).distinct())
         for profile in profiles.iterator():
             profile._updating_stats_only = True
+            UserProblemPoints.recompute(profile.id, problem_id)
             profile.calculate_points()
             cache.delete('user_complete:%d' % profile.id)
             cache.delete('user_attempted:%d' % profile.id)
@@ -1 +1,1348 @@
-# Create your tests here.
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import zlib
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+from urllib.request import urlopen
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from event_socket_server import Handler, SizedPacketHandler, engines
+from event_socket_server.helpers import size_pack
+from websocket import WebSocketException
+
+from judge.bridge.djangohandler import DjangoHandler
+from judge.bridge.judgecallback import DjangoJudgeHandler, GradingResult
+from judge.bridge.journal import QueueJournal
+from judge.bridge.judgelist import FairSharePolicy, JudgeList, LeastLoadSelector, ScoringSelector, \
+    StrictPriorityPolicy, SubmissionQueue, judge_speed_factors
+from judge.bridge.metrics import BridgeMetrics, Histogram, serve_metrics
+from judge.bridge.recompute import RecomputeQueue
+from judge.bridge.sharding import ShardCoordinator
+from judge.bridge.simulated_judge import SimulatedJudge
+from judge.bridge.writebuffer import JudgeStatusBuffer, ResultCountBuffer, SubmissionWriteBuffer
+from judge.event_poster_ws import AsyncEventPoster, EventPostingError
+from judge.judgeapi import BATCH_REJUDGE_PRIORITY, BridgeError, judge_submission, judge_submissions
+from judge.management.commands.benchmark_ratings import legacy_recalculate_ratings
+from judge.models import Contest, ContestParticipation, ContestProblem, ContestSubmission, Judge, Language, Problem, \
+    ProblemGroup, Profile, Rating, Submission, SubmissionResultCount, SubmissionSource, SubmissionTestCase, \
+    UserProblemPoints
+from judge.ratings import WP, erf, expected_ranks, recalculate_ratings
+from judge.tasks import rate_all_contests
+from judge.tasks.contest import RATE_ALL_CHECKPOINT, RATE_ALL_LOCK, _rate_all_contests
+from judge.scoreboard import get_contest_scoreboard, post_contest_update
+from judge.views.status import with_live_status
+
+
+class FakeJudge(object):
+    """Just enough of a judge handler for a JudgeList: it takes one submission at a time and never finishes it."""
+
+    def __init__(self, name, problems, executors):
+        self.name = name
+        self.problems = problems
+        self.executors = executors
+        self.load = 0
+        self.current = None
+
+    @property
+    def working(self):
+        return self.current is not None
+
+    def can_judge(self, problem, executor):
+        return problem in self.problems and executor in self.executors
+
+    def submit(self, id, problem, language, source):
+        self.current = id
+
+    def get_current_submission(self):
+        return self.current
+
+    def abort(self):
+        pass
+
+    def disconnect(self, force=False):
+        pass
+
+
+class QueueJournalTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'queue.journal')
+
+    def journal(self, **kwargs):
+        journal = QueueJournal(self.path, **kwargs)
+        self.addCleanup(journal.close)
+        return journal
+
+    def replayed(self):
+        return [submission[0] for submission in self.journal().replay()]
+
+    def test_replay(self):
+        journal = self.journal()
+        for id in range(1, 6):
+            journal.enqueue(id, 'aplusb', 'PY3', 'print(1)', 1, user=id, contest=None)
+        journal.dispatch(2)
+        journal.dispatch(3)
+        journal.complete(3)
+        journal.complete(4)
+        journal.sync()
+
+        submissions = self.journal().replay()
+        self.assertEqual([submission[0] for submission in submissions], [1, 2, 5])
+        self.assertEqual(submissions[0], (1, 'aplusb', 'PY3', 'print(1)', 1, 1, None))
+
+    def test_dispatched_but_unfinished_survives_compaction(self):
+        journal = self.journal()
+        journal.enqueue(1, 'aplusb', 'PY3', 'print(1)', 1)
+        journal.dispatch(1)
+        journal.sync()
+
+        # Replaying compacts the file, which must still know the submission was being judged.
+        replayed = self.journal()
+        self.assertEqual([submission[0] for submission in replayed.replay()], [1])
+        self.assertEqual(replayed._dispatched, {1})
+        replayed.close()
+        self.assertEqual(self.replayed(), [1])
+
+    def test_torn_record(self):
+        journal = self.journal()
+        for id in range(1, 4):
+            journal.enqueue(id, 'aplusb', 'PY3', 'print(1)', 1)
+        journal.sync()
+        journal.complete(1)
+        journal.sync()
+        journal.close()
+
+        # A crash in the middle of appending the last record leaves only part of it on disk.
+        size = os.path.getsize(self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(size - 5)
+        self.assertEqual(self.replayed(), [1, 2, 3])
+
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 10)
+        self.assertEqual(self.replayed(), [1, 2])
+
+    def run_bridge(self):
+        journal = QueueJournal(self.path, compact_min=20, compact_ratio=2)
+        judges = JudgeList(journal=journal)
+        judge = FakeJudge('judge', {'aplusb'}, {'PY3'})
+        judges.register(judge)
+
+        # Syncing and compacting run on another thread while submissions are queued, as they do in the bridge.
+        stop = threading.Event()
+
+        def sync():
+            while not stop.is_set():
+                journal.sync()
+
+        thread = threading.Thread(target=sync)
+        thread.start()
+        for id in range(1, 201):
+            judges.judge(id, 'aplusb', 'PY3', 'print(%d)' % id, id % 2, user=id)
+            if id < 150:
+                finished, judge.current = judge.current, None
+                judges.on_judge_free(judge, finished)
+        stop.set()
+        thread.join()
+        journal.sync()
+
+        # Never synced, so lost with the bridge.
+        judges.judge(201, 'aplusb', 'PY3', 'print(201)', 1)
+        os.kill(os.getpid(), signal.SIGKILL)
+
+    def test_bridge_killed_mid_queue(self):
+        bridge = multiprocessing.get_context('fork').Process(target=self.run_bridge)
+        bridge.start()
+        bridge.join(60)
+        self.assertEqual(bridge.exitcode, -signal.SIGKILL)
+
+        judges = JudgeList(journal=self.journal())
+        for submission in judges.journal.replay():
+            judges.judge(*submission)
+        queued = list(judges.queue)
+        # The submission being judged when the bridge died is queued again along with the rest, by priority.
+        self.assertEqual([entry.id for entry in queued], list(range(150, 201, 2)) + list(range(151, 201, 2)))
+        self.assertEqual((queued[0].source, queued[0].priority, queued[0].user), ('print(150)', 0, 150))
+
+    def test_compaction(self):
+        journal = self.journal(compact_min=10, compact_ratio=2)
+        for id in range(1, 21):
+            journal.enqueue(id, 'aplusb', 'PY3', 'print(1)', 1)
+            journal.dispatch(id)
+            if id % 5:
+                journal.complete(id)
+        journal.sync()
+
+        with open(self.path, 'rb') as f:
+            records = f.read().splitlines()
+        # Four live submissions, each with its enqueue and dispatch records.
+        self.assertEqual(len(records), 8)
+        self.assertEqual(self.replayed(), [5, 10, 15, 20])
+
+        journal.enqueue(21, 'aplusb', 'PY3', 'print(1)', 1)
+        journal.sync()
+        self.assertEqual(self.replayed(), [5, 10, 15, 20, 21])
+
+
+class SubmissionQueueTest(SimpleTestCase):
+    def test_dispatch_order_matches_linear_scan(self):
+        rng = random.Random(0)
+        problems = ['p%d' % i for i in range(20)]
+        languages = ['L%d' % i for i in range(4)]
+        pools = [(set(rng.sample(problems, 10)), set(rng.sample(languages, 2))) for _ in range(4)]
+        judges = [FakeJudge('judge%d' % i, *rng.choice(pools)) for i in range(10)]
+        queue = SubmissionQueue(JudgeList.priorities)
+        for judge in judges:
+            queue.attach(judge)
+
+        # Every queued submission by priority, then by when it was queued, as the bridge used to scan them.
+        pending = []
+        for id in range(1, 2001):
+            if id <= 500 or rng.random() < 0.5:
+                problem, language = rng.choice(problems), rng.choice(languages)
+                priority = rng.randrange(JudgeList.priorities)
+                queue.push(id, problem, language, '', priority)
+                pending.append((priority, id, problem, language))
+                pending.sort()
+            judge = rng.choice(judges)
+            expected = next((id for priority, id, problem, language in pending if judge.can_judge(problem, language)),
+                            None)
+            entry = queue.peek(judge)
+            self.assertEqual(entry and entry.id, expected)
+            if entry is not None:
+                queue.remove(entry.id, dispatched=True)
+                pending = [item for item in pending if item[1] != entry.id]
+        self.assertEqual(len(queue), len(pending))
+
+    def test_aborted_submissions_are_skipped(self):
+        judge_list = JudgeList()
+        for id in range(1, 4):
+            judge_list.judge(id, 'aplusb', 'PY3', '', 1)
+        judge_list.abort(2)
+
+        judge = FakeJudge('judge', {'aplusb'}, {'PY3'})
+        judge_list.register(judge)
+        self.assertEqual(judge.get_current_submission(), 1)
+        judge.current = None
+        judge_list.on_judge_free(judge, 1)
+        self.assertEqual(judge.get_current_submission(), 3)
+        self.assertEqual(len(judge_list.queue), 0)
+
+    def test_judge_changing_problems(self):
+        judge_list = JudgeList()
+        judge = FakeJudge('judge', {'aplusb'}, {'PY3'})
+        judge_list.register(judge)
+        judge_list.judge(1, 'aplusb', 'PY3', '', 1)
+        judge_list.judge(2, 'helloworld', 'PY3', '', 0)
+        self.assertEqual(judge.get_current_submission(), 1)
+
+        judge.current = None
+        judge_list.on_judge_free(judge, 1)
+        self.assertFalse(judge.working)
+        judge.problems = {'aplusb', 'helloworld'}
+        judge_list.update_problems(judge)
+        self.assertEqual(judge.get_current_submission(), 2)
+
+
+class SchedulingPolicyTest(SimpleTestCase):
+    def queued(self, policy, submissions):
+        queue = SubmissionQueue(JudgeList.priorities, policy)
+        for id, priority, user, contest in submissions:
+            queue.push(id, 'aplusb', 'PY3', '', priority, user, contest)
+        return [entry.id for entry in queue]
+
+    def test_strict_priority(self):
+        self.assertEqual(self.queued(StrictPriorityPolicy(), [
+            (1, 1, 'a', None), (2, 1, 'a', None), (3, 0, 'b', None), (4, 1, 'b', None), (5, 0, 'a', None),
+        ]), [3, 5, 1, 2, 4])
+
+    def test_fair_share_interleaves_users(self):
+        # User a queues a burst of submissions, then user b queues one, which does not wait for the whole burst.
+        submissions = [(id, 1, 'a', None) for id in range(1, 6)] + [(6, 1, 'b', None)]
+        self.assertEqual(self.queued(FairSharePolicy(), submissions), [1, 6, 2, 3, 4, 5])
+        self.assertEqual(self.queued(StrictPriorityPolicy(), submissions), [1, 2, 3, 4, 5, 6])
+
+    def test_fair_share_contests(self):
+        policy = FairSharePolicy(user_interval=0, contest_interval=10)
+        submissions = [(1, 1, 'a', 'x'), (2, 1, 'b', 'x'), (3, 1, 'c', 'y'), (4, 1, 'd', None)]
+        self.assertEqual(self.queued(policy, submissions), [1, 3, 4, 2])
+
+    def test_priority_aging(self):
+        policy = FairSharePolicy(priority_step=60)
+        old = policy.rank(2, 'a', None, 0, 0)
+        # Not yet waited a full step: the more urgent submission goes first.
+        self.assertLess(policy.rank(1, 'b', None, 59, 1), old)
+        # Waited longer than a step: the older, less urgent submission goes first, so it is never starved.
+        self.assertGreater(policy.rank(1, 'c', None, 61, 2), old)
+        # Two steps make up for two levels of priority.
+        self.assertGreater(policy.rank(0, 'd', None, 121, 3), old)
+
+
+class JudgeSelectorTest(SimpleTestCase):
+    def setUp(self):
+        self.fast = SimpleNamespace(name='fast', load=0.5, latency=0.01)
+        self.idle = SimpleNamespace(name='idle', load=0.0, latency=0.2)
+
+    def test_least_load(self):
+        self.assertIs(LeastLoadSelector().select([self.fast, self.idle], 'aplusb', 'PY3'), self.idle)
+
+    def test_score(self):
+        selector = ScoringSelector()
+        # Some load and little latency beats no load and 200ms of latency.
+        self.assertIs(selector.select([self.fast, self.idle], 'aplusb', 'PY3'), self.fast)
+
+        # Historically twice as slow on this language.
+        selector.speeds[('fast', 'PY3')] = 2
+        self.assertIs(selector.select([self.fast, self.idle], 'aplusb', 'PY3'), self.idle)
+        self.assertIs(selector.select([self.fast, self.idle], 'aplusb', 'CPP17'), self.fast)
+
+    def test_affinity(self):
+        selector = ScoringSelector(latency_weight=0)
+        self.idle.load = 0.4
+        self.assertIs(selector.select([self.fast, self.idle], 'aplusb', 'PY3'), self.idle)
+        selector.dispatched(self.fast, 'aplusb', 'PY3')
+        self.assertIs(selector.select([self.fast, self.idle], 'aplusb', 'PY3'), self.fast)
+        self.assertIs(selector.select([self.fast, self.idle], 'helloworld', 'PY3'), self.idle)
+
+    def test_judge_speed_factors(self):
+        timings = []
+        for case in range(30):
+            timings += [('fast', 'PY3', ('aplusb', case), 1.0), ('slow', 'PY3', ('aplusb', case), 3.0)]
+        # Too few samples to judge.
+        timings += [('fast', 'CPP17', ('aplusb', 0), 1.0), ('slow', 'CPP17', ('aplusb', 0), 3.0)]
+        speeds = judge_speed_factors(timings)
+        self.assertAlmostEqual(speeds[('fast', 'PY3')], 0.5)
+        self.assertAlmostEqual(speeds[('slow', 'PY3')], 1.5)
+        self.assertNotIn(('fast', 'CPP17'), speeds)
+
+
+class JudgeDataMixin(object):
+    """Two public problems worth 10 points and two users to submit to them."""
+
+    def setUp(self):
+        super(JudgeDataMixin, self).setUp()
+        self.language = Language.objects.first() or Language.objects.create(key='PY3', name='Python 3',
+                                                                             short_name='PY3')
+        group = ProblemGroup.objects.create(name='test', full_name='test')
+        self.problems = [Problem.objects.create(code='problem%d' % i, name='problem', description='', time_limit=1,
+                                                memory_limit=65536, points=10, group=group, is_public=True)
+                         for i in range(2)]
+        self.users = [Profile.objects.create(user=User.objects.create(username='user%d' % i), language=self.language)
+                      for i in range(2)]
+        self.start = timezone.now() - timedelta(hours=1)
+        self.submitted = 0
+
+    def submit(self, status='QU', user=0, problem=0, **fields):
+        submission = Submission.objects.create(user=self.users[user], problem=self.problems[problem],
+                                               language=self.language, status=status, **fields)
+        # The date field is auto_now_add, so it is set afterwards.
+        Submission.objects.filter(id=submission.id).update(date=self.start + timedelta(minutes=self.submitted))
+        self.submitted += 1
+        submission.refresh_from_db()
+        return submission
+
+
+class DefaultContestFormatTest(JudgeDataMixin, TestCase):
+    def test_update_participation(self):
+        contest = Contest.objects.create(key='contest', name='contest', start_time=self.start,
+                                         end_time=self.start + timedelta(hours=5),
+                                         freeze_scoreboard_after=self.start + timedelta(hours=2),
+                                         format_config={'penalty': 20})
+        problems = [ContestProblem.objects.create(contest=contest, problem=problem, points=100, partial=True, order=i)
+                    for i, problem in enumerate(self.problems)]
+        participation = ContestParticipation.objects.create(contest=contest, user=self.users[0], real_start=self.start)
+
+        for minute, problem, result, points in [
+            (10, 0, 'WA', 0), (30, 0, 'WA', 0), (30, 0, 'AC', 100), (50, 0, 'AC', 100),
+            (70, 1, 'WA', 50), (80, 1, 'TLE', 0), (90, 1, 'WA', 50), (150, 1, 'AC', 100),
+        ]:
+            submission = self.submit('D', problem=problem, result=result, points=points)
+            Submission.objects.filter(id=submission.id).update(date=self.start + timedelta(minutes=minute))
+            ContestSubmission.objects.create(submission=submission, problem=problems[problem],
+                                             participation=participation, points=points)
+        contest.format.update_participation(participation)
+        participation.refresh_from_db()
+
+        # The earliest submission with the best score counts, penalized by the wrong submissions strictly before it.
+        first, second = str(problems[0].id), str(problems[1].id)
+        self.assertEqual((participation.score, participation.cumtime), (200, (30 + 20 + 150 + 3 * 20) * 60))
+        self.assertEqual(participation.format_data, {
+            first: {'time': 30 * 60, 'points': 100, 'penalty': 1},
+            second: {'time': 150 * 60, 'points': 100, 'penalty': 3},
+        })
+        # Only what was submitted before the scoreboard froze.
+        self.assertEqual((participation.frozen_score, participation.frozen_cumtime), (150, (30 + 20 + 70) * 60))
+        self.assertEqual(participation.frozen_format_data, {
+            first: {'time': 30 * 60, 'points': 100, 'penalty': 1},
+            second: {'time': 70 * 60, 'points': 50, 'penalty': 0},
+        })
+
+class AttemptNumberTest(JudgeDataMixin, TestCase):
+    def test_attempt_no(self):
+        self.assertEqual(self.submit('D').get_attempt_no(), 1)
+        self.submit('CE')
+        self.submit('IE')
+        queued = self.submit('QU')
+        self.submit('D', user=1)
+        self.submit('D', problem=1)
+        later = self.submit('QU')
+        later.attempt_no = later.get_attempt_no()
+        later.save(update_fields=['attempt_no'])
+        self.assertEqual(later.attempt_no, 3)
+
+        # The queued submission failing to compile does not renumber the submission made after it.
+        Submission.objects.filter(id=queued.id).update(status='CE', result='CE')
+        later.refresh_from_db()
+        self.assertEqual(later.attempt_no, 3)
+        self.assertEqual(later.get_attempt_no(), 2)
+
+
+class ProblemStatsTest(JudgeDataMixin, TestCase):
+    def stats(self, problem=0):
+        self.problems[problem].refresh_from_db()
+        problem = self.problems[problem]
+        return problem.submission_count, problem.ac_count, problem.user_count, problem.ac_rate
+
+    def grade(self, submission, result, points):
+        Submission.objects.filter(id=submission.id).update(status='D', result=result, points=points)
+        submission.refresh_from_db()
+        solved = UserProblemPoints.record_submission(submission)
+        submission.problem.adjust_stats(accepted=int(result == 'AC' and points >= submission.problem.points),
+                                        users=solved)
+        return solved
+
+    def test_submissions_are_counted_when_created(self):
+        self.submit()
+        self.submit(user=1)
+        self.submit(problem=1)
+        self.assertEqual(self.stats(), (2, 0, 0, 0))
+
+    def test_solved_needs_full_points(self):
+        self.assertEqual(self.grade(self.submit(), 'WA', 5), 0)
+        self.assertEqual(self.grade(self.submit(), 'AC', 10), 1)
+        self.assertEqual(self.grade(self.submit(), 'AC', 10), 0)
+        self.assertEqual(self.stats(), (3, 2, 1, 200.0 / 3))
+
+        # Accepted before the problem was made worth more.
+        Problem.objects.filter(id=self.problems[1].id).update(points=20)
+        self.assertEqual(self.grade(self.submit(problem=1), 'AC', 10), 0)
+        best = UserProblemPoints.objects.get(user=self.users[0], problem=self.problems[1])
+        self.assertEqual((best.points, best.is_accepted), (10, False))
+        self.assertEqual(self.stats(1), (1, 0, 0, 0))
+        self.assertEqual(UserProblemPoints.objects.filter(is_accepted=True).count(),
+                         sum(problem.user_count for problem in Problem.objects.all()))
+
+    def test_rejudge_to_compile_error(self):
+        submission = self.submit()
+        self.grade(submission, 'AC', 10)
+        self.assertEqual(self.stats()[2], 1)
+
+        # judge_submission clears the result of a rejudged submission before queueing it.
+        Submission.objects.filter(id=submission.id).update(status='QU', result=None, points=None, was_rejudged=True)
+        scheduled = []
+        handler = DjangoJudgeHandler.__new__(DjangoJudgeHandler)
+        handler.server = SimpleNamespace(result_counts=ResultCountBuffer(),
+                                         recompute=SimpleNamespace(schedule=lambda key, *args: scheduled.append(key)))
+        self.assertTrue(handler._finish_submission(submission.id, status='CE', result='CE', error='error'))
+        self.assertFalse(UserProblemPoints.objects.filter(user=self.users[0]).exists())
+        self.assertEqual(self.stats()[2], 0)
+        self.assertEqual(scheduled, [('user', self.users[0].id)])
+
+
+class SubmissionResultDataTest(JudgeDataMixin, TestCase):
+    def setUp(self):
+        super(SubmissionResultDataTest, self).setUp()
+        cache.clear()
+        Problem.objects.filter(id=self.problems[1].id).update(is_public=False)
+        counts = ResultCountBuffer()
+        for problem, result in ((0, 'AC'), (0, 'WA'), (1, 'AC')):
+            submission = self.submit('D', problem=problem, result=result)
+            counts.change(submission.problem_id, submission.user_id, None, submission.language_id, None, result)
+        counts.flush()
+
+    def totals(self, **params):
+        response = self.client.get(reverse('all_submissions'), dict(params, results=''))
+        return {category['code']: category['count'] for category in response.json()['categories']}
+
+    def test_result_counts(self):
+        self.assertEqual(SubmissionResultCount.results('global'), {'AC': 2, 'WA': 1})
+        self.assertEqual(SubmissionResultCount.results('problem', self.problems[0].id), {'AC': 1, 'WA': 1})
+
+    def test_private_problems_are_not_counted(self):
+        self.assertEqual(self.totals()['AC'], 1)
+        self.assertEqual(self.totals(language=self.language.key)['AC'], 1)
+
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        Profile.objects.create(user=admin, language=self.language)
+        self.client.force_login(admin)
+        self.assertEqual(self.totals()['AC'], 2)
+        self.assertEqual(self.totals(language=self.language.key)['AC'], 2)
+
+
+def connect(server, address, timeout=5):
+    # The engine only starts listening once it is serving, and only knows the client once it has accepted it.
+    deadline = time.monotonic() + timeout
+    clients = len(server._clients)
+    while True:
+        try:
+            client = socket.create_connection(address)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+    while len(server._clients) == clients and time.monotonic() < deadline:
+        time.sleep(0.01)
+    client.settimeout(timeout)
+    return client
+
+
+class ServerShutdownTest(SimpleTestCase):
+    def test_clients_close_before_shutdown(self):
+        for name, engine in engines.items():
+            with self.subTest(engine=name):
+                events = []
+
+                class Client(Handler):
+                    def _recv_data(self, data):
+                        pass
+
+                    def on_close(self):
+                        events.append('close')
+
+                class Server(engine):
+                    def on_shutdown(self):
+                        events.append('shutdown')
+
+                server = Server([('127.0.0.1', 0)], Client)
+                address = next(iter(server._servers)).getsockname()
+                thread = threading.Thread(target=server.serve_forever, daemon=True)
+                thread.start()
+                try:
+                    client = connect(server, address)
+                finally:
+                    server.stop()
+                    thread.join(10)
+                client.close()
+                self.assertEqual(events, ['close', 'shutdown'])
+
+
+class SizedPacketHandlerTest(SimpleTestCase):
+    def setUp(self):
+        sockets = socket.socketpair()
+        for sock in sockets:
+            self.addCleanup(sock.close)
+        self.sockets = sockets
+
+    def test_split_reads(self):
+        packets = [b'a', bytes(range(256)) * 300, b'\x00' * 4, b'end']
+        stream = b''.join(size_pack.pack(len(packet)) + packet for packet in packets)
+        for size in (1, 3, 4, 5, 1000, len(stream)):
+            with self.subTest(size=size):
+                received = []
+                handler = SizedPacketHandler(None, self.sockets[0])
+                handler._packet = received.append
+                for start in range(0, len(stream), size):
+                    # Engines pass a view of their read buffer, which is reused for the next read.
+                    handler._recv_data(memoryview(bytearray(stream[start:start + size])))
+                self.assertEqual(received, packets)
+                self.assertEqual((len(handler._buffer), handler._packetlen), (0, 0))
+
+    def test_large_packet(self):
+        payload = bytes(range(256)) * 40000
+
+        class Client(SizedPacketHandler):
+            def _packet(self, data):
+                self.send(payload)
+
+        for name, engine in engines.items():
+            with self.subTest(engine=name):
+                server = engine([('127.0.0.1', 0)], Client)
+                address = next(iter(server._servers)).getsockname()
+                thread = threading.Thread(target=server.serve_forever, daemon=True)
+                thread.start()
+                try:
+                    client = connect(server, address)
+                    client.sendall(size_pack.pack(1) + b'?')
+                    # The engine writes what the socket takes at a time, so this arrives over many partial sends.
+                    data = b''
+                    while len(data) < size_pack.size + len(payload):
+                        chunk = client.recv(65536)
+                        if not chunk:
+                            break
+                        data += chunk
+                    client.close()
+                finally:
+                    server.stop()
+                    thread.join(10)
+                self.assertEqual(data, size_pack.pack(len(payload)) + payload)
+
+
+class AsyncioServerTest(SimpleTestCase):
+    def setUp(self):
+        self.received = {}
+        self.blocked = threading.Event()
+        self.release = threading.Event()
+        test = self
+
+        class Client(Handler):
+            def _recv_data(self, data):
+                test.received[self.client_address] = test.received.get(self.client_address, b'') + data
+                if data.startswith(b'!'):
+                    test.blocked.set()
+                    test.release.wait(5)
+                self._send(data)
+
+        class Server(engines['asyncio']):
+            workers = 2
+
+        self.server = Server([('127.0.0.1', 0)], Client)
+        self.address = next(iter(self.server._servers)).getsockname()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 10)
+        self.addCleanup(self.server.stop)
+        self.addCleanup(self.release.set)
+
+    def connect(self):
+        client = connect(self.server, self.address)
+        self.addCleanup(client.close)
+        return client
+
+    def test_slow_client_does_not_stall_others(self):
+        slow, other = self.connect(), self.connect()
+        slow.sendall(b'!')
+        self.assertTrue(self.blocked.wait(5))
+        slow.sendall(b'123')
+        other.sendall(b'abc')
+        self.assertEqual(other.recv(16), b'abc')
+        self.assertEqual(self.server.loop_stats()['clients'], 2)
+
+        # The slow client's packets are handled in the order they arrived, once the first one is done.
+        self.release.set()
+        echoed = b''
+        while len(echoed) < 4:
+            echoed += slow.recv(16)
+        self.assertEqual(echoed, b'!123')
+        self.assertEqual(self.received[slow.getsockname()], b'!123')
+
+    def test_scheduled_jobs(self):
+        ran = threading.Event()
+        cancelled = []
+        self.server.schedule(0, ran.set)
+        job = self.server.schedule(0.1, cancelled.append, True)
+        self.assertTrue(self.server.unschedule(job))
+        self.assertTrue(ran.wait(5))
+        time.sleep(0.3)
+        self.assertEqual(cancelled, [])
+
+
+class AsyncEventPosterTest(SimpleTestCase):
+    def setUp(self):
+        self.sent = []
+        self.failures = []
+        patcher = mock.patch('judge.event_poster_ws.EventPoster',
+                             return_value=SimpleNamespace(post_batch=self.post_batch))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post_batch(self, messages):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.sent.extend(message for channel, message in messages)
+
+    def test_merge_by_key(self):
+        poster = AsyncEventPoster(retry_delay=0)
+        with poster._cond:
+            for i in range(3):
+                poster.post('submissions', i, key='submission')
+            poster.post('submissions', 3)
+        self.assertTrue(poster.flush(5))
+        self.assertEqual(self.sent, [2, 3])
+        self.assertEqual(poster.stats['merged'], 2)
+
+    def test_connection_errors_are_retried(self):
+        self.failures = [WebSocketException(), ConnectionRefusedError()]
+        poster = AsyncEventPoster(retry_delay=0)
+        poster.post('submissions', 0)
+        self.assertTrue(poster.flush(5))
+        self.assertEqual(self.sent, [0])
+        self.assertEqual(poster.stats['failed'], 2)
+
+    def test_rejected_batches_are_dropped(self):
+        self.failures = [EventPostingError('bad-message')]
+        poster = AsyncEventPoster(batch_size=1, retry_delay=0)
+        with poster._cond:
+            poster.post('submissions', 0)
+            poster.post('submissions', 1)
+        self.assertTrue(poster.flush(5))
+        self.assertEqual(self.sent, [1])
+        self.assertEqual(poster.stats['rejected'], 1)
+
+
+class DjangoHandlerTest(SimpleTestCase):
+    def setUp(self):
+        self.disconnected = []
+        server = SimpleNamespace(judges=SimpleNamespace(disconnect=lambda name, force: self.disconnected.append(name)))
+        sockets = socket.socketpair()
+        for sock in sockets:
+            self.addCleanup(sock.close)
+        self.handler = DjangoHandler(server, sockets[0])
+        self.sent = []
+        self.handler.send = lambda data, callback=None: self.sent.append(data)
+
+    def test_every_reply_has_a_name(self):
+        self.handler.packet(json.dumps({'name': 'disconnect-judge', 'judge-id': 'judge', 'force': False,
+                                        'request-id': 1}))
+        self.handler.packet(json.dumps({'name': 'unknown', 'request-id': 2}))
+        self.handler.packet(json.dumps({'request-id': 3}))
+        self.assertEqual(self.disconnected, ['judge'])
+        self.assertEqual(self.sent, [{'name': 'judge-disconnected', 'request-id': 1},
+                                     {'name': 'bad-request', 'request-id': 2},
+                                     {'name': 'bad-request', 'request-id': 3}])
+
+    def test_submission_batch(self):
+        judged = []
+        self.handler.server.judges = SimpleNamespace(check_priority=lambda priority: priority < 4, journal=None,
+                                                     judge=lambda id, *args: judged.append(id))
+        self.handler.packet(json.dumps({'name': 'submission-request', 'request-id': 1, 'submissions': [
+            {'submission-id': id, 'problem-id': 'problem', 'language': 'PY3', 'source': '', 'priority': priority}
+            for id, priority in ((1, 3), (2, 5), (3, 0))
+        ]}))
+        self.assertEqual(judged, [1, 3])
+        self.assertEqual(self.sent, [{'name': 'submission-received', 'submission-ids': [1, 3], 'rejected-ids': [2],
+                                      'request-id': 1}])
+
+
+class JudgeSubmissionTest(JudgeDataMixin, TestCase):
+    def test_unexpected_reply(self):
+        submission = self.submit()
+        SubmissionSource.objects.create(submission=submission, source='print(1)')
+        for response in ({'name': 'bad-request'}, {}):
+            with mock.patch('judge.judgeapi.judge_request', return_value=response):
+                self.assertTrue(judge_submission(submission, False))
+            self.assertEqual(Submission.objects.get(id=submission.id).status, 'IE')
+
+    def test_batch(self):
+        accepted = self.submit('D', result='AC', points=10)
+        wrong = self.submit('D', result='WA', points=0, problem=1)
+        grading = self.submit('G')
+        rejected = self.submit('D', result='AC', points=10, user=1)
+        for submission in (accepted, wrong, grading, rejected):
+            SubmissionSource.objects.create(submission=submission, source='source %d' % submission.id)
+            SubmissionTestCase.objects.create(submission=submission, case=1, status='AC', points=1, total=1)
+        Problem.objects.filter(id=self.problems[0].id).update(ac_count=2)
+
+        requests = []
+
+        def judge_request(packet):
+            requests.append(packet)
+            return {'name': 'submission-received', 'submission-ids': [accepted.id, wrong.id]}
+
+        with mock.patch('judge.judgeapi.judge_request', side_effect=judge_request):
+            queued = judge_submissions([accepted.id, wrong.id, grading.id, rejected.id], True, batch_rejudge=True)
+        self.assertEqual(queued, [accepted.id, wrong.id])
+
+        # One bridge request for the whole chunk, without the submission that is still being graded.
+        self.assertEqual(len(requests), 1)
+        self.assertEqual([(request['submission-id'], request['source'], request['priority'])
+                          for request in requests[0]['submissions']],
+                         [(submission.id, 'source %d' % submission.id, BATCH_REJUDGE_PRIORITY)
+                          for submission in (accepted, wrong, rejected)])
+
+        self.assertEqual(dict(Submission.objects.values_list('id', 'status')),
+                         {accepted.id: 'QU', wrong.id: 'QU', grading.id: 'G', rejected.id: 'IE'})
+        self.assertFalse(Submission.objects.exclude(id=grading.id).filter(result__isnull=False).exists())
+        self.assertEqual(list(SubmissionTestCase.objects.values_list('submission_id', flat=True)), [grading.id])
+        self.assertTrue(Submission.objects.get(id=accepted.id).was_rejudged)
+        # Both accepted submissions stop counting towards the problem until they are graded again.
+        self.assertEqual(Problem.objects.get(id=self.problems[0].id).ac_count, 0)
+
+
+class JudgeProblemsTest(JudgeDataMixin, TestCase):
+    def test_problems_created_after_connecting(self):
+        handler = DjangoJudgeHandler.__new__(DjangoJudgeHandler)
+        handler.judge = Judge.objects.create(name='judge', auth_key='key')
+        handler._problem_ids = {}
+        handler.problems = {'problem0': 0, 'later': 0}
+        self.assertTrue(handler._update_problems())
+        self.assertEqual(set(handler.judge.problems.values_list('code', flat=True)), {'problem0'})
+
+        Problem.objects.create(code='later', name='later', description='', time_limit=1, memory_limit=65536,
+                               points=10, group=self.problems[0].group)
+        handler.problems = {'problem0': 0, 'problem1': 0, 'later': 0}
+        self.assertTrue(handler._update_problems())
+        self.assertEqual(set(handler.judge.problems.values_list('code', flat=True)), {'problem0', 'problem1', 'later'})
+
+        handler.problems = {'problem1': 0, 'missing': 0}
+        self.assertTrue(handler._update_problems())
+        self.assertFalse(handler._update_problems())
+        self.assertEqual(set(handler.judge.problems.values_list('code', flat=True)), {'problem1'})
+
+
+class ScoreboardTest(JudgeDataMixin, TestCase):
+    def setUp(self):
+        super(ScoreboardTest, self).setUp()
+        cache.clear()
+        self.contest = Contest.objects.create(key='contest', name='contest', start_time=self.start,
+                                              end_time=self.start + timedelta(days=1))
+        ContestProblem.objects.create(contest=self.contest, problem=self.problems[0], points=10, order=0)
+        self.participations = [ContestParticipation.objects.create(contest=self.contest, user=user, score=score)
+                               for user, score in zip(self.users, (5, 10))]
+
+    def scoreboard(self):
+        # The contest and the profiles, with nothing else left to render.
+        with self.assertNumQueries(2):
+            contest = Contest.objects.get(id=self.contest.id)
+            return [(row.username, row.points) for row in get_contest_scoreboard(contest, [], False)]
+
+    def test_user_fields_are_not_cached(self):
+        # Built once, then served from the cache.
+        get_contest_scoreboard(self.contest, [], False)
+        self.assertEqual(self.scoreboard(), [('user1', 10), ('user0', 5)])
+
+        User.objects.filter(id=self.users[1].user_id).update(username='renamed')
+        self.assertEqual(self.scoreboard(), [('renamed', 10), ('user0', 5)])
+        Profile.objects.filter(id=self.users[0].id).update(is_unlisted=True)
+        self.assertEqual(self.scoreboard(), [('renamed', 10)])
+
+    def test_updates(self):
+        get_contest_scoreboard(self.contest, [], False)
+        # Without submissions, the participation's results are recomputed to nothing.
+        self.participations[0].recompute_results()
+        self.assertEqual(self.scoreboard(), [('user1', 10), ('user0', 0)])
+
+        user = Profile.objects.create(user=User.objects.create(username='late'), language=self.language)
+        ContestParticipation.objects.create(contest=self.contest, user=user, score=1)
+        self.assertEqual(len(self.scoreboard()), 2)
+        post_contest_update(self.contest.id)
+        get_contest_scoreboard(self.contest, [], False)
+        self.assertEqual(self.scoreboard(), [('user1', 10), ('late', 1), ('user0', 0)])
+
+
+class JudgeStatusTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(3):
+            Judge.objects.create(name='judge%d' % i, auth_key='key', online=True)
+
+    def status(self):
+        # Only what the bridge published to the cache, not what it wrote to the database.
+        Judge.objects.update(ping=1, load=1)
+        return [(judge.ping, judge.load) for judge in with_live_status(Judge.objects.order_by('name'))]
+
+    def test_live_status(self):
+        buffer = JudgeStatusBuffer()
+        buffer.update('judge0', 0.5, 0.25)
+        buffer.flush()
+        self.assertEqual(self.status(), [(0.5, 0.25), (1, 1), (1, 1)])
+
+    @override_settings(BRIDGED_SHARDS=[{}, {}])
+    def test_sharded_live_status(self):
+        for shard in range(2):
+            buffer = JudgeStatusBuffer(cache_key=JudgeStatusBuffer.shard_cache_key(shard))
+            buffer.update('judge%d' % shard, shard + 2, shard + 2)
+            buffer.flush()
+        self.assertEqual(self.status(), [(2, 2), (3, 3), (1, 1)])
+
+
+class SubmissionWriteBufferTest(JudgeDataMixin, TestCase):
+    def case(self, submission, case, **fields):
+        return SubmissionTestCase(submission_id=submission.id, case=case, status='AC', **fields)
+
+    def test_flush(self):
+        first, second = self.submit('G'), self.submit('G')
+        buffer = SubmissionWriteBuffer(100)
+        buffer.add_test_cases(first.id, [self.case(first, 1), self.case(first, 2)])
+        buffer.update(first.id, current_testcase=2, time=0.5)
+        buffer.update(first.id, current_testcase=3)
+        buffer.add_test_cases(second.id, [self.case(second, 1)])
+        buffer.update(second.id, current_testcase=2)
+        self.assertEqual(len(buffer), 3)
+        self.assertFalse(SubmissionTestCase.objects.exists())
+
+        with self.assertNumQueries(6):
+            buffer.flush()
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(SubmissionTestCase.objects.filter(submission=first).count(), 2)
+        self.assertEqual(SubmissionTestCase.objects.filter(submission=second).count(), 1)
+        first.refresh_from_db()
+        self.assertEqual((first.current_testcase, first.time), (3, 0.5))
+        self.assertEqual(Submission.objects.get(id=second.id).current_testcase, 2)
+        self.assertEqual(buffer.stats()['rows_written'], 3)
+        self.assertEqual(buffer.stats()['updates_written'], 2)
+
+    def test_flush_when_full(self):
+        submission = self.submit('G')
+        buffer = SubmissionWriteBuffer(2)
+        buffer.add_test_cases(submission.id, [self.case(submission, 1)])
+        self.assertFalse(SubmissionTestCase.objects.exists())
+        buffer.add_test_cases(submission.id, [self.case(submission, 2)])
+        self.assertEqual(SubmissionTestCase.objects.count(), 2)
+
+    def test_discard(self):
+        submission = self.submit('G')
+        buffer = SubmissionWriteBuffer(100)
+        buffer.add_test_cases(submission.id, [self.case(submission, 1)])
+        buffer.update(submission.id, current_testcase=2)
+        buffer.discard(submission.id)
+        buffer.flush()
+        self.assertFalse(SubmissionTestCase.objects.exists())
+        self.assertEqual(Submission.objects.get(id=submission.id).current_testcase, 0)
+
+    def test_failing_rows_are_dropped(self):
+        good, bad = self.submit('G'), self.submit('G')
+        buffer = SubmissionWriteBuffer(100)
+        buffer.add_test_cases(good.id, [self.case(good, 1)])
+        buffer.update(good.id, current_testcase=2)
+        # The case number is required, so every batch with this row fails.
+        buffer.add_test_cases(bad.id, [self.case(bad, None)])
+        buffer.update(bad.id, current_testcase=2)
+
+        for attempt in range(SubmissionWriteBuffer.max_failures - 1):
+            with self.assertLogs('judge.bridge', 'ERROR'):
+                buffer.flush()
+            self.assertEqual(len(buffer), 2)
+            self.assertFalse(SubmissionTestCase.objects.exists())
+        with self.assertLogs('judge.bridge', 'ERROR') as logs:
+            buffer.flush()
+        self.assertIn('Dropping 1 buffered test cases', logs.output[-1])
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(list(SubmissionTestCase.objects.values_list('submission_id', flat=True)), [good.id])
+        self.assertEqual(Submission.objects.get(id=good.id).current_testcase, 2)
+        self.assertEqual(Submission.objects.get(id=bad.id).current_testcase, 0)
+
+
+class GradingResultTest(JudgeDataMixin, TestCase):
+    def cases(self, submission):
+        fields = [
+            # case, status, time, memory, points, total, batch
+            (1, 'AC', 0.5, 1024, 2, 2, None),
+            (2, 'AC', 0.25, 2048, 3, 3, 1),
+            (3, 'WA', 0.25, 512, 0, 3, 1),
+            (4, 'TLE', 1, 256, 0, 5, 2),
+            (5, 'AC', 0.5, 4096, 1, 2, None),
+            (6, 'WA', 0.5, 128, 0, 1, None),
+        ]
+        return [SubmissionTestCase(submission=submission, case=case, status=status, time=time, memory=memory,
+                                   points=points, total=total, batch=batch)
+                for case, status, time, memory, points, total, batch in fields]
+
+    def test_aggregate(self):
+        result = GradingResult()
+        for case in self.cases(self.submit('G')):
+            result.add(case)
+        self.assertEqual((result.time, result.memory, result.result), (3, 4096, 'TLE'))
+        # Each batch scores its worst case: 0 of 3 for the first and 0 of 5 for the second.
+        self.assertEqual(result.case_points(), (3, 13))
+
+    def test_same_as_stored_test_cases(self):
+        # A bridge restarted mid-grading aggregates the stored test cases instead, and must come to the same result.
+        submission = self.submit('G')
+        cases = self.cases(submission)
+        SubmissionTestCase.objects.bulk_create(cases)
+        incremental = GradingResult()
+        for case in cases:
+            incremental.add(case)
+        stored = GradingResult.from_test_cases(SubmissionTestCase.objects.filter(submission=submission))
+        self.assertEqual((stored.time, stored.memory, stored.result, stored.case_points()),
+                         (incremental.time, incremental.memory, incremental.result, incremental.case_points()))
+
+
+class RecomputeQueueTest(SimpleTestCase):
+    def test_coalesce_burst(self):
+        runs = []
+        queue = RecomputeQueue(delay=60)
+        for i in range(5):
+            queue.schedule(('user', 1), runs.append, i)
+        queue.schedule(('user', 2), runs.append, 'other')
+        self.assertEqual(runs, [])
+        # Stopping runs what is pending without waiting out the delay.
+        queue.stop(timeout=5)
+        self.assertEqual(sorted(runs, key=str), [0, 'other'])
+        stats = queue.stats()
+        self.assertEqual((stats['scheduled'], stats['coalesced'], stats['executed'], stats['pending']), (6, 4, 2, 0))
+
+    def test_key_never_runs_concurrently(self):
+        started = threading.Event()
+        release = threading.Event()
+        active = []
+        overlaps = []
+
+        def recompute():
+            if active:
+                overlaps.append(True)
+            active.append(True)
+            started.set()
+            release.wait(5)
+            active.pop()
+
+        queue = RecomputeQueue(delay=0, workers=2)
+        queue.schedule(('user', 1), recompute)
+        self.assertTrue(started.wait(5))
+        # A change arriving while the key runs queues exactly one more run, after the current one.
+        queue.schedule(('user', 1), recompute)
+        queue.schedule(('user', 1), recompute)
+        time.sleep(0.1)
+        self.assertEqual(queue.stats()['running'], 1)
+        release.set()
+        queue.stop(timeout=5)
+        self.assertEqual(overlaps, [])
+        self.assertEqual(queue.stats()['executed'], 2)
+
+    def test_failure(self):
+        def fail():
+            raise ValueError
+
+        queue = RecomputeQueue(delay=0)
+        with self.assertLogs('judge.bridge', 'ERROR'):
+            queue.schedule(('user', 1), fail)
+            queue.stop(timeout=5)
+        self.assertEqual((queue.stats()['executed'], queue.stats()['failed']), (1, 1))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RateAllContestsLockTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('judge.tasks.contest._rate_all_contests', return_value=3)
+        self.rate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_task(self, task_id):
+        rate_all_contests.push_request(id=task_id)
+        try:
+            return rate_all_contests.run()
+        finally:
+            rate_all_contests.pop_request()
+
+    def test_runs_and_releases(self):
+        self.assertEqual(self.run_task('a'), 3)
+        self.assertIsNone(cache.get(RATE_ALL_LOCK))
+
+    def test_lock_taken_by_caller(self):
+        cache.set(RATE_ALL_LOCK, 'a')
+        self.assertEqual(self.run_task('a'), 3)
+        self.assertIsNone(cache.get(RATE_ALL_LOCK))
+
+    def test_another_running(self):
+        cache.set(RATE_ALL_LOCK, 'a')
+        self.assertIsNone(self.run_task('b'))
+        self.rate.assert_not_called()
+        self.assertEqual(cache.get(RATE_ALL_LOCK), 'a')
+
+    def test_released_on_failure(self):
+        self.rate.side_effect = ValueError
+        with self.assertRaises(ValueError):
+            self.run_task('a')
+        self.assertIsNone(cache.get(RATE_ALL_LOCK))
+
+
+class BridgeMetricsTest(TestCase):
+    def setUp(self):
+        def broken():
+            raise ValueError
+
+        judges = JudgeList()
+        self.server = SimpleNamespace(judges=judges, writes=SubmissionWriteBuffer(10),
+                                      recompute=SimpleNamespace(stats=broken))
+        self.metrics = BridgeMetrics(self.server)
+        judges.queue.wait_observer = self.metrics.queue_wait.observe
+        judges.register(FakeJudge('judge "a"', {'problem'}, {'PY3'}))
+        judges.register(FakeJudge('idle', set(), set()))
+        judges.judge(1, 'problem', 'PY3', '', 1)
+        judges.judge(2, 'problem', 'PY3', '', 2)
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'Test.', ('packet',), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value, 'grading-end')
+        self.assertEqual(list(histogram.render()), [
+            'test_seconds_bucket{packet="grading-end",le="0.1"} 2',
+            'test_seconds_bucket{packet="grading-end",le="1"} 3',
+            'test_seconds_bucket{packet="grading-end",le="+Inf"} 4',
+            'test_seconds_sum{packet="grading-end"} 5.65',
+            'test_seconds_count{packet="grading-end"} 4',
+        ])
+
+    def test_render(self):
+        with self.metrics.time_packet('grading-end'):
+            Judge.objects.count()
+        with self.assertLogs('judge.bridge', 'ERROR'):
+            lines = self.metrics.render().splitlines()
+        self.assertIn('# TYPE bridge_queue_depth gauge', lines)
+        self.assertIn('bridge_queue_depth{priority="2"} 1', lines)
+        self.assertIn('bridge_judge_working{judge="judge \\"a\\""} 1', lines)
+        self.assertIn('bridge_judge_working{judge="idle"} 0', lines)
+        self.assertIn('bridge_write_buffer{stat="pending"} 0', lines)
+        self.assertIn('bridge_queue_wait_seconds_count{priority="1"} 1', lines)
+        self.assertIn('bridge_callback_seconds_count{packet="grading-end"} 1', lines)
+        self.assertIn('bridge_callback_db_seconds_count{packet="grading-end"} 1', lines)
+        # A metric that fails to collect is left out, rather than failing the whole scrape.
+        self.assertFalse([line for line in lines if 'bridge_recompute_queue' in line])
+
+    def test_serve(self):
+        server = serve_metrics(self.metrics, ('127.0.0.1', 0))
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        with self.assertLogs('judge.bridge', 'ERROR'), \
+                urlopen('http://127.0.0.1:%d/metrics' % server.server_address[1], timeout=5) as response:
+            self.assertEqual(response.headers['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+            self.assertIn(b'bridge_queue_depth{priority="2"} 1', response.read())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ShardStealTest(TestCase):
+    shards = [{'django_address': [('127.0.0.1', 9998)]}, {'django_address': [('127.0.0.1', 9988)]}]
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.journal_path = os.path.join(directory, 'queue.journal')
+        journal = QueueJournal(self.journal_path)
+        self.addCleanup(journal.close)
+
+        # The other shard has no judges and a backlog, which this shard's idle judge can take some of.
+        self.victim = JudgeList(journal=journal)
+        for id, problem, priority in ((1, 'problem', 1), (2, 'other', 1), (3, 'problem', 2)):
+            self.victim.judge(id, problem, 'PY3', 'source %d' % id, priority)
+        victim_server = SimpleNamespace(judges=self.victim)
+        ShardCoordinator(victim_server, 1, self.shards).publish()
+
+        sockets = socket.socketpair()
+        for sock in sockets:
+            self.addCleanup(sock.close)
+        handler = DjangoHandler(victim_server, sockets[0])
+        self.fail_confirm = False
+
+        def request(packet):
+            if packet['name'] == 'steal-confirm' and self.fail_confirm:
+                raise BridgeError('timed out')
+            return json.loads(json.dumps(handler.handlers[packet['name']](json.loads(json.dumps(packet)))))
+
+        self.judge = FakeJudge('judge', {'problem'}, {'PY3'})
+        self.thief = JudgeList()
+        self.thief.register(self.judge)
+        self.coordinator = ShardCoordinator(SimpleNamespace(judges=self.thief), 0, self.shards)
+        self.coordinator.peers[1] = SimpleNamespace(request=request)
+
+    def journaled(self):
+        self.victim.journal.sync()
+        journal = QueueJournal(self.journal_path)
+        try:
+            return [submission[0] for submission in journal.replay()]
+        finally:
+            journal.close()
+
+    def test_steal(self):
+        self.coordinator.steal()
+        # One idle judge takes one submission, the best ranked one it can judge.
+        self.assertEqual(self.judge.current, 1)
+        self.assertEqual([entry.id for entry in self.victim.queue], [2, 3])
+        self.assertEqual((self.victim.handed_off, self.journaled()), ({}, [2, 3]))
+
+    def test_unconfirmed_steal_is_requeued(self):
+        self.fail_confirm = True
+        with self.assertLogs('judge.bridge', 'ERROR'):
+            self.coordinator.steal()
+        self.assertEqual(self.judge.current, 1)
+        self.assertEqual(list(self.victim.handed_off), [1])
+        self.assertEqual(self.journaled(), [1, 2, 3])
+
+        self.assertEqual(self.victim.reclaim_handoffs(60), 0)
+        self.assertEqual(self.victim.reclaim_handoffs(0), 1)
+        self.assertEqual(self.victim.handed_off, {})
+        self.assertEqual(sorted(entry.id for entry in self.victim.queue), [1, 2, 3])
+
+    def test_nothing_to_steal(self):
+        # What is left is for a problem the idle judge does not have.
+        self.victim.abort(1)
+        self.victim.abort(3)
+        self.coordinator.steal()
+        self.assertIsNone(self.judge.current)
+        self.assertEqual([entry.id for entry in self.victim.queue], [2])
+        self.assertEqual(self.journaled(), [2])
+
+
+class SimulatedJudgeTest(SimpleTestCase):
+    def setUp(self):
+        listener = socket.socket()
+        self.addCleanup(listener.close)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        listener.settimeout(5)
+        self.requested = []
+        self.ended = threading.Event()
+        self.judge = SimulatedJudge(listener.getsockname(), 'judge', 'key', ['aplusb'], ['PY3'], cases=3,
+                                    case_time=0, fail_rate=1, on_request=self.requested.append,
+                                    on_end=lambda id: self.ended.set())
+        self.addCleanup(self.judge.close)
+        # The bridge answers the handshake once the judge has connected.
+        self.bridge = None
+        thread = threading.Thread(target=self.accept, args=(listener,))
+        thread.start()
+        self.judge.connect()
+        thread.join()
+        self.addCleanup(self.bridge.close)
+
+    def accept(self, listener):
+        self.bridge, address = listener.accept()
+        self.bridge.settimeout(5)
+        self.handshake = self.read()
+        self.send({'name': 'handshake-success'})
+
+    def read(self):
+        size, = size_pack.unpack(self.bridge.recv(size_pack.size, socket.MSG_WAITALL))
+        return json.loads(zlib.decompress(self.bridge.recv(size, socket.MSG_WAITALL)).decode('utf-8'))
+
+    def send(self, packet):
+        data = zlib.compress(json.dumps(packet).encode('utf-8'))
+        self.bridge.sendall(size_pack.pack(len(data)) + data)
+
+    def test_handshake(self):
+        self.assertEqual(self.handshake['name'], 'handshake')
+        self.assertEqual((self.handshake['id'], self.handshake['key']), ('judge', 'key'))
+        self.assertEqual(self.handshake['problems'], [['aplusb', 0]])
+        self.assertEqual(list(self.handshake['executors']), ['PY3'])
+
+    def test_grading(self):
+        self.send({'name': 'submission-request', 'submission-id': 5, 'problem-id': 'aplusb', 'language': 'PY3',
+                   'source': '', 'time-limit': 1, 'memory-limit': 65536, 'short-circuit': False, 'meta': {}})
+        self.send({'name': 'ping', 'when': 1})
+        packets = [self.read() for _ in range(7)]
+        self.assertIn({'name': 'ping-response', 'when': 1, 'time': mock.ANY, 'load': 0}, packets)
+        packets = [packet for packet in packets if packet['name'] != 'ping-response']
+        self.assertEqual([packet['name'] for packet in packets],
+                         ['submission-acknowledged', 'grading-begin'] + ['test-case-status'] * 3 + ['grading-end'])
+        self.assertEqual({packet['submission-id'] for packet in packets}, {5})
+        self.assertEqual([(case['position'], case['status'], case['points'])
+                          for packet in packets[2:5] for case in packet['cases']], [(1, 1, 0), (2, 1, 0), (3, 1, 0)])
+        self.assertTrue(self.ended.wait(5))
+        self.assertEqual((self.requested, self.judge.graded), ([5], 1))
+
+    def test_abort(self):
+        self.judge.case_time = 0.2
+        self.send({'name': 'submission-request', 'submission-id': 5, 'problem-id': 'aplusb', 'language': 'PY3',
+                   'source': ''})
+        self.assertEqual(self.read()['name'], 'submission-acknowledged')
+        self.send({'name': 'terminate-submission', 'submission-id': 5})
+        names = []
+        while not names or names[-1] not in ('submission-terminated', 'grading-end'):
+            names.append(self.read()['name'])
+        self.assertEqual(names[-1], 'submission-terminated')
+        self.assertEqual(self.judge.graded, 0)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RateAllContestsResumeTest(JudgeDataMixin, TestCase):
+    def setUp(self):
+        super(RateAllContestsResumeTest, self).setUp()
+        cache.clear()
+        self.contests = []
+        for i in range(3):
+            contest = Contest.objects.create(key='contest%d' % i, name='contest', start_time=self.start, is_rated=True,
+                                             end_time=self.start + timedelta(hours=i + 1))
+            ContestParticipation.objects.create(contest=contest, user=self.users[0])
+            self.contests.append(contest)
+        self.calls = []
+        self.fail = None
+        patcher = mock.patch('judge.tasks.contest.rate_contest', side_effect=self.rate_contest)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def rate_contest(self, contest, ratings):
+        self.calls.append((contest.id, dict(ratings)))
+        if contest.id == self.fail:
+            raise ValueError
+        user = self.users[0].id
+        rating, times = 1500 + len(self.calls), ratings.get(user, (0, 0, 0))[2] + 1
+        Rating.objects.create(user_id=user, contest=contest, participation=contest.users.get(), rank=1, rating=rating,
+                              volatility=300, last_rated=contest.end_time)
+        return {user: (rating, 300, times)}
+
+    def test_resume(self):
+        task = SimpleNamespace(update_state=lambda **kwargs: None)
+        self.fail = self.contests[1].id
+        with self.assertRaises(ValueError):
+            _rate_all_contests(task)
+        self.assertEqual(cache.get(RATE_ALL_CHECKPOINT), self.contests[0].id)
+
+        # Continues after the last contest rated, from the ratings it stored rather than from scratch.
+        self.fail = None
+        del self.calls[:]
+        self.assertEqual(_rate_all_contests(task), 3)
+        user = self.users[0].id
+        self.assertEqual(self.calls, [(self.contests[1].id, {user: (1501, 300, 1)}),
+                                      (self.contests[2].id, {user: (1501, 300, 2)})])
+        self.assertIsNone(cache.get(RATE_ALL_CHECKPOINT))
+        self.assertEqual(Rating.objects.count(), 3)
+
+class RatingsTest(SimpleTestCase):
+    def random_contest(self, rng, N):
+        # Returning users with a spread of ratings, some new users, and ties in the standings.
+        old_rating, old_volatility, times_rated = [], [], []
+        for _ in range(N):
+            new = rng.random() < 0.2
+            old_rating.append(1200 if new else int(rng.gauss(1500, 400)))
+            old_volatility.append(535 if new else rng.randint(80, 535))
+            times_rated.append(0 if new else rng.randint(1, 60))
+        scores = sorted((rng.randrange(max(2, N // 3)) for _ in range(N)), reverse=True)
+        # Tied users share the average of the places they span.
+        actual_rank = [scores.index(score) + 1 + (scores.count(score) - 1) / 2.0 for score in scores]
+        return old_rating, old_volatility, actual_rank, times_rated
+
+    def test_new_users(self):
+        new_rating, new_volatility = recalculate_ratings([1200] * 3, [535] * 3, [1, 2, 3], [0] * 3)
+        self.assertGreater(new_rating[0], 1200)
+        self.assertAlmostEqual(new_rating[1], 1200)
+        self.assertAlmostEqual(new_rating[0] - 1200, 1200 - new_rating[2])
+        self.assertEqual(new_volatility, [385] * 3)
+
+        new_rating, new_volatility = recalculate_ratings([1200] * 3, [535] * 3, [1.5, 1.5, 3], [0] * 3)
+        self.assertEqual(new_rating[0], new_rating[1])
+        self.assertGreater(new_rating[1], 1200)
+
+    def test_erf(self):
+        rng = random.Random(0)
+        # Around the boundaries between Cody's approximations, and spread over the range that matters.
+        values = [0.0, -0.0, 0.46875, -0.46875, 4.0, -4.0, 6.5, -30.0, 1e-300]
+        values += [rng.uniform(-6, 6) for _ in range(10000)] + [rng.gauss(0, 1) for _ in range(10000)]
+        actual = erf(np.array(values))
+        for x, y in zip(values, actual):
+            self.assertAlmostEqual(y, math.erf(x), delta=4 * np.spacing(abs(math.erf(x))), msg='erf(%r)' % x)
+
+    def test_expected_ranks(self):
+        rng = random.Random(0)
+        for _ in range(20):
+            old_rating, old_volatility, actual_rank, times_rated = self.random_contest(rng, rng.randint(1, 100))
+            # A small block size spreads the rows over many blocks.
+            actual = expected_ranks(old_rating, old_volatility, block_size=rng.choice([1, 64, 2 ** 20]))
+            for i, rank in enumerate(actual):
+                expected = 0.5
+                for j in range(len(old_rating)):
+                    expected += WP(old_rating[i], old_rating[j], old_volatility[i], old_volatility[j])
+                self.assertAlmostEqual(rank, expected, delta=1e-9 * len(old_rating))
+
+    def test_recalculate_ratings(self):
+        rng = random.Random(0)
+        for _ in range(50):
+            contest = self.random_contest(rng, rng.randint(1, 200))
+            self.assertEqual(recalculate_ratings(*contest), legacy_recalculate_ratings(*contest))
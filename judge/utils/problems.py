@@ -7,9 +7,10 @@ from django.db.models.fields import FloatField
 from django.utils import timezone
 from django.utils.translation import gettext as _, gettext_noop
 
-from judge.models import ContestSubmission, Language, Problem, Submission
+from judge.models import ContestSubmission, Language, Problem, Submission, SubmissionResultCount
 
-__all__ = ['contest_completed_ids', 'get_result_data', 'user_completed_ids', 'user_authored_ids', 'user_editable_ids']
+__all__ = ['contest_completed_ids', 'get_result_data', 'get_scope_result_data', 'user_completed_ids',
+           'user_authored_ids', 'user_editable_ids']
 
 
 def user_authored_ids(profile):
@@ -57,8 +58,15 @@ def get_result_data(*args, **kwargs):
     else:
         submissions = Submission.objects.filter(**kwargs) if kwargs is not None else Submission.objects
     raw = submissions.values('result').annotate(count=Count('result')).values_list('result', 'count')
-    results = defaultdict(int, raw)
+    return _result_data(defaultdict(int, raw))
 
+
+def get_scope_result_data(scope, key=0, results=None):
+    """Like get_result_data, for the submissions of a SubmissionResultCount scope, from the stored counts."""
+    return _result_data(defaultdict(int, SubmissionResultCount.results(scope, key, results)))
+
+
+def _result_data(results):
     return {
         'categories': [
             # Using gettext_noop here since this will be tacked into the cache, so it must be language neutral.
@@ -29,6 +29,7 @@ from judge import event_poster as event
 from judge.comments import CommentedDetailView
 from judge.forms import ContestCloneForm, ContestShareMessageForm
 from judge.models import Contest, ContestParticipation, ContestProblem, ContestTag, Problem, ProblemClarification, Profile, Ticket
+from judge.scoreboard import get_contest_scoreboard, make_contest_ranking_profile, post_contest_update
 from judge.utils.opengraph import generate_opengraph
 from judge.utils.ranker import ranker
 from judge.utils.views import DiggPaginatorMixin, SingleObjectFormView, TitleMixin, generic_message
@@ -366,6 +367,8 @@ class ContestJoin(LoginRequiredMixin, ContestMixin, BaseDetailView):
                     contest=contest, user=profile, virtual=(-1 if self.is_organizer else 0),
                     real_start=timezone.now(),
                 )
+                if participation.live:
+                    post_contest_update(contest.id)
             else:
                 if participation.ended:
                     participation = ContestParticipation.objects.get_or_create(
@@ -508,33 +511,9 @@ class CachedContestCalendar(ContestCalendar):
         return response
 
 
-ContestRankingProfile = namedtuple(
-    'ContestRankingProfile',
-    'id user css_class username points cumtime participation '
-    'participation_rating problem_cells result_cell',
-)
-
 BestSolutionData = namedtuple('BestSolutionData', 'code points time state is_pretested')
 
 
-def make_contest_ranking_profile(contest, participation, contest_problems, is_scoreboard_frozen):
-    user = participation.user
-
-    return ContestRankingProfile(
-        id=user.id,
-        user=user.user,
-        css_class=user.css_class,
-        username=user.username,
-        points=participation.frozen_score if is_scoreboard_frozen else participation.score,
-        cumtime=participation.frozen_cumtime if is_scoreboard_frozen else participation.cumtime,
-        participation_rating=participation.rating.rating if hasattr(participation, 'rating') else None,
-        problem_cells=[contest.format.display_user_problem(participation, contest_problem, is_scoreboard_frozen)
-                    for contest_problem in contest_problems],
-        result_cell=contest.format.display_participation_result(participation, is_scoreboard_frozen),
-        participation=participation,
-    )
-
-
 def base_contest_ranking_list(contest, problems, queryset, is_scoreboard_frozen, is_show_full_scoreboard):
     participations = queryset.select_related('user__user', 'rating').defer('user__about')
 
@@ -547,17 +526,8 @@ def base_contest_ranking_list(contest, problems, queryset, is_scoreboard_frozen,
         for participation in participations]
 
 def contest_ranking_list(contest, problems, is_scoreboard_frozen, is_show_full_scoreboard=False):
-    if is_scoreboard_frozen:
-        return base_contest_ranking_list(contest, problems, contest.users.filter(virtual=0, user__is_unlisted=False)
-                                     .order_by('-frozen_score', 'frozen_cumtime'),
-                                     is_scoreboard_frozen=is_scoreboard_frozen,
-                                     is_show_full_scoreboard=is_show_full_scoreboard)
-
-
-    return base_contest_ranking_list(contest, problems, contest.users.filter(virtual=0, user__is_unlisted=False)
-                                     .order_by('-score', 'cumtime'),
-                                     is_scoreboard_frozen=is_scoreboard_frozen,
-                                     is_show_full_scoreboard=is_show_full_scoreboard)
+    return get_contest_scoreboard(contest, problems, is_scoreboard_frozen=is_scoreboard_frozen,
+                                  is_show_full_scoreboard=is_show_full_scoreboard)
 
 
 def get_contest_ranking_list(request, contest, participation=None, ranking_list=contest_ranking_list,
@@ -180,7 +180,7 @@ class ProblemDetail(ProblemMixin, SolvedProblemMixin, CommentedDetailView):
                                                   get_contest_submission_count(self.object.code, user.profile,
                                                                                user.profile.current_contest.virtual), 0)
 
-        context['available_judges'] = Judge.objects.filter(online=True, problems=self.object)
+        context['available_judges'] = Judge.get_online_for_problem(self.object.id)
         context['show_languages'] = self.object.allowed_languages.count() != Language.objects.count()
         context['has_pdf_render'] = HAS_PDF
         context['completed_problem_ids'] = self.get_completed_problems()
@@ -576,6 +576,10 @@ def problem_submit(request, problem=None, submission=None):
                 else:
                     model = form.save()
 
+                # Stored so that the bridge does not count earlier submissions every time this one is judged.
+                model.attempt_no = model.get_attempt_no()
+                model.save(update_fields=['attempt_no'])
+
                 # Create the SubmissionSource object
                 source = SubmissionSource(submission=model, source=form.cleaned_data['source'])
                 source.save()
@@ -1,21 +1,39 @@
 from collections import defaultdict
 from functools import partial
 
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import render
 from django.utils import six
 from django.utils.translation import gettext as _
 from packaging import version
 
+from judge.bridge.writebuffer import JudgeStatusBuffer
 from judge.models import Judge, Language, RuntimeVersion
 
 __all__ = ['status_all', 'status_table']
 
 
+def with_live_status(judges):
+    # The bridge publishes the latest ping and load of its judges, which it only writes to the database periodically.
+    judges = list(judges)
+    shards = range(len(getattr(settings, 'BRIDGED_SHARDS', None) or ()))
+    keys = [JudgeStatusBuffer.shard_cache_key(shard) for shard in [None, *shards]]
+    status = {}
+    for snapshot in cache.get_many(keys).values():
+        status.update(snapshot)
+    if status:
+        for judge in judges:
+            if judge.online and judge.name in status:
+                judge.ping, judge.load = status[judge.name]
+    return judges
+
+
 def get_judges(request):
     if request.user.is_superuser or request.user.is_staff:
-        return True, Judge.objects.order_by('-online', 'name')
+        return True, with_live_status(Judge.objects.order_by('-online', 'name'))
     else:
-        return False, Judge.objects.filter(online=True)
+        return False, with_live_status(Judge.objects.filter(online=True))
 
 
 def status_all(request):
@@ -21,7 +21,8 @@ from preferences import preferences
 from judge import event_poster as event
 from judge.highlight_code import highlight_code
 from judge.models import Contest, Language, Problem, ProblemTranslation, Profile, Submission
-from judge.utils.problems import get_result_data, user_authored_ids, user_completed_ids, user_editable_ids
+from judge.utils.problems import get_result_data, get_scope_result_data, user_authored_ids, user_completed_ids, \
+    user_editable_ids
 from judge.utils.raw_sql import use_straight_join
 from judge.utils.views import DiggPaginatorMixin, TitleMixin
 
@@ -173,7 +174,18 @@ class SubmissionsListBase(DiggPaginatorMixin, TitleMixin, ListView):
             category['name'] = _(category['name'])
         return result
 
+    def get_result_scope(self):
+        """
+        The SubmissionResultCount scope and key holding the result counts of this list before filtering by result,
+        or None if they must be counted from the submissions.
+        """
+        return None
+
     def _get_result_data(self):
+        # A frozen scoreboard hides recent submissions, which the stored counts include.
+        scope = self.get_result_scope() if self.allow_dynamic_update else None
+        if scope is not None:
+            return get_scope_result_data(*scope, results=self.selected_statuses)
         return get_result_data(self.get_queryset().order_by())
 
     def access_check(self, request):
@@ -324,6 +336,15 @@ class AllUserSubmissions(ConditionalUserTabMixin, UserMixin, SubmissionsListBase
         if self.request.user.is_authenticated:
             return reverse('all_user_submissions', kwargs={'user': self.request.user.username})
 
+    def get_result_scope(self):
+        # Others are not shown submissions on private problems or in contests with hidden scoreboards.
+        if self.in_contest or self.selected_languages:
+            return None
+        user = self.request.user
+        if (user.is_authenticated and self.request.profile == self.profile) or \
+                (user.has_perm('judge.see_private_problem') and user.has_perm('judge.see_private_contest')):
+            return 'user', self.profile.id
+
     def get_context_data(self, **kwargs):
         context = super(AllUserSubmissions, self).get_context_data(**kwargs)
         context['dynamic_update'] = self.allow_dynamic_update and context['page_obj'].number == 1
@@ -371,6 +392,14 @@ class ProblemSubmissionsBase(SubmissionsListBase):
     def get_all_submissions_page(self):
         return reverse('chronological_submissions', kwargs={'problem': self.problem.code})
 
+    def get_result_scope(self):
+        if self.in_contest or self.selected_languages:
+            return None
+        if not self.request.user.has_perm('judge.see_private_contest') and \
+                Contest.objects.filter(hide_scoreboard=True, contest_problems__problem=self.problem).exists():
+            return None
+        return 'problem', self.problem.id
+
     def get_context_data(self, **kwargs):
         context = super(ProblemSubmissionsBase, self).get_context_data(**kwargs)
         if self.dynamic_update and self.allow_dynamic_update:
@@ -405,6 +434,9 @@ class UserProblemSubmissions(ConditionalUserTabMixin, UserMixin, ProblemSubmissi
     def get_queryset(self):
         return super(UserProblemSubmissions, self).get_queryset().filter(user_id=self.profile.id)
 
+    def get_result_scope(self):
+        return None
+
     def get_title(self):
         if self.is_own:
             return _("My submissions for %(problem)s") % {'problem': self.problem_name}
@@ -474,8 +506,27 @@ class AllSubmissions(SubmissionsListBase):
         context['stats_update_interval'] = self.stats_update_interval
         return context
 
+    def get_result_scope(self):
+        if self.in_contest:
+            if self.selected_languages or \
+                    (self.contest.hide_scoreboard and self.contest.is_in_contest(self.request.user)):
+                return None
+            return 'contest', self.contest.id
+        # The shared counts include private problems and hidden scoreboards, which others cannot see in the list.
+        user = self.request.user
+        if not (user.has_perm('judge.see_private_problem') and user.has_perm('judge.see_private_contest')):
+            return None
+        if not self.selected_languages:
+            return 'global', 0
+        if len(self.selected_languages) == 1:
+            language = Language.objects.filter(key__in=self.selected_languages).values_list('id', flat=True).first()
+            if language is not None:
+                return 'language', language
+        return None
+
     def _get_result_data(self):
-        if self.in_contest or self.selected_languages or self.selected_statuses:
+        if self.in_contest or self.selected_languages or self.selected_statuses or \
+                not self.allow_dynamic_update or self.get_result_scope() is not None:
             return super(AllSubmissions, self)._get_result_data()
 
         key = 'global_submission_result_data'
@@ -122,6 +122,21 @@ wss_sender.on('connection', function (socket) {
                 id: messages.post(request.channel, request.message)
             };
         },
+        post_batch: function (request) {
+            if (!Array.isArray(request.messages) || !request.messages.every(function (message) {
+                    return message && typeof message.channel == 'string';
+                }))
+                return {
+                    status: 'error',
+                    code: 'invalid-channel'
+                };
+            return {
+                status: 'success',
+                ids: request.messages.map(function (message) {
+                    return messages.post(message.channel, message.message);
+                })
+            };
+        },
         last_msg: function (request) {
             return {
                 status: 'success',